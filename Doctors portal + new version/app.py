@@ -1,19 +1,35 @@
 import os
+import copy
 import json
 import threading
 import re
 from datetime import datetime, timedelta
 from time import sleep, time
-from urllib.request import urlopen, Request
-from urllib.parse import urlencode
-from flask import Flask, request, jsonify, send_from_directory, render_template, Response, redirect, url_for, stream_with_context, session, send_file
+from flask import Flask, request, jsonify, send_from_directory, render_template, Response, redirect, url_for, stream_with_context, session, send_file, has_request_context
+import hmac
 import importlib
+import queue
 import sys
+from functools import wraps
 from collections import deque
+from contextlib import contextmanager, nullcontext
 from io import BytesIO
 from hashlib import sha256
 import csv
 from typing import Optional
+from storage import open_store
+from schedule_index import ScheduleIndex
+from response_cache import ResponseCache
+from event_broker import EventBroker, EventFilter, RESYNC_EVENT, format_sse, parse_last_event_id
+from schedule_parser import XlsxRows, ParseCache, make_doctor_matcher, parse_schedule
+from jobs import JobRunner, JobQueueFull, report_progress
+from name_index import DoctorNameIndex, name_tokens, names_signature
+from telegram_client import TelegramClient, TelegramError
+from log_pipeline import LogPipeline, TAIL_LIMIT
+from json_repository import JsonRepository
+from json_codec import JSONProvider
+from compression import Compressor
+import roster_engine
 
 # Load .env file if present (production-friendly) without hard import dependency
 try:
@@ -39,6 +55,10 @@ PROMO_DIR = os.path.join('uploads', 'doctor_promos')  # Full-screen promotional
 MEDIA_HISTORY_DIR = os.path.join('uploads', 'media_history')  # Archive of all uploaded images
 # New: persistent log file path
 LOG_PATH = os.path.join('data', 'telegram.log')
+# Rotation: new segment past LOG_MAX_BYTES or LOG_MAX_AGE seconds, keep LOG_BACKUPS gzipped ones
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', str(5 * 1024 * 1024)))
+LOG_MAX_AGE = int(os.environ.get('LOG_MAX_AGE', str(7 * 86400)))
+LOG_BACKUPS = int(os.environ.get('LOG_BACKUPS', '10'))
 # New: logo path and in-memory version for cache busting
 LOGO_PATH = os.path.join('static', 'img', 'hulhumale-logo.png')
 _LOGO_VERSION = 0
@@ -53,6 +73,31 @@ CLOSURE_PATTERNS = [
     re.compile(r"\b(hospital\s*closed)\b", re.I),
     re.compile(r"\b(opd\s*is\s*closed)\b", re.I),
 ]
+# Storage backend for doctors/schedule data: 'json' (data/doctors.json, default), 'journal' or 'sqlite'
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', os.path.join('data', 'schedule.db'))
+JOURNAL_PATH = os.environ.get('JOURNAL_PATH', os.path.join('data', 'doctors.journal'))
+JOURNAL_MAX_BYTES = int(os.environ.get('JOURNAL_MAX_BYTES', str(1024 * 1024)))
+JOURNAL_MAX_AGE = int(os.environ.get('JOURNAL_MAX_AGE', '3600'))  # seconds
+# Several server processes sharing data/: file lock + shared version counter + cross-process events
+MULTI_WORKER = os.environ.get('MULTI_WORKER', '').lower() in ('1','true','yes','on')
+LOCK_PATH = os.environ.get('LOCK_PATH', os.path.join('data', 'doctors.lock'))
+VERSION_PATH = os.environ.get('VERSION_PATH', os.path.join('data', 'doctors.version'))
+EVENT_BUS_PATH = os.environ.get('EVENT_BUS_PATH', os.path.join('data', 'events.db'))
+EVENT_BUS_POLL_MS = int(os.environ.get('EVENT_BUS_POLL_MS', '100'))
+# Background jobs (Prefer: respond-async / ?async=1 on the slow admin endpoints)
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_DIR = os.environ.get('JOB_DIR', os.path.join('data', 'jobs'))
+# PR roster solver: default search time per generate call, in seconds (requests may pass time_budget/seed)
+ROSTER_TIME_BUDGET = float(os.environ.get('ROSTER_TIME_BUDGET', '2'))
+# Response compression (gzip, or brotli when installed) for text bodies of at least COMPRESS_MIN_BYTES
+COMPRESS = os.environ.get('COMPRESS', '1').lower() in ('1','true','yes','on')
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', '6'))
+COMPRESS_BR_QUALITY = int(os.environ.get('COMPRESS_BR_QUALITY', '5'))
+_store = open_store(STORAGE_BACKEND, DATA_PATH, CLOSURE_PATH, SQLITE_PATH,
+                    journal_path=JOURNAL_PATH, journal_max_bytes=JOURNAL_MAX_BYTES, journal_max_age=JOURNAL_MAX_AGE,
+                    multi_worker=MULTI_WORKER, lock_path=LOCK_PATH, version_path=VERSION_PATH)
 
  # --- Global configuration variables ---
 ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN') or (getattr(cfg, 'ADMIN_TOKEN', '') if cfg else '')  # legacy token disabled by default
@@ -83,31 +128,17 @@ if val:
 if TELEGRAM_CHAT_ID:
     EXTRA_CHAT_IDS.add(str(TELEGRAM_CHAT_ID))
 
-_recent = []
+_recent = deque(maxlen=200)
+_log_pipeline = LogPipeline(LOG_PATH, max_bytes=LOG_MAX_BYTES, max_age=LOG_MAX_AGE, backups=LOG_BACKUPS)
 
 def log(msg):
+    # Queued: stdout and data/telegram.log are written by the pipeline's listener thread
     ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     txt = f"{ts} [telegram] {msg}"
-    try:
-        print(txt)
-    except Exception:
-        pass
-    try:
-        _recent.append(txt)
-        if len(_recent) > 200:
-            del _recent[:len(_recent)-200]
-    except Exception:
-        pass
-    try:
-        os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
-        with open(LOG_PATH, 'a', encoding='utf-8') as f:
-            f.write(txt + "\n")
-    except Exception:
-        pass
+    _recent.append(txt)
+    _log_pipeline.write(txt)
 
 # --- Settings helpers ---
-_settings_cache = None
-_settings_lock = threading.Lock()
 
 def _default_settings():
     return {
@@ -122,31 +153,19 @@ def _default_settings():
         }
     }
 
+_settings_repo = JsonRepository(SETTINGS_PATH, default=_default_settings,
+                                validate=lambda d: d if isinstance(d, dict) else _default_settings())
+
 def load_settings():
-    global _settings_cache
-    with _settings_lock:
-        if _settings_cache is not None:
-            return _settings_cache
-        try:
-            with open(SETTINGS_PATH, 'r', encoding='utf-8') as f:
-                _settings_cache = json.load(f)
-        except Exception:
-            _settings_cache = _default_settings()
-        return _settings_cache
+    """Current settings, re-read when settings.json changes. Callers that
+    modify the returned dict must pass it to save_settings()."""
+    return _settings_repo.view()
 
 def save_settings(data=None):
-    global _settings_cache
-    with _settings_lock:
-        if data is not None:
-            _settings_cache = data
-        else:
-            data = _settings_cache or _default_settings()
-        os.makedirs(os.path.dirname(SETTINGS_PATH), exist_ok=True)
-        tmp = SETTINGS_PATH + '.tmp'
-        with open(tmp, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2)
-        os.replace(tmp, SETTINGS_PATH)
-        return data
+    if data is None:
+        data = _settings_repo.view()
+    _settings_repo.save(data)
+    return data
 
 # --- Telegram polling state & helpers (relocated after globals) ---
 _telegram_thread = None
@@ -155,6 +174,25 @@ _telegram_running = False
 _telegram_offset = 0
 _telegram_fail_streak = 0  # incremental backoff counter
 _processed_commands = {}  # Track recent commands to prevent duplicates (chat_id -> {command: timestamp})
+# Bot API base URL (point at fake_telegram_api.py for local testing)
+TELEGRAM_API_BASE = os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org')
+_telegram_api = None
+# 'poll' (getUpdates long polling, default) or 'webhook' (Telegram pushes to /telegram/webhook)
+TELEGRAM_MODE = (os.environ.get('TELEGRAM_MODE') or 'poll').strip().lower()
+TELEGRAM_WEBHOOK_URL = _clean_env(os.environ.get('TELEGRAM_WEBHOOK_URL'))  # public https URL of /telegram/webhook
+TELEGRAM_WEBHOOK_SECRET = _clean_env(os.environ.get('TELEGRAM_WEBHOOK_SECRET'))
+_telegram_inbox = queue.Queue(maxsize=1000)  # webhook updates waiting for the worker
+_telegram_seen_ids = deque(maxlen=2000)  # recently processed update ids
+
+def _telegram_client() -> TelegramClient:
+    """Keep-alive Bot API client for the current token (recreated if it changes)."""
+    global _telegram_api
+    with _telegram_lock:
+        if _telegram_api is None or _telegram_api.token != TELEGRAM_TOKEN:
+            if _telegram_api is not None:
+                _telegram_api.close()
+            _telegram_api = TelegramClient(TELEGRAM_TOKEN, TELEGRAM_API_BASE, log=log)
+        return _telegram_api
 
 
 def maybe_start_telegram():
@@ -198,20 +236,96 @@ def maybe_start_telegram():
         if _telegram_thread and _telegram_thread.is_alive():
             return
         _telegram_running = True
-        _telegram_thread = threading.Thread(target=_telegram_loop, name="telegram-poll", daemon=True)
+        _telegram_thread = _new_telegram_thread()
         _telegram_thread.start()
 
 
+def _new_telegram_thread() -> threading.Thread:
+    """Poll thread, or the webhook queue worker when TELEGRAM_MODE=webhook."""
+    if TELEGRAM_MODE == 'webhook':
+        return threading.Thread(target=_telegram_webhook_worker, name="telegram-webhook", daemon=True)
+    return threading.Thread(target=_telegram_loop, name="telegram-poll", daemon=True)
+
+
+def _telegram_worker_active() -> bool:
+    """True when the bot is enabled and configured and its thread is running."""
+    return bool(ENABLE_TELEGRAM and TELEGRAM_TOKEN and _telegram_running
+                and _telegram_thread is not None and _telegram_thread.is_alive())
+
+
+def _process_telegram_updates(updates) -> int:
+    """Apply one batch of updates (a getUpdates response or what the webhook queued).
+    Schedule changes are saved and published once, after the last message;
+    each message is still processed and logged on its own. Returns messages handled."""
+    global _telegram_offset
+    with batched_schedule_writes() as batch:
+        for upd in updates:
+            upid = upd.get('update_id', 0)
+            if upid in _telegram_seen_ids or (TELEGRAM_MODE != 'webhook' and upid <= _telegram_offset):
+                # Already processed (duplicate delivery) – skip
+                continue
+            # Webhook deliveries can arrive out of order, so duplicates are
+            # recognised by id rather than by the offset alone
+            _telegram_seen_ids.append(upid)
+            _telegram_offset = max(_telegram_offset, upid)
+            msg = upd.get('message') or upd.get('channel_post') or {}
+            if not msg:
+                continue
+            chat_id = str((msg.get('chat') or {}).get('id', ''))
+            text = msg.get('text') or msg.get('caption') or ''
+            if not text:
+                continue
+            if not ACCEPT_ANY_CHAT and EXTRA_CHAT_IDS and (chat_id not in EXTRA_CHAT_IDS):
+                continue  # ignore unauthorized chats
+            batch.messages += 1
+            try:
+                process_telegram_message(text, chat_id)
+            except Exception as e:
+                log(f"msg error: {e}")
+    if batch.saved:
+        log(f"batch of {batch.messages} messages: saved {batch.saved} schedule changes once")
+    return batch.messages
+
+
+def _telegram_webhook_worker():
+    """Webhook mode: register the webhook, then drain the inbox in batches."""
+    log("telegram webhook worker started")
+    if TELEGRAM_WEBHOOK_URL:
+        try:
+            _telegram_client().call('setWebhook', {
+                'url': TELEGRAM_WEBHOOK_URL, 'secret_token': TELEGRAM_WEBHOOK_SECRET,
+                'allowed_updates': json.dumps(['message', 'channel_post'])})
+            log(f"webhook registered: {TELEGRAM_WEBHOOK_URL}")
+        except Exception as e:
+            log(f"setWebhook failed: {e}")
+    while _telegram_running:
+        try:
+            first = _telegram_inbox.get(timeout=1.0)
+        except queue.Empty:
+            continue
+        updates = [first]
+        while len(updates) < 100:
+            try:
+                updates.append(_telegram_inbox.get_nowait())
+            except queue.Empty:
+                break
+        updates.sort(key=lambda u: u.get('update_id', 0))
+        try:
+            _process_telegram_updates(updates)
+        except Exception as e:
+            log(f"webhook batch error: {e}")
+
+
 def _telegram_loop():
     """Background loop performing getUpdates long polling and dispatching messages.
     Enhanced: richer logging, 409 conflict mitigation, adaptive backoff, periodic webhook delete retry.
     """
-    global _telegram_running, _telegram_offset, _telegram_fail_streak
-    base = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}"
+    global _telegram_running, _telegram_fail_streak
+    client = _telegram_client()
     log("telegram poll thread started")
     # Ensure webhook removed (once now, periodically later)
     try:
-        urlopen(f"{base}/deleteWebhook")
+        client.delete_webhook()
     except Exception:
         pass
     import random, time as _t
@@ -220,30 +334,20 @@ def _telegram_loop():
     while _telegram_running and TELEGRAM_TOKEN:
         if _t.time() - last_webhook_clear > 600:  # every 10 minutes
             try:
-                urlopen(f"{base}/deleteWebhook")
+                client.delete_webhook()
                 last_webhook_clear = _t.time()
             except Exception:
                 pass
         try:
-            # Always send offset = last_seen + 1 per Telegram docs (omit if zero)
-            params = {'timeout': 25}
-            if _telegram_offset:
-                params['offset'] = _telegram_offset + 1
-            # Could scope updates in future: params['allowed_updates'] = json.dumps(['message','channel_post'])
-            query = urlencode(params)
-            url = f"{base}/getUpdates?{query}"
-            with urlopen(Request(url, headers={'User-Agent':'schedule-bot'}), timeout=35) as resp:
-                raw = resp.read().decode('utf-8', errors='replace')
+            # Always send offset = last_seen + 1 per Telegram docs (omit if zero);
+            # the long poll reuses one keep-alive connection
             try:
-                data = json.loads(raw)
-            except Exception as je:
-                _telegram_fail_streak += 1
-                log(f"json decode error: {je}; raw(trunc)={raw[:120]!r}")
-                sleep(min(30, 2 + _telegram_fail_streak))
-                continue
-            if not data.get('ok'):
+                data = client.get_updates(_telegram_offset + 1 if _telegram_offset else None, timeout=25)
+            except TelegramError as te:
+                if te.code == 409:
+                    raise
                 _telegram_fail_streak += 1
-                log(f"api not ok: {data}")
+                log(f"api not ok: {te}")
                 sleep(min(30, 2 + _telegram_fail_streak))
                 continue
             # Success path resets fail streak & 409 counter
@@ -252,27 +356,10 @@ def _telegram_loop():
             updates = data.get('result', []) or []
             if updates:
                 log(f"fetched {len(updates)} updates (offset now {updates[-1].get('update_id')})")
-            got_any = False
-            for upd in updates:
-                got_any = True
-                upid = upd.get('update_id', 0)
-                if upid <= _telegram_offset:
-                    # Already processed (duplicate delivery) – skip
-                    continue
-                _telegram_offset = upid
-                msg = upd.get('message') or upd.get('channel_post') or {}
-                if not msg:
-                    continue
-                chat_id = str((msg.get('chat') or {}).get('id', ''))
-                text = msg.get('text') or msg.get('caption') or ''
-                if not text:
-                    continue
-                if not ACCEPT_ANY_CHAT and EXTRA_CHAT_IDS and (chat_id not in EXTRA_CHAT_IDS):
-                    continue  # ignore unauthorized chats
-                try:
-                    process_telegram_message(text, chat_id)
-                except Exception as e:
-                    log(f"msg error: {e}")
+            got_any = bool(updates)
+            if updates:
+                # One working copy per getUpdates response
+                _process_telegram_updates(updates)
             # If no updates returned, jitter sleep avoids tight loop
             if not got_any:
                 sleep(0.9 + random.uniform(0, 0.9))
@@ -285,7 +372,7 @@ def _telegram_loop():
                     log(f"409 conflict (#{consecutive_409}) – fast retry")
                 # Aggressively clear webhook every 10th 409
                 if consecutive_409 % 10 == 0:
-                    try: urlopen(f"{base}/deleteWebhook"); last_webhook_clear = _t.time()
+                    try: client.delete_webhook(); last_webhook_clear = _t.time()
                     except Exception: pass
                 sleep(1.2)
                 continue
@@ -306,14 +393,42 @@ def _telegram_status():
     return {
         'enabled': bool(enabled),
         'running': _telegram_thread.is_alive() if _telegram_thread else False,
+        'mode': TELEGRAM_MODE,
         'offset': _telegram_offset,
-        'fail_streak': _telegram_fail_streak
+        'fail_streak': _telegram_fail_streak,
+        'webhook_queue': _telegram_inbox.qsize()
     }
 
 # Ensure Flask app exists before applying route decorators
 if 'app' not in globals():
     app = Flask(__name__)
     app.secret_key = SECRET_KEY
+# orjson-backed jsonify()/request.json when available
+app.json = JSONProvider(app)
+
+@app.post('/telegram/webhook')
+def telegram_webhook():
+    """Webhook mode: Telegram POSTs each update here with the secret given to
+    setWebhook. Updates are queued for the worker thread; reply 200 at once so
+    Telegram doesn't retry."""
+    if TELEGRAM_MODE != 'webhook' or not TELEGRAM_WEBHOOK_SECRET:
+        return jsonify({'ok': False, 'error': 'webhook disabled'}), 404
+    token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(token.encode('utf-8'), TELEGRAM_WEBHOOK_SECRET.encode('utf-8')):
+        return jsonify({'ok': False, 'error': 'forbidden'}), 403
+    if not _telegram_worker_active():
+        # Bot disabled or not configured but the webhook is still registered:
+        # a 200 would drop the update, a 503 makes Telegram keep and resend it
+        return jsonify({'ok': False, 'error': 'bot not running'}), 503
+    update = request.get_json(silent=True)
+    if not isinstance(update, dict) or 'update_id' not in update:
+        return jsonify({'ok': False, 'error': 'update expected'}), 400
+    try:
+        _telegram_inbox.put_nowait(update)
+    except queue.Full:
+        # Non-2xx: Telegram keeps the update and delivers it again later
+        return jsonify({'ok': False, 'error': 'busy'}), 503
+    return jsonify({'ok': True})
 
 # ---- Patient display settings API ----
 @app.get('/api/patient_display/settings')
@@ -358,21 +473,20 @@ def api_update_patient_display_settings():
     exclusive_multi = as_bool(data.get('exclusive_multirow_specialty'), False)
     per_spec = as_bool(data.get('per_specialty_slides'), False)
     flat_mode = as_bool(data.get('flat_mode'), False)
-    s = load_settings()
-    if 'patient_display' not in s:
-        s['patient_display'] = {}
-    s['patient_display']['rotate_ms'] = rotate_ms
-    s['patient_display']['show_room'] = show_room
-    s['patient_display']['show_breaks'] = show_breaks
-    s['patient_display']['show_start_time'] = show_start_time
-    s['patient_display']['exclusive_multirow_specialty'] = exclusive_multi
-    s['patient_display']['per_specialty_slides'] = per_spec
-    s['patient_display']['flat_mode'] = flat_mode
-    if display_resolution is not None:
-        s['patient_display']['display_resolution'] = display_resolution
-    if fill_mode is not None:
-        s['patient_display']['fill_mode'] = fill_mode
-    save_settings(s)
+    with _settings_repo.edit() as s:
+        if 'patient_display' not in s:
+            s['patient_display'] = {}
+        s['patient_display']['rotate_ms'] = rotate_ms
+        s['patient_display']['show_room'] = show_room
+        s['patient_display']['show_breaks'] = show_breaks
+        s['patient_display']['show_start_time'] = show_start_time
+        s['patient_display']['exclusive_multirow_specialty'] = exclusive_multi
+        s['patient_display']['per_specialty_slides'] = per_spec
+        s['patient_display']['flat_mode'] = flat_mode
+        if display_resolution is not None:
+            s['patient_display']['display_resolution'] = display_resolution
+        if fill_mode is not None:
+            s['patient_display']['fill_mode'] = fill_mode
     try:
         broker.publish_event('patient_display_settings', s['patient_display'])
     except Exception:
@@ -603,6 +717,59 @@ def api_schedule_template():
         bio = BytesIO('\n'.join(lines).encode('utf-8'))
         return send_file(bio, as_attachment=True, download_name='template.csv', mimetype='text/csv')
 
+# -------------- Background jobs --------------
+
+# No job_update broadcast: /events is public and a job belongs to one user.
+# Clients poll the 202 response's Location (/api/jobs/<id>), which checks the owner.
+jobs = JobRunner(JOB_DIR, max_workers=JOB_WORKERS)
+
+def _wants_async() -> bool:
+    prefer = [p.strip().lower() for p in request.headers.get('Prefer', '').split(',')]
+    return 'respond-async' in prefer or (request.args.get('async') or '').lower() in ('1', 'true', 'yes')
+
+def runs_as_job(kind: str):
+    """Let a slow POST endpoint run in the background when the client asks for it.
+    The view is replayed on a job thread inside a copy of the request (same body
+    and session cookie); the 202 response carries the job id to poll."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.environ.get('schedule.job') or not _wants_async() or not session.get('user'):
+                return view(*args, **kwargs)
+            body = request.get_data(cache=True)
+            environ = {k: v for k, v in request.environ.items() if not k.startswith(('werkzeug.', 'schedule.'))}
+            environ.update({'wsgi.input': BytesIO(body), 'CONTENT_LENGTH': str(len(body)), 'schedule.job': True})
+            def run():
+                with app.request_context(environ):
+                    resp = app.make_response(view(*args, **kwargs))
+                    return resp.status_code, resp.get_json(silent=True)
+            try:
+                job = jobs.submit(kind, run, owner=(session.get('user') or {}).get('username'))
+            except JobQueueFull:
+                return jsonify({'ok': False, 'error': 'too many background jobs, try again shortly'}), 503
+            status_url = url_for('api_job_status', job_id=job['id'])
+            resp = jsonify({'ok': True, 'job': job, 'status_url': status_url})
+            resp.status_code = 202
+            resp.headers['Location'] = status_url
+            resp.headers['Preference-Applied'] = 'respond-async'
+            return resp
+        return wrapper
+    return decorator
+
+@app.get('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    """Status, progress and (when finished) the endpoint's JSON response of a background job.
+    Only the user who started the job (or an admin) can see it."""
+    user = session.get('user')
+    if not user:
+        return jsonify({'ok': False, 'error': 'auth required'}), 401
+    job = jobs.get(job_id)
+    is_admin = (user.get('role') or '').upper() == ROLE_ADMIN
+    if job is None or (not is_admin and job.get('owner') != user.get('username')):
+        # 404 either way: don't confirm that someone else's job id exists
+        return jsonify({'ok': False, 'error': 'job not found'}), 404
+    return jsonify({'ok': True, 'job': job})
+
 @app.post('/api/schedule/bulk_excel')
 def api_schedule_bulk_excel():
     """Upload an Excel (.xlsx) with rows: Date, Doctor, Start Time, Room, Total Patients,
@@ -617,212 +784,38 @@ def api_schedule_bulk_excel():
     if not f.filename:
         return jsonify({'ok': False, 'error': 'empty filename'}), 400
     try:
-        from openpyxl import load_workbook
+        import openpyxl
     except Exception:
         return jsonify({'ok': False, 'error': 'openpyxl not installed'}), 500
 
-    # Helpers
-    def _cell_str(v):
-        if v is None:
-            return ''
-        if isinstance(v, (int, float)):
-            # Excel times sometimes come as floats; we'll ignore here
-            return str(v)
-        return str(v).strip()
-
-    def _parse_date(v) -> Optional[str]:
-        from datetime import datetime, date
-        if v is None:
-            return None
-        if isinstance(v, datetime):
-            return v.date().isoformat()
-        if isinstance(v, date):
-            return v.isoformat()
-        s = _cell_str(v)
-        if not s:
-            return None
-        # try ISO first
-        try:
-            return datetime.strptime(s, '%Y-%m-%d').date().isoformat()
-        except Exception:
-            pass
-        # try dd/mm/yyyy
-        try:
-            d, m, y = s.replace('.', '/').replace('-', '/').split('/')
-            return f"{int(y):04d}-{int(m):02d}-{int(d):02d}"
-        except Exception:
-            return None
-
-    def _parse_breaks(v):
-        s = _cell_str(v)
-        if not s:
-            return None
-        items = [p.strip() for p in s.split(',') if p.strip()]
-        return items or None
-
-    def _extract_time_and_count(v):
-        s = _cell_str(v)
-        if not s:
-            return (None, None)
-        # Find first time range like HH:MM(:SS)?-HH:MM(:SS)?
-        m = re.search(r'(\d{1,2}:\d{2}(?::\d{2})?)\s*-\s*(\d{1,2}:\d{2}(?::\d{2})?)', s)
-        time_txt = None
-        rest = s
-        if m:
-            a, b = m.group(1), m.group(2)
-            def norm(t):
-                mm = re.match(r'^(\d{1,2}):(\d{2})', t)
-                return f"{int(mm.group(1)):02d}:{mm.group(2)}" if mm else t
-            time_txt = f"{norm(a)}-{norm(b)}"
-            # Remove matched range for number search
-            rest = (s[:m.start()] + ' ' + s[m.end():]).strip()
-        # Find an integer not part of the time
-        m2 = re.findall(r'\b\d{1,3}\b', rest)
-        count = int(m2[-1]) if m2 else None
-        return (time_txt, count)
-
-    def _match_doctor(name: str, doctors: list):
-        toks = set(name_tokens(name))
-        if not toks:
-            return None
-        best = None; score = 0
-        for d in doctors:
-            dt = set(name_tokens(d.get('name','')))
-            if dt and dt.issubset(toks) and len(dt) > score:
-                best = d; score = len(dt)
-        return best
-
-    # Load workbook
+    data = load_data()
+    doc_list = data.get('doctors', [])
+    # Parse workbook (rows are streamed, see schedule_parser)
     try:
-        bio = BytesIO(f.read())
-        wb = load_workbook(bio, data_only=True)
-        ws = wb.active
+        records = parse_schedule(XlsxRows(BytesIO(f.read())), make_doctor_matcher(doctor_name_index(doc_list), doc_list),
+                                 _load_shift_knowledge_safe())
     except Exception as e:
         return jsonify({'ok': False, 'error': f'failed to read xlsx: {e}'}), 400
 
-    # Map headers
-    headers = {}
-    first = True
+    by_id = {str(d.get('id')): d for d in doc_list}
     applied = 0
+    changes = []
     errors = []
-    data = load_data()
-    doc_list = data.get('doctors', [])
-    for i, row in enumerate(ws.iter_rows(values_only=True), start=1):
-        if first:
-            first = False
-            for idx, h in enumerate(row):
-                key = _cell_str(h).lower()
-                headers[key] = idx
-            continue
-        def col(name):
-            idx = headers.get(name)
-            if idx is None:
-                return None
-            try:
-                return row[idx]
-            except Exception:
-                return None
-        date_iso = _parse_date(col('date'))
-        doc_name = _cell_str(col('doctor'))
-        if not date_iso or not doc_name:
-            # Allow empty rows
-            continue
+    for rec in records:
         # Exclude Fridays (auto-closed): ignore rows for Fridays
-        try:
-            if datetime.strptime(date_iso, '%Y-%m-%d').date().weekday() == 4:
-                errors.append({'row': i, 'error': 'Friday is auto-closed; row ignored', 'doctor': doc_name})
-                continue
-        except Exception:
-            pass
-        doc = _match_doctor(doc_name, doc_list)
-        if not doc:
-            errors.append({'row': i, 'error': 'doctor not found', 'doctor': doc_name})
+        if datetime.strptime(rec.date, '%Y-%m-%d').date().weekday() == 4:
+            errors.append({'row': rec.row, 'error': 'Friday is auto-closed; row ignored', 'doctor': rec.doctor_name})
             continue
-        patch = {}
-        st = _cell_str(col('start time'))
-        if st:
-            patch['start_time'] = st
-            patch['status'] = 'ON_DUTY'
-        rm = _cell_str(col('room'))
-        if rm:
-            patch['room'] = rm
-        tot = _cell_str(col('total patients'))
-        if tot:
-            try: patch['patient_count'] = int(float(tot))
-            except Exception: pass
-        breaks_accum = []
-        bb_raw = _cell_str(col('before break opd patients')) or _cell_str(col('before break opd patients (time/pts)'))
-        if bb_raw:
-            rng, cnt = _extract_time_and_count(bb_raw)
-            if cnt is not None:
-                try: patch['before_break_opd_patients'] = int(float(cnt))
-                except Exception: pass
-            if rng:
-                breaks_accum.append(rng)
-        br = _parse_breaks(col('breaks'))
-        if br:
-            # Check for "NO BREAK" explicitly
-            if any(re.search(r'no\s*break', b, re.I) for b in br):
-                patch['breaks'] = ['NO BREAK']
-                breaks_accum = []  # explicit override
-            else:
-                patch['breaks'] = br
-        ab_raw = _cell_str(col('after break opd patients')) or _cell_str(col('after break opd patients (time/pts)'))
-        if ab_raw:
-            rng, cnt = _extract_time_and_count(ab_raw)
-            if cnt is not None:
-                try: patch['after_break_opd_patients'] = int(float(cnt))
-                except Exception: pass
-            if rng:
-                breaks_accum.append(rng)
-        if breaks_accum and patch.get('breaks') != ['NO BREAK']:
-            # Merge with parsed breaks (if any) and de-dup
-            existing = set(patch.get('breaks') or [])
-            for r in breaks_accum:
-                if r not in existing:
-                    existing.add(r)
-            if existing:
-                patch['breaks'] = list(existing)
-        
-        # NEW: Status column (H) - special duty status markers
-        status_val = _cell_str(col('status')).upper()
-        if status_val:
-            if status_val in ('ON/CALL', 'ON CALL', 'ONCALL', 'ON-CALL'):
-                patch['status'] = 'ON_CALL'
-                # ON_CALL can have OPD if other fields provided
-            elif status_val in ('POST ON/CALL', 'POST ONCALL', 'POST ON CALL', 'POST-ONCALL', 'POST-ON-CALL'):
-                patch['status'] = 'ON_DUTY'
-                patch['post_oncall'] = True
-                # Can have OPD details
-            elif status_val == 'OFF':
-                patch['status'] = 'OFF_DUTY'
-                # Clear OPD fields for OFF status - doctor is not working
-                patch['start_time'] = None
-                patch['room'] = None
-                patch['patient_count'] = None
-                patch['before_break_opd_patients'] = None
-                patch['after_break_opd_patients'] = None
-                patch['breaks'] = None
-        
-        # If either before or after patient count is missing (empty cell), default to 0
-        # This prevents the "no patient" issue when cells are left empty
-        # BUT: only if status is not OFF_DUTY
-        if 'start_time' in patch and 'patient_count' not in patch and patch.get('status') != 'OFF_DUTY':
-            # If start time exists but counts are missing, set defaults
-            if 'before_break_opd_patients' not in patch:
-                patch['before_break_opd_patients'] = 0
-            if 'after_break_opd_patients' not in patch:
-                patch['after_break_opd_patients'] = 0
-        if not patch:
+        doc = by_id.get(str(rec.doctor_id)) if rec.doctor_id is not None else None
+        if not doc:
+            errors.append({'row': rec.row, 'error': 'doctor not found', 'doctor': rec.doctor_name})
             continue
-        if apply_single_day_update(doc, date_iso, patch):
+        if rec.patch and apply_single_day_update(doc, rec.date, copy.deepcopy(rec.patch)):
             applied += 1
+            changes.append((doc, rec.date))
     if applied:
-        save_data(data)
-        try:
-            broker.publish_event('doctor_update', {'bulk': True})
-        except Exception:
-            pass
+        versions = save_day_updates(data, changes)
+        publish_bulk_doctor_updates(changes, versions)
     return jsonify({'ok': True, 'applied': applied, 'errors': errors})
 
 # ==================== NEW 2-STAGE EXCEL UPLOAD SYSTEM ====================
@@ -947,6 +940,7 @@ def api_schedule_delete_excel():
         return jsonify({'ok': False, 'error': 'file not found'}), 404
     try:
         os.remove(filepath)
+        _excel_parse_cache.discard(filepath)
         return jsonify({'ok': True, 'deleted': filename})
     except Exception as e:
         return jsonify({'ok': False, 'error': f'failed to delete: {e}'}), 500
@@ -971,325 +965,31 @@ def api_schedule_preview_excel():
         return jsonify({'ok': False, 'error': 'File not found'}), 404
     
     try:
-        from openpyxl import load_workbook
-        from datetime import datetime, date
+        import openpyxl
     except Exception:
         return jsonify({'ok': False, 'error': 'openpyxl not installed'}), 500
     
-    def _cell_str(v):
-        if v is None: return ''
-        return str(v).strip()
-    
-    def _parse_date(v):
-        import re
-        if v is None: return None
-        if isinstance(v, datetime): return v.date().isoformat()
-        if isinstance(v, date): return v.isoformat()
-        s = _cell_str(v)
-        if not s: return None
-        try:
-            return datetime.strptime(s, '%Y-%m-%d').date().isoformat()
-        except:
-            pass
-        # Try to find a date anywhere in the string (handles e.g. "2nd Sunday 2025 02/11/2025")
-        m = re.search(r'(\d{4})[./-](\d{1,2})[./-](\d{1,2})', s)
-        if m:
-            y, mo, d = map(int, m.groups())
-            return f"{y:04d}-{mo:02d}-{d:02d}"
-        m = re.search(r'(\d{1,2})[./-](\d{1,2})[./-](\d{2,4})', s)
-        if m:
-            d, mo, y = m.groups()
-            y = int(y)
-            if y < 100: y += 2000
-            return f"{y:04d}-{int(mo):02d}-{int(d):02d}"
-        return None
-    
+    data_all = load_data()
+    doc_list = data_all.get('doctors', [])
     try:
-        wb = load_workbook(filepath, data_only=True)
-        ws = wb.active
-        print(f"DEBUG Preview: Loaded workbook with {ws.max_row} rows and {ws.max_column} columns")
-        # Print first few rows for debugging
-        for i, row in enumerate(ws.iter_rows(values_only=True), start=1):
-            if i <= 5:
-                print(f"DEBUG Row {i}: {[_cell_str(v) for v in row]}")
+        records = _parse_stored_schedule(filepath, doc_list)
     except Exception as e:
         print(f"ERROR Preview: Failed to read file: {str(e)}")
         return jsonify({'ok': False, 'error': f'Failed to read file: {str(e)}'}), 400
+    if not records:
+        print("ERROR: No valid schedule data found in file")
+        return jsonify({'ok': False, 'error': 'No valid schedule data found in file'}), 400
     
-    # Parse file and collect statistics
-    headers = {}
-    first = True
+    # Collect statistics. For the richer preview, map matched system doctor -> per-date state:
+    # ADDED (has schedule details), OFF (explicit off), EMPTY (row present but no details), MISSING (no row for that date)
     date_range = set()
     doctor_stats = {}
-    total_rows = 0
-    # For richer preview: map matched system doctor -> per-date status
-    # States: ADDED (has schedule details), OFF (explicit off), EMPTY (row present but no details), MISSING (no row for that date)
-    data_all = load_data()
-    doc_list = data_all.get('doctors', [])
-
-    def _match_doctor(name: str, doctors: list):
-        toks = set(name_tokens(name))
-        if not toks:
-            return None
-        best = None; score = 0
-        for d in doctors:
-            dt = set(name_tokens(d.get('name','')))
-            if dt and dt.issubset(toks) and len(dt) > score:
-                best = d; score = len(dt)
-        return best
-
     per_doc_date = {}  # id -> { date_iso: state }
-    
-    # Header normalization map
-    def norm_key(k: str) -> str:
-        k = (k or '').strip().lower()
-        aliases = {
-            'doctor name': 'doctor', 'name': 'doctor', 'dr': 'doctor', 'dr.': 'doctor',
-            'physician': 'doctor', 'doctor/physician': 'doctor',
-            'starting time': 'start time', 'start': 'start time', 'starttime': 'start time',
-            'room no': 'room', 'room number': 'room',
-            'total no of patients': 'total patients', 'total patients': 'total patients', 'total': 'total patients',
-            # Support both old combined format and new separate columns
-            'before break opd patients (time/pts)': 'before break opd patients combined',
-            'before break opd timing': 'before break opd timing',
-            'before break opd patients': 'before break opd patients',
-            'before break patients': 'before break opd patients',
-            'after break opd patients (time/pts)': 'after break opd patients combined',
-            'after break opd timing': 'after break opd timing',
-            'after break opd patients': 'after break opd patients',
-            'after break patients': 'after break opd patients',
-            # New modern template columns
-            'shift': 'shift',
-            'specialty': 'specialty', 'speciality': 'specialty', 'department': 'specialty', 'dept': 'specialty',
-        }
-        return aliases.get(k, k)
-
-    # Try to find header row (might not be first row)
-    header_row_index = None
-    # Load shift knowledge once
-    shift_knowledge = {}
-    try:
-        shift_knowledge = load_shift_knowledge()
-    except Exception:
-        shift_knowledge = {}
-
-    def _find_specialty_match(spec_val: str) -> str:
-        if not spec_val:
-            return None
-        s = spec_val.strip().lower()
-        for k in shift_knowledge.keys():
-            if k.strip().lower() == s:
-                return k
-        return spec_val  # return as-is if not found; caller will still try
-
-    def _apply_shift_defaults(patch: dict, spec: str, shift_name: str):
-        if not shift_name:
-            return
-        s_key = _find_specialty_match(spec or '') if spec else None
-        if not s_key:
-            return
-        spec_data = shift_knowledge.get(s_key) or {}
-        sh = (shift_name or '').strip() or ''
-        defaults = spec_data.get(sh)
-        if not isinstance(defaults, dict):
-            return
-        applied_any = False
-        # Start time
-        if 'start_time' not in patch and defaults.get('start'):
-            patch['start_time'] = defaults.get('start')
-            applied_any = True
-        # Before/After patients
-        if 'before_break_opd_patients' not in patch and defaults.get('before_patients') not in (None, ''):
-            try:
-                patch['before_break_opd_patients'] = int(defaults.get('before_patients'))
-            except Exception:
-                pass
-            else:
-                applied_any = True
-        if 'after_break_opd_patients' not in patch and defaults.get('after_patients') not in (None, ''):
-            try:
-                patch['after_break_opd_patients'] = int(defaults.get('after_patients'))
-            except Exception:
-                pass
-            else:
-                applied_any = True
-        # Breaks/timings bucket
-        if 'breaks' not in patch:
-            accum = []
-            bt = (defaults.get('before_timing') or '').strip()
-            if bt:
-                accum.append(bt)
-            brk = (defaults.get('breaks') or '').strip()
-            if brk:
-                accum.append(brk)
-            at = (defaults.get('after_timing') or '').strip()
-            if at:
-                accum.append(at)
-            if accum:
-                patch['breaks'] = accum
-                applied_any = True
-        # Total patients if not set
-        if 'patient_count' not in patch:
-            tp = defaults.get('total_patients')
-            if tp not in (None, ''):
-                try:
-                    patch['patient_count'] = int(tp)
-                    applied_any = True
-                except Exception:
-                    pass
-            else:
-                # compute from before/after if both available
-                bp = patch.get('before_break_opd_patients')
-                ap = patch.get('after_break_opd_patients')
-                if isinstance(bp, int) and isinstance(ap, int):
-                    patch['patient_count'] = bp + ap
-                    applied_any = True
-        if applied_any and patch.get('status') not in ('OFF_DUTY', 'ON_CALL'):
-            patch['status'] = 'ON_DUTY'
-
-    for i, row in enumerate(ws.iter_rows(values_only=True), start=1):
-        row_vals = [_cell_str(v).lower() for v in row]
-        # Check if this row contains key headers
-        if any('doctor' in val or 'physician' in val or 'dr.' in val for val in row_vals):
-            # This looks like a header row
-            header_row_index = i
-            print(f"DEBUG: Found header row at index {i}")
-            for idx, h in enumerate(row):
-                key = norm_key(_cell_str(h))
-                if key:
-                    headers[key] = idx
-            print(f"DEBUG: Headers found: {headers}")
-            break
-    
-    # If we found headers, parse data rows
-    if headers and 'doctor' in headers:
-        for i, row in enumerate(ws.iter_rows(values_only=True), start=1):
-            # Skip until after header row
-            if header_row_index and i <= header_row_index:
-                continue
-            
-            def col(name):
-                idx = headers.get(name)
-                if idx is None: return None
-                try: return row[idx]
-                except: return None
-            
-            date_iso = _parse_date(col('date'))
-            doc_name = _cell_str(col('doctor'))
-            
-            if not date_iso or not doc_name:
-                continue
-            
-            date_range.add(date_iso)
-            if doc_name not in doctor_stats:
-                doctor_stats[doc_name] = 0
-            doctor_stats[doc_name] += 1
-            total_rows += 1
-
-            # Determine row state
-            st_txt = _cell_str(col('start time'))
-            bb_t = _cell_str(col('before break opd timing'))
-            ab_t = _cell_str(col('after break opd timing'))
-            status_val = (_cell_str(col('status')) or '').strip().upper()
-            if status_val == 'OFF':
-                state = 'OFF'
-            elif st_txt or bb_t or ab_t:
-                state = 'ADDED'
-            else:
-                state = 'EMPTY'
-            match = _match_doctor(doc_name, doc_list)
-            if match:
-                dd = per_doc_date.setdefault(match.get('id') or match.get('name'), {})
-                dd[date_iso] = state
-    
-    # If the simple column-based parse found nothing, try "grouped" template parsing
-    if not total_rows:
-        print("DEBUG: No rows found in column-based parse, trying grouped template...")
-        current_date = None
-        header_map = None
-
-        def build_header_map(row_vals):
-            m = {}
-            for idx, val in enumerate(row_vals):
-                k = norm_key(_cell_str(val))
-                if k:
-                    m[k] = idx
-            return m if ('doctor' in m) else None
-
-        for i, row in enumerate(ws.iter_rows(values_only=True), start=1):
-            row_vals = [_cell_str(v) for v in row]
-            if not any(row_vals):
-                continue
-            
-            # First check if this is a header row before checking for dates
-            if not header_map:
-                hm = build_header_map(row_vals)
-                if hm:
-                    header_map = hm
-                    print(f"DEBUG: Found header map at line {i}: {header_map}")
-                    continue
-            
-            # If we have a header_map, try to process this as a data row first
-            if current_date and header_map and len(row_vals) > header_map.get('doctor', -1):
-                doc_name = row_vals[header_map['doctor']] if header_map.get('doctor', -1) < len(row_vals) else None
-                doc_name = _cell_str(doc_name)
-                
-                # If there's a doctor name, this is a data row
-                if doc_name and len(doc_name) > 0:
-                    # Extract date from this row if 'date' column exists
-                    row_date = None
-                    if 'date' in header_map and header_map['date'] < len(row_vals):
-                        row_date = _parse_date(row_vals[header_map['date']])
-                    
-                    # Use row date if available, otherwise use current_date
-                    use_date = row_date if row_date else current_date
-                    
-                    if use_date:
-                        total_rows += 1
-                        date_range.add(use_date)
-                        doctor_stats[doc_name] = doctor_stats.get(doc_name, 0) + 1
-                        print(f"DEBUG: Data row {i}: doctor={doc_name}, date={use_date}")
-
-                        # Determine state using available columns
-                        def get_col(k):
-                            j = header_map.get(k); return row_vals[j] if (j is not None and j < len(row_vals)) else ''
-                        st_txt = _cell_str(get_col('start time'))
-                        before_t = _cell_str(get_col('before break opd timing'))
-                        after_t = _cell_str(get_col('after break opd timing'))
-                        status_val = (_cell_str(get_col('status')) or '').strip().upper()
-                        if status_val == 'OFF':
-                            state = 'OFF'
-                        elif st_txt or before_t or after_t:
-                            state = 'ADDED'
-                        else:
-                            state = 'EMPTY'
-                        match = _match_doctor(doc_name, doc_list)
-                        if match:
-                            dd = per_doc_date.setdefault(match.get('id') or match.get('name'), {})
-                            dd[use_date] = state
-                    continue
-            
-            # Detect a date declaration row (standalone date rows)
-            # These typically have few non-empty cells and no doctor name
-            non_empty = sum(1 for v in row_vals if v)
-            det_date = None
-            
-            # Only treat as date declaration if it has <= 3 non-empty cells
-            if non_empty <= 3:
-                for v in row_vals:
-                    iso = _parse_date(v)
-                    if iso:
-                        det_date = iso
-                        break
-                if det_date:
-                    current_date = det_date
-                    print(f"DEBUG: Found date declaration row at line {i}: {current_date}")
-                    header_map = None  # Reset header to look for new one
-                    continue
-        print(f"DEBUG: Grouped template found {total_rows} rows")
-        if not total_rows:
-            print("ERROR: No valid schedule data found in file after both parsing methods")
-            return jsonify({'ok': False, 'error': 'No valid schedule data found in file'}), 400
+    for rec in records:
+        date_range.add(rec.date)
+        doctor_stats[rec.doctor_name] = doctor_stats.get(rec.doctor_name, 0) + 1
+        if rec.doctor_id is not None:
+            per_doc_date.setdefault(rec.doctor_id, {})[rec.date] = rec.state
     
     sorted_dates = sorted(list(date_range))
     date_range_str = f"{sorted_dates[0]} to {sorted_dates[-1]}" if sorted_dates else "Unknown"
@@ -1297,15 +997,14 @@ def api_schedule_preview_excel():
     doctor_matrix = []
     if sorted_dates:
         for d in doc_list:
-            key = d.get('id') or d.get('name')
-            per = per_doc_date.get(key, {})
+            per = per_doc_date.get(d.get('id'), {})
             states = [ per.get(dt, 'MISSING') for dt in sorted_dates ]
             doctor_matrix.append({'name': d.get('name'), 'specialty': d.get('specialty'), 'states': states})
     
     return jsonify({
         'ok': True,
         'filename': filename,
-        'total_schedules': total_rows,
+        'total_schedules': len(records),
         'unique_doctors': len(doctor_stats),
         'date_range': date_range_str,
         'dates_count': len(date_range),
@@ -1318,6 +1017,7 @@ def api_schedule_preview_excel():
     })
 
 @app.post('/api/schedule/apply_excel')
+@runs_as_job('apply_excel')
 def api_schedule_apply_excel():
     """Stage 2b: Actually process and apply the Excel file to database."""
     if not session.get('user'):
@@ -1336,443 +1036,37 @@ def api_schedule_apply_excel():
         return jsonify({'ok': False, 'error': 'File not found'}), 404
     
     try:
-        from openpyxl import load_workbook
-        from datetime import datetime, date
+        import openpyxl
     except Exception:
         return jsonify({'ok': False, 'error': 'openpyxl not installed'}), 500
     
-    def _cell_str(v):
-        if v is None: return ''
-        if isinstance(v, (int, float)): return str(v)
-        return str(v).strip()
-    
-    def _parse_date(v):
-        import re
-        if v is None: return None
-        if isinstance(v, datetime): return v.date().isoformat()
-        if isinstance(v, date): return v.isoformat()
-        s = _cell_str(v)
-        if not s: return None
-        try:
-            return datetime.strptime(s, '%Y-%m-%d').date().isoformat()
-        except:
-            pass
-        # Search for dates embedded in strings
-        m = re.search(r'(\d{4})[./-](\d{1,2})[./-](\d{1,2})', s)
-        if m:
-            y, mo, d = map(int, m.groups())
-            return f"{y:04d}-{mo:02d}-{d:02d}"
-        m = re.search(r'(\d{1,2})[./-](\d{1,2})[./-](\d{2,4})', s)
-        if m:
-            d, mo, y = m.groups()
-            y = int(y)
-            if y < 100: y += 2000
-            return f"{y:04d}-{int(mo):02d}-{int(d):02d}"
-        return None
-    
-    def _parse_breaks(v):
-        s = _cell_str(v)
-        if not s: return None
-        items = [p.strip() for p in s.split(',') if p.strip()]
-        return items or None
-    def _extract_time_and_count(v):
-        s = _cell_str(v)
-        if not s:
-            return (None, None)
-        m = re.search(r'(\d{1,2}:\d{2}(?::\d{2})?)\s*-\s*(\d{1,2}:\d{2}(?::\d{2})?)', s)
-        time_txt = None
-        rest = s
-        if m:
-            a, b = m.group(1), m.group(2)
-            def norm(t):
-                mm = re.match(r'^(\d{1,2}):(\d{2})', t)
-                return f"{int(mm.group(1)):02d}:{mm.group(2)}" if mm else t
-            time_txt = f"{norm(a)}-{norm(b)}"
-            rest = (s[:m.start()] + ' ' + s[m.end():]).strip()
-        m2 = re.findall(r'\b\d{1,3}\b', rest)
-        count = int(m2[-1]) if m2 else None
-        return (time_txt, count)
-    
-    def _match_doctor(name: str, doctors: list):
-        toks = set(name_tokens(name))
-        if not toks: return None
-        best = None; score = 0
-        for d in doctors:
-            dt = set(name_tokens(d.get('name','')))
-            if dt and dt.issubset(toks) and len(dt) > score:
-                best = d; score = len(dt)
-        return best
-    
+    data = load_data()
+    doc_list = data.get('doctors', [])
+    # Usually already parsed by the preview step
     try:
-        wb = load_workbook(filepath, data_only=True)
-        ws = wb.active
+        records = _parse_stored_schedule(filepath, doc_list)
     except Exception as e:
         return jsonify({'ok': False, 'error': f'Failed to read file: {str(e)}'}), 400
     
-    # Process file and apply schedules
-    headers = {}
-    first = True
+    by_id = {str(d.get('id')): d for d in doc_list}
     applied = 0
+    changes = []
     errors = []
-    data = load_data()
-    doc_list = data.get('doctors', [])
-    
-    def norm_key(k: str) -> str:
-        k = (k or '').strip().lower()
-        aliases = {
-            'doctor name': 'doctor', 'name': 'doctor', 'dr': 'doctor', 'dr.': 'doctor',
-            'physician': 'doctor', 'doctor/physician': 'doctor',
-            'starting time': 'start time', 'start': 'start time', 'starttime': 'start time',
-            'room no': 'room', 'room number': 'room',
-            'total no of patients': 'total patients', 'total patients': 'total patients', 'total': 'total patients',
-            # Support both old combined format and new separate columns
-            'before break opd patients (time/pts)': 'before break opd patients combined',
-            'before break opd timing': 'before break opd timing',
-            'before break opd patients': 'before break opd patients',
-            'before break patients': 'before break opd patients',
-            'after break opd patients (time/pts)': 'after break opd patients combined',
-            'after break opd timing': 'after break opd timing',
-            'after break opd patients': 'after break opd patients',
-            'after break patients': 'after break opd patients',
-            # New modern template columns
-            'shift': 'shift',
-            'specialty': 'specialty', 'speciality': 'specialty', 'department': 'specialty', 'dept': 'specialty',
-        }
-        return aliases.get(k, k)
-
-    # Load shift knowledge and helpers (used to fill missing fields when Shift is selected)
-    shift_knowledge = {}
-    try:
-        shift_knowledge = load_shift_knowledge()
-    except Exception:
-        shift_knowledge = {}
-
-    def _find_specialty_match(spec_val: str) -> str:
-        if not spec_val:
-            return None
-        s = spec_val.strip().lower()
-        for k in shift_knowledge.keys():
-            if k.strip().lower() == s:
-                return k
-        return spec_val
-
-    def _apply_shift_defaults(patch: dict, spec: str, shift_name: str):
-        if not shift_name:
-            return
-        s_key = _find_specialty_match(spec or '') if spec else None
-        if not s_key:
-            return
-        spec_data = shift_knowledge.get(s_key) or {}
-        sh = (shift_name or '').strip() or ''
-        defaults = spec_data.get(sh)
-        if not isinstance(defaults, dict):
-            return
-        applied_any = False
-        if 'start_time' not in patch and defaults.get('start'):
-            patch['start_time'] = defaults.get('start')
-            applied_any = True
-        if 'before_break_opd_patients' not in patch and defaults.get('before_patients') not in (None, ''):
-            try:
-                patch['before_break_opd_patients'] = int(defaults.get('before_patients'))
-            except Exception:
-                pass
-            else:
-                applied_any = True
-        if 'after_break_opd_patients' not in patch and defaults.get('after_patients') not in (None, ''):
-            try:
-                patch['after_break_opd_patients'] = int(defaults.get('after_patients'))
-            except Exception:
-                pass
-            else:
-                applied_any = True
-        if 'breaks' not in patch:
-            accum = []
-            bt = (defaults.get('before_timing') or '').strip()
-            if bt:
-                accum.append(bt)
-            brk = (defaults.get('breaks') or '').strip()
-            if brk:
-                accum.append(brk)
-            at = (defaults.get('after_timing') or '').strip()
-            if at:
-                accum.append(at)
-            if accum:
-                patch['breaks'] = accum
-                applied_any = True
-        if 'patient_count' not in patch:
-            tp = defaults.get('total_patients')
-            if tp not in (None, ''):
-                try:
-                    patch['patient_count'] = int(tp)
-                    applied_any = True
-                except Exception:
-                    pass
-            else:
-                bp = patch.get('before_break_opd_patients')
-                ap = patch.get('after_break_opd_patients')
-                if isinstance(bp, int) and isinstance(ap, int):
-                    patch['patient_count'] = bp + ap
-                    applied_any = True
-        if applied_any and patch.get('status') not in ('OFF_DUTY', 'ON_CALL'):
-            patch['status'] = 'ON_DUTY'
-
-    for i, row in enumerate(ws.iter_rows(values_only=True), start=1):
-        if first:
-            first = False
-            for idx, h in enumerate(row):
-                key = norm_key(_cell_str(h))
-                headers[key] = idx
-            continue
-        
-        def col(name):
-            idx = headers.get(name)
-            if idx is None: return None
-            try: return row[idx]
-            except: return None
-        
-        date_iso = _parse_date(col('date'))
-        doc_name = _cell_str(col('doctor'))
-        
-        if not date_iso or not doc_name:
-            continue
-        
-        doc = _match_doctor(doc_name, doc_list)
+    for n, rec in enumerate(records):
+        if n % 200 == 0:
+            report_progress(n / (len(records) + 1), f'{n}/{len(records)} rows')
+        doc = by_id.get(str(rec.doctor_id)) if rec.doctor_id is not None else None
         if not doc:
-            errors.append(f"Row {i}: Doctor '{doc_name}' not found")
-            continue
-        
-        patch = {}
-        st = _cell_str(col('start time'))
-        if st: patch['start_time'] = st
-        rm = _cell_str(col('room'))
-        if rm: patch['room'] = rm
-        tp = _cell_str(col('total patients'))
-        if tp:
-            try: patch['patient_count'] = int(float(tp))
-            except: pass
-        breaks_accum = []
-        bb_raw = _cell_str(col('before break opd patients')) or _cell_str(col('before break opd patients (time/pts)'))
-        if bb_raw:
-            rng, cnt = _extract_time_and_count(bb_raw)
-            if cnt is not None:
-                try: patch['before_break_opd_patients'] = int(float(cnt))
-                except: pass
-            if rng: breaks_accum.append(rng)
-        br = _parse_breaks(col('breaks'))
-        if br:
-            if any(re.search(r'no\s*break', b, re.I) for b in br):
-                patch['breaks'] = ['NO BREAK']; breaks_accum = []
-            else:
-                patch['breaks'] = br
-        ab_raw = _cell_str(col('after break opd patients')) or _cell_str(col('after break opd patients (time/pts)'))
-        if ab_raw:
-            rng, cnt = _extract_time_and_count(ab_raw)
-            if cnt is not None:
-                try: patch['after_break_opd_patients'] = int(float(cnt))
-                except: pass
-            if rng: breaks_accum.append(rng)
-        if breaks_accum and patch.get('breaks') != ['NO BREAK']:
-            existing = set(patch.get('breaks') or [])
-            for r in breaks_accum:
-                if r not in existing:
-                    existing.add(r)
-            if existing:
-                patch['breaks'] = list(existing)
-
-        # Apply shift defaults if provided and fields are missing
-        shift_val = _cell_str(col('shift'))
-        spec_val = _cell_str(col('specialty')) or (doc.get('specialty') if isinstance(doc, dict) else None)
-        if shift_val:
-            _apply_shift_defaults(patch, spec_val, shift_val)
-        
-        if not patch:
+            errors.append(f"Row {rec.row}: Doctor '{rec.doctor_name}' not found")
             continue
-        
-        if apply_single_day_update(doc, date_iso, patch):
+        # Copy: the cached parse must not share lists with the stored schedule
+        if rec.patch and apply_single_day_update(doc, rec.date, copy.deepcopy(rec.patch)):
             applied += 1
-    
-    # If nothing applied with simple column-based approach, try grouped template parsing
-    if applied == 0:
-        current_date = None
-        header_map = None
-
-        def build_header_map(row_vals):
-            m = {}
-            for idx, val in enumerate(row_vals):
-                k = norm_key(_cell_str(val))
-                if k:
-                    m[k] = idx
-            return m if ('doctor' in m) else None
-
-        for i, row in enumerate(ws.iter_rows(values_only=True), start=1):
-            row_vals = [_cell_str(v) for v in row]
-            if not any(row_vals):
-                continue
-            
-            # First check if this is a header row
-            if not header_map:
-                hm = build_header_map(row_vals)
-                if hm:
-                    header_map = hm
-                    print(f"DEBUG Apply: Found header map at line {i}: {header_map}")
-                    continue
-            
-            # Try to process as data row first (if we have header_map and current_date)
-            if current_date and header_map:
-                d_idx = header_map.get('doctor')
-                if d_idx is not None and d_idx < len(row_vals):
-                    doc_name = _cell_str(row_vals[d_idx])
-                    
-                    # Skip section header rows (where doctor column just says "Doctor")
-                    if doc_name and doc_name.lower() == 'doctor':
-                        continue
-                    
-                    # If there's a doctor name, this is a data row - process it
-                    if doc_name and len(doc_name) > 0:
-                        doc = None
-                        # approximate match
-                        try:
-                            doc = _match_doctor(doc_name, doc_list)
-                        except Exception:
-                            doc = None
-                        if not doc:
-                            errors.append(f"Row {i}: Doctor '{doc_name}' not found")
-                            continue
-                        
-                        # Extract date from this row if 'date' column exists
-                        row_date = None
-                        if 'date' in header_map and header_map['date'] < len(row_vals):
-                            row_date = _parse_date(row_vals[header_map['date']])
-                        
-                        # Use row date if available, otherwise use current_date
-                        use_date = row_date if row_date else current_date
-                        
-                        patch = {}
-                        # Helper getter
-                        def get_col(key):
-                            j = header_map.get(key)
-                            return row_vals[j] if j is not None and j < len(row_vals) else ''
-                        st = _cell_str(get_col('start time'))
-                        if st:
-                            patch['start_time'] = st
-                            patch['status'] = 'ON_DUTY'
-                        rm = _cell_str(get_col('room'))
-                        if rm:
-                            patch['room'] = rm
-                        tp = _cell_str(get_col('total patients'))
-                        if tp:
-                            try:
-                                patch['patient_count'] = int(float(tp))
-                            except:
-                                pass
-                        breaks_accum = []
-                        # Check for separate timing and patient columns first (new format)
-                        before_timing = _cell_str(get_col('before break opd timing'))
-                        before_patients = _cell_str(get_col('before break opd patients'))
-                        
-                        # If separate columns exist, use them
-                        if before_timing or before_patients:
-                            if before_patients:
-                                try: 
-                                    patch['before_break_opd_patients'] = int(float(before_patients))
-                                except: 
-                                    pass
-                            if before_timing:
-                                breaks_accum.append(before_timing)
-                        else:
-                            # Fall back to old combined format
-                            bb = _cell_str(get_col('before break opd patients combined'))
-                            if bb:
-                                rng, cnt = _extract_time_and_count(bb)
-                                if cnt is not None:
-                                    try: patch['before_break_opd_patients'] = int(float(cnt))
-                                    except: pass
-                                if rng: breaks_accum.append(rng)
-                        
-                        br = _parse_breaks(get_col('breaks'))
-                        if br:
-                            if any(re.search(r'no\s*break', b, re.I) for b in br):
-                                patch['breaks'] = ['NO BREAK']; breaks_accum = []
-                            else:
-                                patch['breaks'] = br
-                        
-                        # Check for separate after break columns (new format)
-                        after_timing = _cell_str(get_col('after break opd timing'))
-                        after_patients = _cell_str(get_col('after break opd patients'))
-                        
-                        if after_timing or after_patients:
-                            if after_patients:
-                                try: 
-                                    patch['after_break_opd_patients'] = int(float(after_patients))
-                                except: 
-                                    pass
-                            if after_timing:
-                                breaks_accum.append(after_timing)
-                        else:
-                            # Fall back to old combined format
-                            ab = _cell_str(get_col('after break opd patients combined'))
-                            if ab:
-                                rng, cnt = _extract_time_and_count(ab)
-                                if cnt is not None:
-                                    try: patch['after_break_opd_patients'] = int(float(cnt))
-                                    except: pass
-                                if rng: breaks_accum.append(rng)
-                        if breaks_accum and patch.get('breaks') != ['NO BREAK']:
-                            existing = set(patch.get('breaks') or [])
-                            for r in breaks_accum:
-                                if r not in existing:
-                                    existing.add(r)
-                            if existing:
-                                patch['breaks'] = list(existing)
-                        # Apply shift defaults if provided and fields are missing
-                        shift_val = _cell_str(get_col('shift'))
-                        spec_val = _cell_str(get_col('specialty')) or (doc.get('specialty') if isinstance(doc, dict) else None)
-                        if shift_val:
-                            _apply_shift_defaults(patch, spec_val, shift_val)
-                        status_val = _cell_str(get_col('status')).upper()
-                        if status_val:
-                            if status_val in ('ON/CALL','ON CALL','ONCALL','ON-CALL'):
-                                patch['status'] = 'ON_CALL'
-                            elif status_val in ('POST ON/CALL','POST ONCALL','POST ON CALL','POST-ONCALL','POST-ON-CALL'):
-                                patch['status'] = 'ON_DUTY'
-                                patch['post_oncall'] = True
-                            elif status_val == 'OFF':
-                                patch['status'] = 'OFF_DUTY'
-                                patch['start_time'] = None
-                                patch['room'] = None
-                                patch['patient_count'] = None
-                                patch['before_break_opd_patients'] = None
-                                patch['after_break_opd_patients'] = None
-                                patch['breaks'] = None
-                        if patch:
-                            if apply_single_day_update(doc, use_date, patch):
-                                applied += 1
-                                print(f"DEBUG Apply: Applied schedule for {doc_name} on {use_date}")
-                        continue  # Processed as data row, skip date detection
-            
-            # Detect a date declaration row (only if not a data row)
-            non_empty = sum(1 for v in row_vals if v)
-            det_date = None
-            
-            # Only treat as date declaration if it has <= 3 non-empty cells
-            if non_empty <= 3:
-                for v in row_vals:
-                    iso = _parse_date(v)
-                    if iso:
-                        det_date = iso
-                        break
-                if det_date:
-                    current_date = det_date
-                    print(f"DEBUG Apply: Found date declaration row at line {i}: {current_date}")
-                    header_map = None  # Reset header to look for new one
-                    continue
+            changes.append((doc, rec.date))
 
     if applied:
-        save_data(data)
-        try:
-            broker.publish_event('doctor_update', {'bulk': True})
-        except:
-            pass
+        versions = save_day_updates(data, changes)
+        publish_bulk_doctor_updates(changes, versions)
     
     return jsonify({
         'ok': True,
@@ -1797,22 +1091,35 @@ def _safe_under_root(relpath: str) -> str:
     return target
 
 # ---------------- Shift Knowledge Management APIs -----------------
-def _shift_knowledge_path():
-    return os.path.join('data','shift_knowledge.json')
+SHIFT_KNOWLEDGE_PATH = os.path.join('data', 'shift_knowledge.json')
+_shift_knowledge_repo = JsonRepository(SHIFT_KNOWLEDGE_PATH)
 
 def load_shift_knowledge():
-    path = _shift_knowledge_path()
+    return _shift_knowledge_repo.load()
+
+def _load_shift_knowledge_safe():
     try:
-        with open(path,'r',encoding='utf-8') as f:
-            return json.load(f)
+        return load_shift_knowledge()
     except Exception:
         return {}
 
+# Parsed stored uploads, shared by preview_excel and apply_excel
+_excel_parse_cache = ParseCache()
+
+def _parse_stored_schedule(filepath: str, doc_list: list):
+    """ScheduleRecords for an uploaded workbook, parsed once per file content.
+    A parse also depends on doctor names/specialties (matching, shift defaults)
+    and the shift templates, so those are part of the cache key; editing the
+    doctor list invalidates every cached parse."""
+    shift_knowledge = _load_shift_knowledge_safe()
+    context = (tuple((str(d.get('id')), d.get('name'), d.get('specialty')) for d in doc_list),
+               json.dumps(shift_knowledge, sort_keys=True))
+    return _excel_parse_cache.get_or_parse(
+        filepath, context,
+        lambda: parse_schedule(XlsxRows(filepath), make_doctor_matcher(doctor_name_index(doc_list), doc_list), shift_knowledge))
+
 def save_shift_knowledge(data_obj):
-    path = _shift_knowledge_path()
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path,'w',encoding='utf-8') as f:
-        json.dump(data_obj, f, indent=2, ensure_ascii=False)
+    _shift_knowledge_repo.save(data_obj)
 
 @app.get('/api/shift_knowledge')
 def api_get_shift_knowledge():
@@ -1858,6 +1165,8 @@ def api_files_list():
     items = []
     try:
         for name in os.listdir(base):
+            if name.startswith('.'):
+                continue  # parse-cache sidecars and other hidden files
             p = os.path.join(base, name)
             try:
                 st = os.stat(p)
@@ -1910,6 +1219,7 @@ def api_files_delete():
                 os.rmdir(p)
         elif os.path.isfile(p):
             os.remove(p)
+            _excel_parse_cache.discard(p)
         else:
             return jsonify({'ok': False, 'error': 'not found'}), 404
         return jsonify({'ok': True, 'deleted': rel})
@@ -1930,6 +1240,8 @@ def api_files_rename():
         parent = os.path.dirname(src)
         dst = _safe_under_root(os.path.relpath(os.path.join(parent, new_name), _sched_root()))
         os.rename(src, dst)
+        if os.path.isfile(dst):
+            _excel_parse_cache.move(src, dst)
         return jsonify({'ok': True, 'renamed': rel, 'to': os.path.relpath(dst, _sched_root()).replace('\\','/')})
     except Exception as e:
         return jsonify({'ok': False, 'error': str(e)}), 400
@@ -1970,6 +1282,8 @@ def api_files_move():
         # Move the file/folder
         import shutil
         shutil.move(src, dst)
+        if os.path.isfile(dst):
+            _excel_parse_cache.move(src, dst)
         
         # Return the new relative path
         new_path = os.path.relpath(dst, _sched_root()).replace('\\', '/')
@@ -2010,29 +1324,18 @@ def api_telegram_restart():
             _telegram_running = False  # signal old loop to exit
         # start fresh
         _telegram_running = True
-        _telegram_thread = threading.Thread(target=_telegram_loop, name="telegram-poll", daemon=True)
+        _telegram_thread = _new_telegram_thread()
         _telegram_thread.start()
     return jsonify({'ok': True, 'restarted': True, 'status': _telegram_status()})
 
 
 def _send_telegram_message(chat_id: str, text: str, parse_mode: str = None):
-    """Send a message to a Telegram chat."""
+    """Queue a message to a Telegram chat (sent by the client's rate-limited
+    sender thread, so a slow send never holds up polling)."""
     if not TELEGRAM_TOKEN:
         return False
     try:
-        base = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}"
-        payload = {
-            'chat_id': chat_id,
-            'text': text
-        }
-        if parse_mode:
-            payload['parse_mode'] = parse_mode
-        
-        data = urlencode(payload).encode('utf-8')
-        req = Request(f"{base}/sendMessage", data=data, headers={'Content-Type': 'application/x-www-form-urlencoded'})
-        with urlopen(req, timeout=10) as resp:
-            result = json.loads(resp.read().decode('utf-8'))
-            return result.get('ok', False)
+        return _telegram_client().send_message(chat_id, text, parse_mode)
     except Exception as e:
         log(f"send message error: {e}")
         return False
@@ -2285,8 +1588,8 @@ def process_telegram_message(text: str, chat_id: str):
     parse_time_fn = g.get('parse_time_from_text')
     load_data_fn = g.get('load_data')
     apply_day_fn = g.get('apply_single_day_update')
-    save_data_fn = g.get('save_data')
-    broker_obj = g.get('broker')
+    save_days_fn = g.get('save_day_updates')
+    publish_fn = g.get('publish_doctor_update')
 
     status = parse_status_fn(t_low) if parse_status_fn else None
     rich = parse_rich_fn(text, status) if parse_rich_fn else {}
@@ -2310,10 +1613,9 @@ def process_telegram_message(text: str, chat_id: str):
         if d.get('id') == doc.get('id'):
             doc = d; break
     if apply_day_fn(doc, date_iso, patch):
-        if save_data_fn:
-            save_data_fn(data)
-        if broker_obj:
-            broker_obj.publish_event('doctor_update', {'doctor_id': doc.get('id'), 'date': date_iso})
+        versions = save_days_fn(data, [(doc, date_iso)]) if save_days_fn else None
+        if publish_fn:
+            publish_fn(doc, date_iso, versions)
         log(f"updated {doc.get('name')} {date_iso}: {list(patch.keys())}")
 def _process_rich_multiline_message(text: str) -> bool:
     """Parse rich multi-line Telegram messages for schedule updates.
@@ -2371,23 +1673,14 @@ def _process_rich_multiline_message(text: str) -> bool:
     if not doc_name:
         return False
     data = load_data()
+    names = doctor_name_index(data['doctors'])
     # Exact match first
-    doc = next((d for d in data['doctors'] if d['name'].lower() == doc_name.lower()), None)
+    doc = names.match_exact(doc_name, data['doctors'])
     # Fuzzy / partial token match (handles 'Dr. Asish' vs 'Dr. Asish Rajak')
     if not doc:
-        name_tokens_fn = globals().get('name_tokens')
-        tokens = set(name_tokens_fn(doc_name)) if name_tokens_fn else set(t.lower() for t in re.findall(r"[A-Za-z']+", doc_name) if len(t)>1)
-        best = None; best_score = 0.0
-        for d in data['doctors']:
-            d_tokens = set(name_tokens_fn(d['name'])) if name_tokens_fn else set(t.lower() for t in re.findall(r"[A-Za-z']+", d['name']) if len(t)>1)
-            if not d_tokens: continue
-            inter = tokens & d_tokens
-            if not inter: continue
-            # score: overlap over smaller set size so 'Asish' perfectly matches first name
-            score = len(inter) / max(1, min(len(tokens), len(d_tokens)))
-            # Prefer higher score; tie-break shorter levenshtein distance (optional simple length diff) / more tokens
-            if score > best_score:
-                best_score = score; best = d
+        tokens = set(name_tokens(doc_name))
+        # score: overlap over smaller set size so 'Asish' perfectly matches first name
+        best, best_score = names.best_overlap(doc_name, data['doctors'])
         # Accept if at least half tokens overlap or full first token match
         if best and (best_score >= 0.5 or any(best['name'].lower().startswith(t) for t in tokens)):
             doc = best
@@ -2641,23 +1934,17 @@ def _process_rich_multiline_message(text: str) -> bool:
         return False
     
     # Apply update to all dates in range
-    any_success = False
+    applied_dates = []
     for target_date in dates_to_apply:
         if apply_single_day_update(doc, target_date, patch.copy()):
-            any_success = True
-            # Publish SSE event for each date
-            try:
-                if 'broker' in globals():
-                    broker.publish_event('doctor_update', {
-                        'doctor_id': doc.get('id'),
-                        'date': target_date,
-                        'doctor': hydrate_doctor_for_date(doc, target_date)
-                    })
-            except Exception:
-                pass
+            applied_dates.append(target_date)
+    any_success = bool(applied_dates)
     
     if any_success:
-        save_data(data)
+        versions = save_day_updates(data, [(doc, d) for d in applied_dates])
+        # Publish SSE event for each date (after saving, with the delta row)
+        for target_date in applied_dates:
+            publish_doctor_update(doc, target_date, versions)
         date_desc = f"{dates_to_apply[0]} to {dates_to_apply[-1]}" if len(dates_to_apply) > 1 else dates_to_apply[0]
         log(f"rich multiline updated {doc.get('name')} {date_desc}: {list(patch.keys())}")
         return True
@@ -2666,59 +1953,11 @@ def _process_rich_multiline_message(text: str) -> bool:
 
 
 def _match_doctor_by_text(text: str):
-    import re, difflib, unicodedata
-    g = globals(); name_tokens_fn = g.get('name_tokens'); load_data_fn = g.get('load_data')
-    def norm(s: str) -> str:
-        if not s:
-            return ''
-        s = unicodedata.normalize('NFKD', s)
-        s = ''.join(ch for ch in s if not unicodedata.combining(ch))
-        s = s.lower()
-        s = re.sub(r"(?i)\b(dr|mr|mrs|ms|prof)\.?\b", " ", s)
-        s = re.sub(r"[^a-z0-9\s]", " ", s)
-        s = re.sub(r"\s+", " ", s).strip()
-        return s
-    toks = set(name_tokens_fn(text)) if (name_tokens_fn and text) else set()
-    msg_norm = norm(text)
-    if (not toks and not msg_norm) or not load_data_fn:
+    """Best fuzzy match for a free-text message (see DoctorNameIndex.match_text)."""
+    if not text:
         return None
-    data = load_data_fn()
-    best = None; best_score = 0.0
-    for d in data.get('doctors', []):
-        raw_name = d.get('name','') or ''
-        name_norm = norm(raw_name)
-        dtoks = set(name_tokens(raw_name))
-        if not (name_norm or dtoks):
-            continue
-        overlap = toks & dtoks if toks else set()
-        # Base overlap score normalized by doctor's token count (so extra words in message don't punish)
-        base = (len(overlap) / max(1, len(dtoks))) if dtoks else 0.0
-        # Prefix bonus using normalized name without honorifics
-        prefix_bonus = 0.0
-        for t in (toks or {""}):
-            if t and len(t) > 2 and name_norm.startswith(t):
-                prefix_bonus = 0.6
-                break
-        # Keyword / alias bonus
-        kw_bonus = 0.0
-        kws = d.get('keywords') or []
-        for kw in kws:
-            k = norm(str(kw))
-            if not k:
-                continue
-            if (toks and k in toks) or (k and k in msg_norm):
-                kw_bonus = 0.5
-                break
-        # Fuzzy ratio between normalized strings (bounded weight)
-        ratio = difflib.SequenceMatcher(None, name_norm, msg_norm).ratio() if msg_norm and name_norm else 0.0
-        ratio_bonus = 0.35 * ratio
-        score = base + prefix_bonus + kw_bonus + ratio_bonus
-        # Exact subset of doctor's tokens in message strongly boosts
-        if dtoks and dtoks.issubset(toks):
-            score = max(score, 1.0)
-        if score > best_score:
-            best = d; best_score = score
-    return best
+    data = load_data()
+    return doctor_name_index(data.get('doctors', [])).match_text(text, data.get('doctors', []))
 
 
 def _extract_for_date_or_today(text: str) -> str:
@@ -2782,18 +2021,18 @@ def _process_status_only_message(text: str) -> bool:
     if rng:
         days = _expand_date_range(rng[0], rng[1])
     any_changed = False
+    changed_days = []
     for di in days:
         patch = {'status': status}
         if reason:
             patch['status_reason'] = reason if len(days)==1 else f"{reason} ({_fmt_display_dmy(days[0])} till {_fmt_display_dmy(days[-1])})"
         if apply_single_day_update(found, di, patch):
             any_changed = True
-            try:
-                broker.publish_event('doctor_update', {'doctor_id': found.get('id'), 'date': di})
-            except Exception:
-                pass
+            changed_days.append(di)
     if any_changed:
-        save_data(data)
+        versions = save_day_updates(data, [(found, d) for d in changed_days])
+        for di in changed_days:
+            publish_doctor_update(found, di, versions)
         log(f"status-only updated {found.get('name')} {days[0]}..{days[-1]} -> {status}")
         return True
     return False
@@ -2801,19 +2040,13 @@ def _process_status_only_message(text: str) -> bool:
 # Simple closure persistence (date -> list of reasons)
 
 def _load_closures():
-    if not os.path.exists(CLOSURE_PATH):
-        return {}
     try:
-        with open(CLOSURE_PATH,'r',encoding='utf-8') as f:
-            data = json.load(f)
-        return data if isinstance(data, dict) else {}
+        return _store.load_closures()
     except Exception:
         return {}
 
 def _save_closures(data: dict):
-    os.makedirs(os.path.dirname(CLOSURE_PATH), exist_ok=True)
-    with open(CLOSURE_PATH,'w',encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    _store.save_closures(data)
 
 def _apply_closure(date_iso: str, reason: str):
     closures = _load_closures()
@@ -2840,29 +2073,37 @@ def _apply_closure(date_iso: str, reason: str):
 # app.secret_key = SECRET_KEY
 
 # Simple in-memory event broker (SSE)
-class EventBroker:
-    def __init__(self):
-        self.subscribers = []  # list of queues
-        self.lock = threading.Lock()
-    def subscribe(self):
-        q = deque(maxlen=200)
-        with self.lock:
-            self.subscribers.append(q)
-        return q
-    def publish_event(self, event: str, payload):
-        data = json.dumps(payload)
-        with self.lock:
-            dead = []
-            for q in self.subscribers:
-                try:
-                    q.append((event, data))
-                except Exception:
-                    dead.append(q)
-            for q in dead:
-                try: self.subscribers.remove(q)
-                except Exception: pass
-
-broker = EventBroker()
+# Events kept for Last-Event-ID resume of reconnecting /events clients
+SSE_REPLAY_SIZE = int(os.environ.get('SSE_REPLAY_SIZE', '500'))
+# Bursts of doctor_update for the same date within this window go out as one merged event (0 = off)
+SSE_COALESCE_MS = int(os.environ.get('SSE_COALESCE_MS', '150'))
+broker = EventBroker(replay_size=SSE_REPLAY_SIZE, coalesce_ms=SSE_COALESCE_MS)
+# Multi-worker: events go through a shared SQLite table so every worker's streams see them
+_event_bus = None
+if MULTI_WORKER:
+    from event_bus import SqliteEventBus
+    _event_bus = SqliteEventBus(EVENT_BUS_PATH, poll_interval=EVENT_BUS_POLL_MS / 1000.0).start(broker)
+
+# Optional asyncio SSE server so /events streams don't pin WSGI worker threads
+ASYNC_SSE_PORT = int(os.environ.get('ASYNC_SSE_PORT', '0') or 0)  # 0 = serve /events from Flask
+ASYNC_SSE_HOST = os.environ.get('ASYNC_SSE_HOST', '0.0.0.0')
+ASYNC_SSE_PUBLIC_URL = os.environ.get('ASYNC_SSE_PUBLIC_URL', '')  # e.g. https://host/sse/events behind a proxy
+_async_sse = None
+
+def start_async_sse():
+    """Start the asyncio /events server if ASYNC_SSE_PORT is set (idempotent)."""
+    global _async_sse
+    if not ASYNC_SSE_PORT:
+        return None
+    if _async_sse is None:
+        from sse_async import AsyncSSEServer
+        srv = AsyncSSEServer(ASYNC_SSE_HOST, ASYNC_SSE_PORT, broker=broker).start()
+        if srv._loop is None:
+            return None
+        broker.add_listener(srv.publish)
+        _async_sse = srv
+        log(f"async SSE server listening on {ASYNC_SSE_HOST}:{srv.port}")
+    return _async_sse
 
 # --- Timezone & date helpers (Maldives UTC+5) ---
 TZ_OFFSET_MINUTES = 5 * 60  # UTC+5
@@ -2942,6 +2183,7 @@ def apply_single_day_update(doc: dict, date_iso: str, patch: dict) -> bool:
     if changed:
         current['last_update'] = datetime.utcnow().isoformat()+'Z'
         sched_map[date_iso] = current
+        _schedule_index.touch(doc, date_iso)
     return changed
 
 def hydrate_doctor_for_date(doc: dict, date_iso: str):
@@ -3001,7 +2243,9 @@ def _process_shift_style_message(text: str) -> bool:
     if len(raw_lines) <= 1 and not any(k in joined_lower for k in ('shift',' off','leave','sick','on/call','on call')):
         return False
     data = load_data()
+    names = doctor_name_index(data['doctors'])
     changed = False
+    changes = []
     for line in raw_lines:
         low = line.lower()
         status = None
@@ -3017,13 +2261,7 @@ def _process_shift_style_message(text: str) -> bool:
         name_part = parts[0] if parts else line
         name_part = re.sub(r'^dr[.,\s]+', '', name_part, flags=re.I).strip()
         if not name_part: continue
-        tokens = set(name_tokens(name_part))
-        if not tokens: continue
-        match = None; score = 0
-        for d in data['doctors']:
-            dtoks = set(name_tokens(d.get('name','')))
-            if dtoks and dtoks.issubset(tokens) and len(dtoks) > score:
-                match = d; score = len(dtoks)
+        match = names.match_subset(name_part, data['doctors'])
         if not match:
             continue
         patch = {}
@@ -3032,21 +2270,36 @@ def _process_shift_style_message(text: str) -> bool:
         if not patch: continue
         if apply_single_day_update(match, date_iso, patch):
             changed = True
+            changes.append((match, date_iso))
             log(f"shift-style applied {match.get('name')} {date_iso} -> {patch}")
     if changed:
-        save_data(data)
+        versions = save_day_updates(data, changes)
+        for doc, date_iso in changes:
+            publish_doctor_update(doc, date_iso, versions)
     return changed
 
 # --- Helpers added for multi-date schedule support & parsing ---
-# Tokenize doctor name / text for fuzzy matching
-
-def name_tokens(text: str):
-    if not text:
-        return []
-    # Remove honorifics and punctuation, split on non letters
-    text = re.sub(r"(?i)\b(dr|mr|mrs|ms|prof)\.?\b", " ", text)
-    toks = re.findall(r"[A-Za-z']+", text.lower())
-    return [t for t in toks if len(t) > 1]
+# Doctor name matching (name_tokens comes from name_index)
+_name_index = None
+_name_index_lock = threading.Lock()
+
+def doctor_name_index(doctors) -> DoctorNameIndex:
+    """Name index for this doctors list. Checked once per data version and
+    rebuilt only when names/keywords actually changed."""
+    global _name_index
+    version = _data_version
+    idx = _name_index
+    if idx is not None and idx.doctors is doctors and idx.data_version == version:
+        return idx
+    sig = names_signature(doctors)
+    with _name_index_lock:
+        if _name_index is None or _name_index.signature != sig:
+            _name_index = DoctorNameIndex(doctors)
+        else:
+            # Same names (maybe in a reloaded list): positions still line up
+            _name_index.doctors = doctors
+        _name_index.data_version = version
+        return _name_index
 
 # Flexible human date parser (supports '2025-01-31', '31/01/2025', '31-01-2025', '31 Jan 2025', '31st Jan', 'Jan 31', etc.)
 MONTH_MAP = {m.lower(): i for i, m in enumerate(['January','February','March','April','May','June','July','August','September','October','November','December'], start=1)}
@@ -3140,8 +2393,14 @@ def _extract_date_range(text: str):
 
 # Data persistence helpers
 _data_cache = None
-_data_cache_mtime = 0
+_data_cache_sig = None
 _data_lock = threading.Lock()
+# date -> {doctor_id: entry} view of _data_cache for the read endpoints
+_schedule_index = ScheduleIndex()
+# Bumped on every save/reload; serialized read responses are cached per version
+_data_version = 0
+_response_cache = ResponseCache()
+_compressor = Compressor(COMPRESS_MIN_BYTES, COMPRESS_LEVEL, COMPRESS_BR_QUALITY, enabled=COMPRESS)
 
 LEGACY_PER_DATE_FIELDS = ['status','status_reason','start_time','room','patient_count','opd','breaks','designation','before_break_opd_patients','after_break_opd_patients','before_break_opd','after_break_opd']
 
@@ -3166,17 +2425,13 @@ def _migrate_doctor_multidate(doc: dict):
 
 
 def load_data(force=False):
-    global _data_cache, _data_cache_mtime
+    global _data_cache, _data_cache_sig
     with _data_lock:
         try:
-            st = os.stat(DATA_PATH)
-            if (not force) and _data_cache is not None and st.st_mtime == _data_cache_mtime:
+            sig = _store.signature()
+            if (not force) and _data_cache is not None and sig == _data_cache_sig:
                 return _data_cache
-            if not os.path.exists(DATA_PATH):
-                data = {'doctors': []}
-            else:
-                with open(DATA_PATH, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+            data = _store.load()
             # Ensure list structure
             if not isinstance(data, dict):
                 data = {'doctors': []}
@@ -3185,7 +2440,9 @@ def load_data(force=False):
             for d in data['doctors']:
                 _migrate_doctor_multidate(d)
             _data_cache = data
-            _data_cache_mtime = st.st_mtime if os.path.exists(DATA_PATH) else time()
+            _data_cache_sig = sig
+            _bump_data_version()
+            _schedule_index.rebuild(data, version=_store_version())
             return data
         except Exception:
             if _data_cache is None:
@@ -3193,22 +2450,242 @@ def load_data(force=False):
             return _data_cache
 
 
-def save_data(data):
-    if not isinstance(data, dict):
-        return
-    os.makedirs(os.path.dirname(DATA_PATH), exist_ok=True)
-    tmp_path = DATA_PATH + '.tmp'
-    with _data_lock:
-        with open(tmp_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        os.replace(tmp_path, DATA_PATH)
-        # update cache reference
-        global _data_cache, _data_cache_mtime
-        _data_cache = data
+def _bump_data_version():
+    global _data_version
+    _data_version += 1
+
+
+def _store_lock():
+    """Cross-process write lock in multi-worker mode (a no-op context otherwise).
+    Always taken before _data_lock."""
+    return getattr(_store, 'lock', None) or nullcontext()
+
+
+def holds_store_lock(view):
+    """For views that load, modify and save_data() the whole document: hold the
+    cross-process write lock from the load to the save (multi-worker mode), so
+    another worker's save in between isn't overwritten. Row-level writes
+    (save_day_updates/save_doctor) fold in other workers' changes themselves and
+    only lock inside the helper."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with _store_lock():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def _store_version():
+    """Shared version counter in multi-worker mode (None: the index keeps its own sequence)."""
+    return getattr(_store, 'version', None)
+
+
+def _remember_saved(data):
+    global _data_cache, _data_cache_sig
+    _data_cache = data
+    _bump_data_version()
+    try:
+        _data_cache_sig = _store.signature()
+    except Exception:
+        _data_cache_sig = None
+
+
+def save_data(data):
+    if not isinstance(data, dict):
+        return
+    with _store_lock(), _data_lock:
+        _store.save(data)
+        # update cache reference
+        _remember_saved(data)
+        _schedule_index.mark_stale()
+
+
+def _change_actor():
+    """Who made the current change, for the storage journal."""
+    if has_request_context():
+        u = session.get('user') or {}
+        return u.get('username') or 'api'
+    return 'telegram'
+
+
+class _WriteBatch:
+    """Schedule changes held back by batched_schedule_writes()."""
+    def __init__(self):
+        self.data = None
+        self.changes = {}  # (doctor id, date) -> (doctor, date)
+        self.messages = 0
+        self.saved = 0
+
+    def add(self, data, changes):
+        if self.data is not None and data is not self.data:
+            self.flush()  # data was reloaded mid-batch: save against the copy the changes were made on
+        self.data = data
+        for doc, date_iso in changes:
+            self.changes[(str(doc.get('id')), date_iso)] = (doc, date_iso)
+
+    def flush(self):
+        changes = list(self.changes.values())
+        data, self.data, self.changes = self.data, None, {}
+        if not changes:
+            return
+        active = getattr(_write_batch, 'current', None)
+        _write_batch.current = None
+        try:
+            versions = save_day_updates(data, changes)
+            self.saved += len(changes)
+            publish_bulk_doctor_updates(changes, versions)
+        finally:
+            _write_batch.current = active
+
+_write_batch = threading.local()
+
+@contextmanager
+def batched_schedule_writes():
+    """Unit of work for a burst of updates on this thread (a Telegram getUpdates
+    response): save_day_updates() only collects its changes and
+    publish_doctor_update() is muted; on exit everything is saved once and
+    published as one bulk doctor_update per date."""
+    batch = _WriteBatch()
+    _write_batch.current = batch
+    try:
+        yield batch
+    finally:
+        _write_batch.current = None
+        batch.flush()
+
+def save_day_updates(data, changes):
+    """Persist per-date schedule entries already changed in place on `data`.
+
+    changes: iterable of (doctor, date_iso). The SQLite backend writes only
+    those rows (a removed entry deletes its row), the journal backend appends
+    one line per row; the JSON backend rewrites the document like save_data().
+    Returns {date: (prev_version, version)} for publish_doctor_update()
+    ({} inside batched_schedule_writes(), which saves on exit).
+    """
+    if not isinstance(data, dict):
+        return {}
+    changes = [(doc, d) for doc, d in changes if isinstance(doc, dict) and d]
+    if not changes:
+        return {}
+    batch = getattr(_write_batch, 'current', None)
+    if batch is not None:
+        batch.add(data, changes)
+        return {}
+    with _store_lock(), _data_lock:
+        _schedule_index.ensure(data, version=_store_version())
+        merged = _store.upsert_schedule_entries(data, changes, actor=_change_actor())
+        _remember_saved(data)
+        if merged:
+            # Another worker saved first and its rows were folded into `data`:
+            # reindex and send no versions, so displays refetch the day
+            _schedule_index.rebuild(data, version=_store_version())
+            return {}
+        for doc, date_iso in changes:
+            _schedule_index.touch(doc, date_iso)
+        return _schedule_index.bump((d for _, d in changes), version=_store_version())
+
+
+def save_doctor(data, doc, dates=()):
+    """Persist one doctor's base fields (name, specialty, photo...) changed in place,
+    together with its schedule entries for `dates` as a single write.
+    Returns {date: (prev_version, version)} like save_day_updates()."""
+    if not isinstance(data, dict) or not isinstance(doc, dict):
+        return {}
+    dates = [d for d in dates if d]
+    with _store_lock(), _data_lock:
+        _schedule_index.ensure(data, version=_store_version())
+        merged = _store.upsert_doctor(data, doc, actor=_change_actor(), dates=dates)
+        _remember_saved(data)
+        if merged:
+            _schedule_index.rebuild(data, version=_store_version())
+            return {}
+        _schedule_index.touch_doctor(doc)
+        for date_iso in dates:
+            _schedule_index.touch(doc, date_iso)
+        return _schedule_index.bump(dates, version=_store_version()) if dates else {}
+
+
+def doctor_base(doc: dict) -> dict:
+    """Snapshot of a doctor's base fields, to tell afterwards whether an edit changed them."""
+    return {k: copy.deepcopy(v) for k, v in doc.items() if k != 'schedule_by_date'}
+
+
+def save_doctor_edit(data, doc, base_before, date_iso, day_changed):
+    """Save an edit handler's changes to one doctor with a single store write and
+    publish them: base fields (compared with base_before) and/or its date_iso entry."""
+    base_changed = doctor_base(doc) != base_before
+    if base_changed:
+        versions = save_doctor(data, doc, dates=[date_iso] if day_changed else [])
+    elif day_changed:
+        versions = save_day_updates(data, [(doc, date_iso)])
+    else:
+        return False
+    publish_doctor_update(doc, date_iso, versions)
+    return True
+
+
+def publish_doctor_update(doc, date_iso, versions=None, **extra):
+    """Publish doctor_update with the doctor's /api/day row for date_iso as a delta,
+    so displays can patch the card without refetching the day. prev_version/version
+    (from save_day_updates) let them detect missed changes and fall back to a fetch."""
+    if getattr(_write_batch, 'current', None) is not None:
+        return  # the batch publishes its changes when it is saved
+    payload = {'doctor_id': doc.get('id'), 'date': date_iso,
+               'doctor': _schedule_index.doctor_row(doc, date_iso)}
+    if versions and date_iso in versions:
+        payload['prev_version'], payload['version'] = versions[date_iso]
+    payload.update(extra)
+    try:
+        broker.publish_event('doctor_update', payload)
+    except Exception:
+        pass
+
+
+def publish_bulk_doctor_updates(changes, versions):
+    """One doctor_update per date for a batch of (doctor, date) changes (Excel imports)."""
+    by_date = {}
+    for doc, date_iso in changes:
+        by_date.setdefault(date_iso, {})[str(doc.get('id'))] = doc
+    for date_iso, docs in by_date.items():
+        payload = {'bulk': True, 'date': date_iso,
+                   'doctor_ids': [d.get('id') for d in docs.values()],
+                   'doctors': [_schedule_index.doctor_row(d, date_iso) for d in docs.values()]}
+        if versions and date_iso in versions:
+            payload['prev_version'], payload['version'] = versions[date_iso]
         try:
-            _data_cache_mtime = os.stat(DATA_PATH).st_mtime
+            broker.publish_event('doctor_update', payload)
         except Exception:
-            _data_cache_mtime = time()
+            pass
+
+
+def cached_json_response(key, build):
+    """Return build()'s response (JSON or a rendered page), serialized once per data version.
+
+    The body is cached under (key, today) with a strong ETag, so repeat
+    polls are a dict lookup and a matching If-None-Match gets 304. Large
+    bodies are sent compressed when the client accepts it; the compressed
+    bytes are cached on the entry and carry their own ETag (etag-gzip, etag-br).
+    """
+    load_data()  # revalidate against storage (bumps the version on external changes)
+    version = _data_version
+    cache_key = (key, get_internet_today_iso())
+    entry = _response_cache.get(cache_key, version)
+    if entry is None:
+        resp = app.make_response(build())
+        if resp.status_code != 200:
+            return resp
+        entry = _response_cache.put(cache_key, version, resp.get_data(), resp.mimetype)
+    encoding = _compressor.choose(entry.mimetype, len(entry.body), request.headers.get('Accept-Encoding', ''))
+    if encoding:
+        resp = Response(entry.encoded(encoding, _compressor.compress), mimetype=entry.mimetype)
+        resp.headers['Content-Encoding'] = encoding
+        resp.set_etag(f'{entry.etag}-{encoding}')
+    else:
+        resp = Response(entry.body, mimetype=entry.mimetype)
+        resp.set_etag(entry.etag)
+    if _compressor.eligible(entry.mimetype, len(entry.body)):
+        resp.vary.add('Accept-Encoding')
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp.make_conditional(request)
 
 
 def flatten_schedule(doc: dict, limit_days: int = 14):
@@ -3242,30 +2719,24 @@ ROLE_PR = 'PR'
 ROLE_MED = 'MEDICAL_ADMIN'
 ROLE_VIEW = 'VIEW_ONLY'
 
+def _backfill_users(data):
+    if not isinstance(data, dict):
+        data = {'users': []}
+    data.setdefault('users',[])
+    # Backfill missing role property (default to ADMIN for safety in legacy files)
+    for u in data['users']:
+        if 'role' not in u:
+            # Default the very first user to ADMIN, others to PR as a sane default
+            u['role'] = ROLE_ADMIN if u is data['users'][0] else ROLE_PR
+    return data
+
+_users_repo = JsonRepository(USERS_PATH, default=lambda: {'users': []}, validate=_backfill_users)
+
 def _load_users():
-    if not os.path.exists(USERS_PATH):
-        return {'users': []}
-    try:
-        with open(USERS_PATH,'r',encoding='utf-8') as f:
-            data = json.load(f)
-        if not isinstance(data, dict):
-            data = {'users': []}
-        data.setdefault('users',[])
-        # Backfill missing role property (default to ADMIN for safety in legacy files)
-        for u in data['users']:
-            if 'role' not in u:
-                # Default the very first user to ADMIN, others to PR as a sane default
-                u['role'] = ROLE_ADMIN if u is data['users'][0] else ROLE_PR
-        return data
-    except Exception:
-        return {'users': []}
+    return _users_repo.load()
 
 def _save_users(data):
-    os.makedirs(os.path.dirname(USERS_PATH), exist_ok=True)
-    tmp = USERS_PATH + '.tmp'
-    with open(tmp,'w',encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, USERS_PATH)
+    _users_repo.save(data)
 
 def _hash_pw(pw: str) -> str:
     return sha256((pw or '').encode('utf-8')).hexdigest()
@@ -3454,34 +2925,7 @@ def root():
 def display_page():
     # Provide doctors + flattened schedules for rendering template.
     # Existing template expects richer structure (specialty ordering, etc.).
-    data = load_data()
     today_iso = get_internet_today_iso()
-    # Build per specialty order; fallback if missing
-    specialty_order = data.get('specialty_order') or sorted({d.get('specialty','') for d in data.get('doctors',[])})
-    # Minimal serialization for initial paint (client will poll /api/window & /api/doctors)
-    base_doctors = []
-    for d in data.get('doctors', []):
-        # Merge today's per-date schedule so initial render reflects correct status/timings
-        hd = hydrate_doctor_for_date(d, today_iso)
-        base_doctors.append({
-            'id': d.get('id'),
-            'name': d.get('name'),
-            'specialty': d.get('specialty'),
-            'designation': hd.get('designation', d.get('designation')),
-            'status': hd.get('status', d.get('status')),
-            'start_time': hd.get('start_time', d.get('start_time')),
-            'room': hd.get('room', d.get('room')),
-            'patient_count': hd.get('patient_count', d.get('patient_count')),
-            'opd': hd.get('opd', d.get('opd')),
-            'breaks': hd.get('breaks', d.get('breaks')),
-            # Include explicit before/after arrays and patient counts so groups render immediately
-            'before_break_opd': hd.get('before_break_opd') or d.get('before_break_opd'),
-            'after_break_opd': hd.get('after_break_opd') or d.get('after_break_opd'),
-            'before_break_opd_patients': hd.get('before_break_opd_patients') if 'before_break_opd_patients' in hd else d.get('before_break_opd_patients'),
-            'after_break_opd_patients': hd.get('after_break_opd_patients') if 'after_break_opd_patients' in hd else d.get('after_break_opd_patients'),
-            'after_break_note': hd.get('after_break_note') if 'after_break_note' in hd else d.get('after_break_note'),
-            'image_version': d.get('image_version', 1)
-        })
     closures = _load_closures()
     closure_today = None
     # Check if today is Friday (weekday 4 in Python, 0=Monday)
@@ -3509,16 +2953,46 @@ def display_page():
             if os.path.exists(candidate):
                 display_logo_path = '/static/img/hulhumale-logo' + ext
                 break
-    try:
-        return render_template('display.html', doctors=base_doctors, today=today_iso,
-                               today_iso=today_iso, today_str=today_iso,
-                               data={'specialty_order': specialty_order, 'doctors': base_doctors},
-                               closure=closure_today, logo_version=_LOGO_VERSION,
-                               display_logo=display_logo_path,
-                               contact_phone=os.environ.get('CONTACT_PHONE',''),
-                               contact_address=os.environ.get('CONTACT_ADDRESS',''))
-    except Exception:
-        return jsonify({'doctors': base_doctors})
+    # One rendered page per data version, today's closure banner and logo
+    def build():
+        data = load_data()
+        # Build per specialty order; fallback if missing
+        specialty_order = data.get('specialty_order') or sorted({d.get('specialty','') for d in data.get('doctors',[])})
+        # Minimal serialization for initial paint (client will poll /api/window & /api/doctors)
+        base_doctors = []
+        for d in data.get('doctors', []):
+            # Merge today's per-date schedule so initial render reflects correct status/timings
+            hd = hydrate_doctor_for_date(d, today_iso)
+            base_doctors.append({
+                'id': d.get('id'),
+                'name': d.get('name'),
+                'specialty': d.get('specialty'),
+                'designation': hd.get('designation', d.get('designation')),
+                'status': hd.get('status', d.get('status')),
+                'start_time': hd.get('start_time', d.get('start_time')),
+                'room': hd.get('room', d.get('room')),
+                'patient_count': hd.get('patient_count', d.get('patient_count')),
+                'opd': hd.get('opd', d.get('opd')),
+                'breaks': hd.get('breaks', d.get('breaks')),
+                # Include explicit before/after arrays and patient counts so groups render immediately
+                'before_break_opd': hd.get('before_break_opd') or d.get('before_break_opd'),
+                'after_break_opd': hd.get('after_break_opd') or d.get('after_break_opd'),
+                'before_break_opd_patients': hd.get('before_break_opd_patients') if 'before_break_opd_patients' in hd else d.get('before_break_opd_patients'),
+                'after_break_opd_patients': hd.get('after_break_opd_patients') if 'after_break_opd_patients' in hd else d.get('after_break_opd_patients'),
+                'after_break_note': hd.get('after_break_note') if 'after_break_note' in hd else d.get('after_break_note'),
+                'image_version': d.get('image_version', 1)
+            })
+        try:
+            return render_template('display.html', doctors=base_doctors, today=today_iso,
+                                   today_iso=today_iso, today_str=today_iso,
+                                   data={'specialty_order': specialty_order, 'doctors': base_doctors},
+                                   closure=closure_today, logo_version=_LOGO_VERSION,
+                                   display_logo=display_logo_path,
+                                   contact_phone=os.environ.get('CONTACT_PHONE',''),
+                                   contact_address=os.environ.get('CONTACT_ADDRESS',''))
+        except Exception:
+            return jsonify({'doctors': base_doctors})
+    return cached_json_response(('display', repr(closure_today), _LOGO_VERSION, display_logo_path), build)
 
 @app.get('/patient')
 def patient_page():
@@ -3555,28 +3029,30 @@ def api_doctors():
     """Return doctors list for both admin & display.
     Includes specialty_order and each doctor with merged *today* fields while preserving schedule_by_date for admin editing.
     """
-    data = load_data()
-    today_iso = get_internet_today_iso()
-    specialty_order = data.get('specialty_order') or []
-    specialty_designations = data.get('specialty_designations', {})
-    enriched = []
-    for d in data.get('doctors', []):
-        per_date = {}
-        if isinstance(d.get('schedule_by_date'), dict):
-            per_date = d['schedule_by_date'].get(today_iso, {})
-        doc = dict(d)  # shallow copy of stored structure
-        # Merge today's schedule fields (do not overwrite stored values permanently)
-        for fld in (
-            'designation','status','start_time','room','patient_count','opd','breaks','status_reason',
-            'before_break_opd','after_break_opd','before_break_opd_patients','after_break_opd_patients'
-        ):
-            if fld in per_date:
-                doc[fld] = per_date[fld]
-        doc['for_date'] = today_iso
-        enriched.append(doc)
-    return jsonify({'specialty_order': specialty_order, 'specialty_designations': specialty_designations, 'doctors': enriched, 'today': today_iso})
+    def build():
+        data = load_data()
+        today_iso = get_internet_today_iso()
+        specialty_order = data.get('specialty_order') or []
+        specialty_designations = data.get('specialty_designations', {})
+        todays = _schedule_index.ensure(data, version=_store_version()).entries_for(today_iso)
+        enriched = []
+        for d in data.get('doctors', []):
+            per_date = todays.get(str(d.get('id'))) or {}
+            doc = dict(d)  # shallow copy of stored structure
+            # Merge today's schedule fields (do not overwrite stored values permanently)
+            for fld in (
+                'designation','status','start_time','room','patient_count','opd','breaks','status_reason',
+                'before_break_opd','after_break_opd','before_break_opd_patients','after_break_opd_patients'
+            ):
+                if fld in per_date:
+                    doc[fld] = per_date[fld]
+            doc['for_date'] = today_iso
+            enriched.append(doc)
+        return jsonify({'specialty_order': specialty_order, 'specialty_designations': specialty_designations, 'doctors': enriched, 'today': today_iso})
+    return cached_json_response('doctors', build)
 
 @app.post('/api/doctors')
+@holds_store_lock
 def api_doctors_create():
     payload = request.json if request.is_json else request.form.to_dict()
     name = (payload.get('name') or '').strip()
@@ -3618,6 +3094,7 @@ def api_doctors_patch(doc_id):
     doc = next((d for d in data.get('doctors', []) if str(d.get('id')) == str(doc_id)), None)
     if not doc:
         return jsonify({'ok': False, 'error': 'not found'}), 404
+    base_before = doctor_base(doc)
     # Basic fields
     for base_field in ('name','specialty','notes','keywords','start_time','designation','room','patient_count','opd','breaks','status_reason'):
         if base_field in payload and base_field not in ('patient_count','opd','breaks'):
@@ -3642,12 +3119,15 @@ def api_doctors_patch(doc_id):
     if for_date and per_patch:
         if apply_single_day_update(doc, for_date, per_patch):
             changed = True
-    save_data(data)
+    # One store write (one doctors.json rewrite on the json backend) per request
     if changed:
-        broker.publish_event('doctor_update', {'doctor_id': doc_id, 'date': for_date})
+        save_doctor_edit(data, doc, base_before, for_date, True)
+    elif doctor_base(doc) != base_before:
+        save_doctor(data, doc)
     return jsonify({'ok': True, 'doctor': doc})
 
 @app.delete('/api/doctors/<doc_id>')
+@holds_store_lock
 def api_doctors_delete(doc_id):
     data = load_data()
     before = len(data.get('doctors', []))
@@ -3677,15 +3157,17 @@ def api_schedule_clear_date():
     cleared_count = 0
     doctor_ids = []
     
+    changes = []
     for doc in data.get('doctors', []):
         if 'schedule_by_date' in doc and date_iso in doc['schedule_by_date']:
             # Completely remove the date entry
             del doc['schedule_by_date'][date_iso]
             cleared_count += 1
             doctor_ids.append(doc['id'])
+            changes.append((doc, date_iso))
     
     if cleared_count > 0:
-        save_data(data)
+        save_day_updates(data, changes)
         # Trigger SSE update for all affected doctors
         broker.publish_event('schedule_cleared', {
             'date': date_iso,
@@ -3776,44 +3258,46 @@ def api_doctor_photo(doc_id):
     for d in data.get('doctors', []):
         if str(d.get('id')) == str(doc_id):
             d['image_version'] = int(d.get('image_version', 1)) + 1
+            save_doctor(data, d)
             break
-    save_data(data)
     broker.publish_event('doctor_update', {'doctor_id': doc_id, 'image_version': d.get('image_version',1)})
     return jsonify({'ok': True, 'image_version': d.get('image_version',1)})
 
 @app.get('/admin')
 def admin_page():
     # Combined admin + display snapshot for today's date.
-    data = load_data()
-    today_iso = get_internet_today_iso()
-    out = []
-    for d in data.get('doctors', []):
-        per_date = {}
-        if isinstance(d.get('schedule_by_date'), dict):
-            per_date = d['schedule_by_date'].get(today_iso, {})
-        merged = dict(
-            id=d.get('id'),
-            name=d.get('name'),
-            specialty=d.get('specialty'),
-            keywords=d.get('keywords', []),
-            notes=d.get('notes'),
-            designation=per_date.get('designation', d.get('designation')),
-            status=per_date.get('status', d.get('status','PENDING')),
-            start_time=per_date.get('start_time', d.get('start_time')),
-            room=per_date.get('room', d.get('room')),
-            patient_count=per_date.get('patient_count', d.get('patient_count')),
-            opd=per_date.get('opd', d.get('opd')),
-            breaks=per_date.get('breaks', d.get('breaks')),
-            status_reason=per_date.get('status_reason', d.get('status_reason')),
-            before_break_opd_patients=per_date.get('before_break_opd_patients'),
-            after_break_opd_patients=per_date.get('after_break_opd_patients'),
-            before_break_opd=per_date.get('before_break_opd'),
-            after_break_opd=per_date.get('after_break_opd'),
-            image_version=d.get('image_version', 1),
-            for_date=today_iso if per_date else None
-        )
-        out.append(merged)
-    return jsonify({'specialty_order': data.get('specialty_order', []), 'doctors': out})
+    def build():
+        data = load_data()
+        today_iso = get_internet_today_iso()
+        out = []
+        for d in data.get('doctors', []):
+            per_date = {}
+            if isinstance(d.get('schedule_by_date'), dict):
+                per_date = d['schedule_by_date'].get(today_iso, {})
+            merged = dict(
+                id=d.get('id'),
+                name=d.get('name'),
+                specialty=d.get('specialty'),
+                keywords=d.get('keywords', []),
+                notes=d.get('notes'),
+                designation=per_date.get('designation', d.get('designation')),
+                status=per_date.get('status', d.get('status','PENDING')),
+                start_time=per_date.get('start_time', d.get('start_time')),
+                room=per_date.get('room', d.get('room')),
+                patient_count=per_date.get('patient_count', d.get('patient_count')),
+                opd=per_date.get('opd', d.get('opd')),
+                breaks=per_date.get('breaks', d.get('breaks')),
+                status_reason=per_date.get('status_reason', d.get('status_reason')),
+                before_break_opd_patients=per_date.get('before_break_opd_patients'),
+                after_break_opd_patients=per_date.get('after_break_opd_patients'),
+                before_break_opd=per_date.get('before_break_opd'),
+                after_break_opd=per_date.get('after_break_opd'),
+                image_version=d.get('image_version', 1),
+                for_date=today_iso if per_date else None
+            )
+            out.append(merged)
+        return jsonify({'specialty_order': data.get('specialty_order', []), 'doctors': out})
+    return cached_json_response('admin', build)
 
 # ---------------- Admin REST Endpoints (token protected) ----------------
 def _check_admin(req):
@@ -3830,6 +3314,7 @@ def _admin_guard():
     return None
 
 @app.post('/api/doctors')
+@holds_store_lock
 def admin_create_doctor():
     g = _admin_guard();
     if g: return g
@@ -3872,6 +3357,7 @@ def admin_patch_doctor(doc_id):
     doc = next((d for d in data.get('doctors', []) if str(d.get('id')) == str(doc_id)), None)
     if not doc:
         return jsonify({'ok': False, 'error': 'not found'}), 404
+    base_before = doctor_base(doc)
     # Basic fields
     for k in ('name','specialty','notes','keywords','designation'):
         if k in payload:
@@ -3891,12 +3377,11 @@ def admin_patch_doctor(doc_id):
     if patch:
         if apply_single_day_update(doc, date_iso, patch):
             changed = True
-    if changed:
-        save_data(data)
-        broker.publish_event('doctor_update', {'doctor_id': doc.get('id'), 'date': date_iso})
+    save_doctor_edit(data, doc, base_before, date_iso, changed)
     return jsonify({'ok': True, 'doctor': doc, 'changed': changed})
 
 @app.delete('/api/doctors/<doc_id>')
+@holds_store_lock
 def admin_delete_doctor(doc_id):
     g = _admin_guard();
     if g: return g
@@ -3930,12 +3415,11 @@ def admin_upload_photo(doc_id):
             except Exception: pass
     file.save(path)
     data = load_data(force=True)
-    for d in data.get('doctors', []):
-        if str(d.get('id')) == str(doc_id):
-            d['image_version'] = int(d.get('image_version',1)) + 1
-            break
-    save_data(data)
-    return jsonify({'ok': True, 'image_version': d.get('image_version',1)})
+    doc = next((d for d in data.get('doctors', []) if str(d.get('id')) == str(doc_id)), None)
+    if doc is not None:
+        doc['image_version'] = int(doc.get('image_version',1)) + 1
+        save_doctor(data, doc)
+    return jsonify({'ok': True, 'image_version': (doc or {}).get('image_version',1)})
 
 @app.post('/api/doctors/<doc_id>/promo')
 def admin_upload_promo(doc_id):
@@ -3964,12 +3448,11 @@ def admin_upload_promo(doc_id):
     _save_media_history(doc_id, path, 'promo')
     
     data = load_data(force=True)
-    for d in data.get('doctors', []):
-        if str(d.get('id')) == str(doc_id):
-            d['promo_version'] = int(d.get('promo_version',1)) + 1
-            break
-    save_data(data)
-    return jsonify({'ok': True, 'promo_version': d.get('promo_version',1)})
+    doc = next((d for d in data.get('doctors', []) if str(d.get('id')) == str(doc_id)), None)
+    if doc is not None:
+        doc['promo_version'] = int(doc.get('promo_version',1)) + 1
+        save_doctor(data, doc)
+    return jsonify({'ok': True, 'promo_version': (doc or {}).get('promo_version',1)})
 
 @app.get('/doctor-promo/<doc_id>')
 def get_promo_image(doc_id):
@@ -3986,6 +3469,7 @@ def get_promo_image(doc_id):
     return send_file(os.path.join('static','img','default-doctor.png'))
 
 @app.post('/api/specialties')
+@holds_store_lock
 def admin_add_specialty():
     g = _admin_guard();
     if g: return g
@@ -4014,6 +3498,7 @@ def admin_add_specialty():
     return jsonify({'ok': True, 'specialty_order': order, 'specialty_designations': s_map})
 
 @app.patch('/api/specialties/<path:spec>')
+@holds_store_lock
 def admin_rename_specialty(spec):
     g = _admin_guard();
     if g: return g
@@ -4044,6 +3529,7 @@ def admin_rename_specialty(spec):
     return jsonify({'ok': True, 'changed': changed, 'specialty_order': data.get('specialty_order', []), 'specialty_designations': data.get('specialty_designations', {})})
 
 @app.delete('/api/specialties/<path:spec>')
+@holds_store_lock
 def admin_delete_specialty(spec):
     g = _admin_guard();
     if g: return g
@@ -4060,6 +3546,7 @@ def admin_delete_specialty(spec):
     return jsonify({'ok': False, 'error': 'not found'}), 404
 
 @app.post('/api/specialties/<path:spec>/advanced_delete')
+@holds_store_lock
 def admin_adv_delete(spec):
     g = _admin_guard();
     if g: return g
@@ -4093,6 +3580,7 @@ def admin_adv_delete(spec):
     return jsonify({'ok': False, 'error': 'bad mode'}), 400
 
 @app.post('/api/specialties/reorder')
+@holds_store_lock
 def admin_reorder_specialties():
     g = _admin_guard();
     if g: return g
@@ -4268,18 +3756,13 @@ def api_closure_delete(date_iso):
 # ============================================================================
 OPDINFO_PATH = os.path.join('data', 'opdinfo.json')
 
+_opdinfo_repo = JsonRepository(OPDINFO_PATH)
+
 def _load_opdinfo():
-    if not os.path.exists(OPDINFO_PATH):
-        return {}
-    try:
-        with open(OPDINFO_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return {}
+    return _opdinfo_repo.load()
 
 def _save_opdinfo(data):
-    with open(OPDINFO_PATH, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    _opdinfo_repo.save(data)
 
 @app.get('/api/opdinfo')
 def api_opdinfo_get():
@@ -4305,14 +3788,28 @@ def debug_telegram_status():
     # Provide simple plaintext snapshot for admin panel
     lines = [f"Telegram enabled: {ENABLE_TELEGRAM}", f"Running: {_telegram_thread.is_alive() if _telegram_thread else False}", f"Offset: {_telegram_offset}", f"Fail streak: {_telegram_fail_streak}"]
     try:
-        if os.path.exists(LOG_PATH):
-            with open(LOG_PATH,'r',encoding='utf-8') as f:
-                recent = f.readlines()[-100:]
-            lines.append('\nLast 100 lines:\n' + ''.join(recent))
+        recent = _log_pipeline.tail(None, limit=TAIL_LIMIT)['lines'][-100:]
+        if recent:
+            lines.append('\nLast 100 lines:\n' + '\n'.join(recent))
     except Exception as e:
         lines.append(f"(log read error: {e})")
     return Response('\n'.join(lines), mimetype='text/plain')
 
+@app.get('/api/logs/tail')
+def api_logs_tail():
+    """Log lines after byte ?offset= (default: the last ?limit= bytes); poll again with the returned offset."""
+    g = require_roles(ROLE_ADMIN)
+    if g: return g
+    try:
+        offset = request.args.get('offset')
+        offset = int(offset) if offset not in (None, '') else None
+        limit = min(1024 * 1024, max(1, int(request.args.get('limit') or TAIL_LIMIT)))
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'offset and limit must be integers'}), 400
+    if offset is not None and offset < 0:
+        return jsonify({'ok': False, 'error': 'offset must be >= 0'}), 400
+    return jsonify({'ok': True, 'dropped': _log_pipeline.dropped, **_log_pipeline.tail(offset, limit)})
+
 @app.get('/api/window')
 def api_window():
     """Return window of days with doctors merged per date for date navigation UI."""
@@ -4325,58 +3822,29 @@ def api_window():
         except Exception:
             base = datetime.strptime(get_internet_today_iso(), '%Y-%m-%d').date()
     days = max(1, min(30, int(request.args.get('days', '14'))))
-    data = load_data()
-    window = []
-    today_iso = get_internet_today_iso()
-    # Iterate through more days to compensate for skipped Fridays (add ~20% more)
-    max_iterations = days + (days // 4) + 5
-    for i in range(max_iterations):
-        if len(window) >= days:
-            break
-        day = base + timedelta(days=i)
-        iso = day.isoformat()
-        # Skip past days (older than today) to avoid showing stale previous day as first entry
-        if iso < today_iso:
-            continue
-        # SKIP FRIDAYS COMPLETELY - Don't include them in the window at all
-        if day.weekday() == 4:
-            continue
-        day_doctors = []
-        for d in data.get('doctors', []):
-            per_date = {}
-            if isinstance(d.get('schedule_by_date'), dict):
-                per_date = d['schedule_by_date'].get(iso, {})
-            if per_date:
-                merged = dict(
-                    id=d.get('id'), name=d.get('name'), specialty=d.get('specialty'),
-                    designation=per_date.get('designation'), status=per_date.get('status','PENDING'),
-                    start_time=per_date.get('start_time'), room=per_date.get('room'),
-                    patient_count=per_date.get('patient_count'), opd=per_date.get('opd'),
-                    breaks=per_date.get('breaks'), status_reason=per_date.get('status_reason'),
-                    before_break_opd_patients=per_date.get('before_break_opd_patients'),
-                    after_break_opd_patients=per_date.get('after_break_opd_patients'),
-                    before_break_opd=per_date.get('before_break_opd'),
-                    after_break_opd=per_date.get('after_break_opd'),
-                    post_oncall=per_date.get('post_oncall'),
-                    after_break_note=per_date.get('after_break_note'),
-                    image_version=d.get('image_version',1)
-                )
-            else:
-                # If no per-date schedule for this day:
-                # Always show as clean PENDING (no carry-over) to prevent previous-day bleed-through
-                merged = dict(
-                    id=d.get('id'), name=d.get('name'), specialty=d.get('specialty'),
-                    designation=None, status='PENDING', start_time=None, room=None,
-                    patient_count=None, opd=[], breaks=[], status_reason=None,
-                    before_break_opd=[], after_break_opd=[],
-                    before_break_opd_patients=None, after_break_opd_patients=None,
-                    after_break_note=None,
-                    image_version=d.get('image_version',1)
-                )
-            day_doctors.append(merged)
-        # Add day object (Fridays are already skipped above)
-        window.append({'date': iso, 'doctors': day_doctors})
-    return jsonify({'window': window})
+
+    def build():
+        data = load_data()
+        index = _schedule_index.ensure(data, version=_store_version())
+        window = []
+        today_iso = get_internet_today_iso()
+        # Iterate through more days to compensate for skipped Fridays (add ~20% more)
+        max_iterations = days + (days // 4) + 5
+        for i in range(max_iterations):
+            if len(window) >= days:
+                break
+            day = base + timedelta(days=i)
+            iso = day.isoformat()
+            # Skip past days (older than today) to avoid showing stale previous day as first entry
+            if iso < today_iso:
+                continue
+            # SKIP FRIDAYS COMPLETELY - Don't include them in the window at all
+            if day.weekday() == 4:
+                continue
+            # Add day object (Fridays are already skipped above)
+            window.append({'date': iso, 'doctors': index.window_rows(iso)})
+        return jsonify({'window': window})
+    return cached_json_response(('window', base.isoformat(), days), build)
 
 @app.get('/api/day')
 def api_day():
@@ -4386,30 +3854,14 @@ def api_day():
         datetime.strptime(date_iso, '%Y-%m-%d')
     except Exception:
         date_iso = get_internet_today_iso()
-    data = load_data()
-    today_iso = get_internet_today_iso()
     # Important: Only return doctors that have an explicit per-date entry for date_iso.
     # This API is used by displays as an "override diff". Returning baseline values here
     # caused every doctor to appear as scheduled. Keep it strict to real overrides.
-    docs = []
-    for d in data.get('doctors', []):
-        if not isinstance(d.get('schedule_by_date'), dict):
-            continue
-        per_date = d['schedule_by_date'].get(date_iso)
-        if not per_date:
-            continue
-        merged = dict(id=d.get('id'), name=d.get('name'), specialty=d.get('specialty'),
-                      designation=per_date.get('designation'), status=per_date.get('status','PENDING'),
-                      start_time=per_date.get('start_time'), room=per_date.get('room'),
-                      patient_count=per_date.get('patient_count'), opd=per_date.get('opd'),
-                      breaks=per_date.get('breaks'), status_reason=per_date.get('status_reason'),
-                      before_break_opd_patients=per_date.get('before_break_opd_patients'),
-                      after_break_opd_patients=per_date.get('after_break_opd_patients'),
-                      post_oncall=per_date.get('post_oncall'),
-                      after_break_note=per_date.get('after_break_note'),
-                      image_version=d.get('image_version',1))
-        docs.append(merged)
-    return jsonify({'date': date_iso, 'doctors': docs})
+    def build():
+        index = _schedule_index.ensure(load_data(), version=_store_version())
+        return jsonify({'date': date_iso, 'doctors': index.day_rows(date_iso),
+                        'version': index.date_version(date_iso)})
+    return cached_json_response(('day', date_iso), build)
 
 @app.post('/api/schedule/clear_status')
 def api_schedule_clear_status():
@@ -4460,6 +3912,7 @@ def api_schedule_clear_status():
 
     data = load_data()
     changed = 0
+    changes = []
     for d in data.get('doctors', []):
         sched = d.setdefault('schedule_by_date', {})
         for iso in dates:
@@ -4468,6 +3921,7 @@ def api_schedule_clear_status():
                     try:
                         del sched[iso]
                         changed += 1
+                        changes.append((d, iso))
                     except Exception:
                         pass
             else:
@@ -4476,7 +3930,8 @@ def api_schedule_clear_status():
                 if sched.get(iso) != entry:
                     sched[iso] = entry
                     changed += 1
-    save_data(data)
+                    changes.append((d, iso))
+    save_day_updates(data, changes)
     try:
         broker.publish_event('bulk_schedule_clear', {'dates': dates, 'action': action, 'set': set_status})
     except Exception:
@@ -4495,6 +3950,7 @@ def photo_alias(doc_id):
     return send_file(os.path.join('static','img','default-doctor.png'))
 
 @app.post('/api_create_doctor')
+@holds_store_lock
 def api_create_doctor():
     name = (request.json or {}).get('name') if request.is_json else (request.form.get('name'))
     if not name:
@@ -4524,57 +3980,93 @@ def api_update_doctor():
     doc = next((d for d in data['doctors'] if d.get('id') == doc_id), None)
     if not doc:
         return jsonify({'ok': False, 'error': 'not found'}), 404
+    base_before = doctor_base(doc)
     patch = {k: payload[k] for k in PER_DATE_FIELDS if k in payload}
-    changed = False
+    day_changed = False
     if patch:
-        changed = apply_single_day_update(doc, date_iso, patch)
+        day_changed = apply_single_day_update(doc, date_iso, patch)
     # Non per-date fields (rename etc.)
     if 'name' in payload and payload['name'] != doc.get('name'):
-        doc['name'] = payload['name']; changed = True
-    if changed:
-        save_data(data)
-        broker.publish_event('doctor_update', {'doctor_id': doc_id, 'date': date_iso})
+        doc['name'] = payload['name']
+    changed = save_doctor_edit(data, doc, base_before, date_iso, day_changed)
     return jsonify({'ok': True, 'changed': changed, 'doctor': doc})
 
 # ============== PR PORTAL BACKEND APIs ==============
 
 PR_STAFF_PATH = os.path.join('data', 'pr_staff.json')
 PR_CLINICAL_ROSTER_PATH = os.path.join('data', 'pr_clinical_roster.json')
+PR_ROSTER_PATH = os.path.join('data', 'pr_roster.json')
+PR_LEAVES_PATH = os.path.join('data', 'pr_leaves.json')
 
-def load_pr_staff(auto_sync_specialties: bool = True):
-    try:
-        with open(PR_STAFF_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except Exception:
-        data = {"staff": [], "stations": {"clinical": [], "front": []}, "leave_types": {}}
+_pr_staff_repo = JsonRepository(PR_STAFF_PATH, default=lambda: {"staff": [], "stations": {"clinical": [], "front": []}, "leave_types": {}})
+_pr_clinical_roster_repo = JsonRepository(PR_CLINICAL_ROSTER_PATH, default=lambda: {"rosters": {}})
+_pr_roster_repo = JsonRepository(PR_ROSTER_PATH)
+_pr_leaves_repo = JsonRepository(PR_LEAVES_PATH)
 
-    changed = ensure_station_structure(data)
-    specialty_mutated = False
-    if auto_sync_specialties:
-        _, _, specialty_mutated = sync_doctor_specialty_stations(data)
-    normalize_changed = normalize_pr_staff_records(data)
+# (pr_staff.json signature, doctors data version it was synced against or None, normalised data)
+_pr_staff_cache = None
+_pr_staff_lock = threading.Lock()
 
-    if changed or specialty_mutated or normalize_changed:
-        save_pr_staff(data)
+def _pr_staff_file_sig():
+    return _pr_staff_repo.signature()
+
+def load_pr_staff(auto_sync_specialties: bool = True):
+    """PR staff/stations data, as a private copy the caller may modify and save_pr_staff().
 
+    The file is re-read and normalised only when it changed on disk, and the
+    specialty stations are re-synced only when the doctors data version moved,
+    so repeated reads neither parse, normalise nor write anything.
+    """
+    global _pr_staff_cache
+    doctor_data = load_data() if auto_sync_specialties else None
+    version = _data_version if auto_sync_specialties else None
+    sig = _pr_staff_file_sig()
+    cached = _pr_staff_cache
+    if cached is not None and cached[0] == sig and (not auto_sync_specialties or cached[1] == version):
+        return copy.deepcopy(cached[2])
+    with _pr_staff_lock:
+        cached = _pr_staff_cache
+        if cached is not None and cached[0] == sig:
+            # File unchanged, only the doctors moved on: no re-read or normalisation needed
+            data = copy.deepcopy(cached[2])
+            changed = normalize_changed = False
+        else:
+            data = _pr_staff_repo.load()
+            changed = ensure_station_structure(data)
+            normalize_changed = normalize_pr_staff_records(data)
+        specialty_mutated = False
+        if auto_sync_specialties:
+            _, _, specialty_mutated = sync_doctor_specialty_stations(data, doctor_data)
+            if specialty_mutated:
+                normalize_changed = normalize_pr_staff_records(data) or normalize_changed
+
+        if changed or specialty_mutated or normalize_changed:
+            save_pr_staff(data, synced_version=version)
+        else:
+            _pr_staff_cache = (sig, version, copy.deepcopy(data))
     return data
 
-def save_pr_staff(data):
-    os.makedirs(os.path.dirname(PR_STAFF_PATH), exist_ok=True)
-    with open(PR_STAFF_PATH, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def save_pr_staff(data, synced_version=None):
+    global _pr_staff_cache
+    # Normalise on the way out so the cached copy needs no work on later reads
+    ensure_station_structure(data)
+    normalize_pr_staff_records(data)
+    _pr_staff_repo.save(data)
+    # Specialties are re-checked on the next load unless the caller synced them
+    # against the current doctors version
+    _pr_staff_cache = (_pr_staff_file_sig(), synced_version, copy.deepcopy(data))
 
 def load_pr_clinical_roster():
-    try:
-        with open(PR_CLINICAL_ROSTER_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return {"rosters": {}}
+    return _pr_clinical_roster_repo.load()
 
 def save_pr_clinical_roster(data):
-    os.makedirs(os.path.dirname(PR_CLINICAL_ROSTER_PATH), exist_ok=True)
-    with open(PR_CLINICAL_ROSTER_PATH, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    _pr_clinical_roster_repo.save(data)
+
+def _load_pr_roster() -> dict:
+    return _pr_roster_repo.load()
+
+def _save_pr_roster(roster: dict):
+    _pr_roster_repo.save(roster)
 
 def slugify_station_name(name: str) -> str:
     base = re.sub(r'[^a-z0-9]+', '-', (name or '').lower()).strip('-')
@@ -4778,20 +4270,6 @@ def normalize_pr_staff_records(pr_data: dict) -> bool:
 
     return changed
 
-SHIFT_KNOWLEDGE_PATH = os.path.join('data', 'shift_knowledge.json')
-
-def load_shift_knowledge():
-    try:
-        with open(SHIFT_KNOWLEDGE_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return {}
-
-def save_shift_knowledge(data):
-    os.makedirs(os.path.dirname(SHIFT_KNOWLEDGE_PATH), exist_ok=True)
-    with open(SHIFT_KNOWLEDGE_PATH, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
 @app.get('/pr-portal')
 def pr_portal():
     if not session.get('user'):
@@ -5113,13 +4591,63 @@ def api_pr_roster_clinical_save():
         'duty_type': duty_type,
         'station_id': station_id,
         'leave_type': leave_type,
+        'manual': True,  # kept by incremental regeneration
         'updated_at': datetime.now().isoformat()
     }
     
     save_pr_clinical_roster(data)
     return jsonify({'ok': True, 'roster': data['rosters'][date]})
 
+def _roster_solver_options(payload: dict) -> tuple:
+    """(seed, time_budget) for roster_engine.solve from a generate request; ValueError if malformed."""
+    try:
+        seed = int(payload.get('seed') or 0)
+        time_budget = float(payload.get('time_budget') or ROSTER_TIME_BUDGET)
+    except (TypeError, ValueError):
+        raise ValueError('seed must be an integer and time_budget a number of seconds')
+    return seed, max(0.05, min(60.0, time_budget))
+
+def _roster_scope(payload: dict) -> tuple:
+    """(incremental, staff ids to re-solve or None for everyone) from a generate request.
+
+    mode='incremental' (implied by staff_ids/staff_id) re-solves only those staff
+    in start_date..end_date and keeps every other cell, manual edits included.
+    """
+    staff = payload.get('staff_ids')
+    if staff is None and payload.get('staff_id'):
+        staff = [payload.get('staff_id')]
+    if staff is not None and not isinstance(staff, list):
+        raise ValueError('staff_ids must be a list')
+    incremental = (payload.get('mode') or '').lower() == 'incremental' or bool(staff)
+    return incremental, ({str(x) for x in staff} if staff else None)
+
+def _roster_resolve_plan(cells, dates, horizon, affected, keep_manual: bool) -> tuple:
+    """Split existing roster cells for a re-solve of dates x affected staff.
+
+    cells yields (staff_id, date, kind, slot, manual) with kind 'duty', 'leave'
+    or 'off'. Returns (fixed, unavailable, kept): duties the solver must build
+    around, (staff, date) pairs nobody may be put on, and the (staff, date)
+    cells inside dates that stay as they are.
+    """
+    in_range = set(dates)
+    fixed, unavailable, kept = {}, set(), set()
+    for staff_id, day, kind, slot, manual in cells:
+        if day not in horizon:
+            continue
+        redo = (day in in_range and kind != 'leave' and (affected is None or staff_id in affected)
+                and not (manual and keep_manual))
+        if redo:
+            continue
+        if day in in_range:
+            kept.add((staff_id, day))
+        if kind == 'leave' or (kind == 'off' and manual):
+            unavailable.add((staff_id, day))
+        elif kind == 'duty':
+            fixed[(staff_id, day)] = slot
+    return fixed, unavailable, kept
+
 @app.post('/api/pr/roster/clinical/generate')
+@runs_as_job('clinical_roster')
 def api_pr_roster_clinical_generate():
     """Enhanced AI-based duty generation algorithm with smart balancing"""
     if not session.get('user'):
@@ -5152,134 +4680,87 @@ def api_pr_roster_clinical_generate():
         dates.append(current.isoformat())
         current += timedelta(days=1)
     
-    # Enhanced AI Algorithm with smart workload balancing
-    import random
-    generated_rosters = {}
-    
-    # Track weekly stats per staff (resets each week)
-    staff_weekly_duty_count = {s['id']: 0 for s in clinical_staff}
-    staff_total_duty_count = {s['id']: 0 for s in clinical_staff}
-    staff_consecutive_days = {s['id']: 0 for s in clinical_staff}
-    staff_last_specialty = {s['id']: None for s in clinical_staff}
-    
-    # Check existing leave assignments
+    try:
+        seed, time_budget = _roster_solver_options(payload)
+        incremental, affected = _roster_scope(payload)
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    rules = roster_engine.Rules.from_ai_rules(pr_data.get('ai_rules'))
+    horizon = roster_engine.context_days(dates[0], dates[-1], rules)
+
+    # One slot per doctor on duty, labelled with the specialty (any clinical staff may take it)
+    staff_ids = [s['id'] for s in clinical_staff]
+    eligible = tuple(x for x in staff_ids if affected is None or x in affected)
     existing_rosters = roster_data.get('rosters', {})
-    
+    slots = []
     for date_str in dates:
-        # Get doctors scheduled for this date
-        doctors_on_duty = []
         for doc in doctor_data.get('doctors', []):
             # Check both 'schedule' and 'schedule_by_date' for compatibility
-            schedule = None
-            if 'schedule_by_date' in doc:
-                schedule = doc['schedule_by_date'].get(date_str, {})
-            elif 'schedule' in doc:
-                schedule = doc['schedule'].get(date_str, {})
-            
-            if schedule:
-                status = schedule.get('status', 'MISSING')
-                if status == 'ON_DUTY':
-                    specialty = doc.get('specialty', 'General')
-                    doctors_on_duty.append({
-                        'name': doc['name'], 
-                        'specialty': specialty,
-                        'room': schedule.get('room', 'N/A')
-                    })
-        
-        # Get unique specialties for today
-        specialties_today = list(set([d['specialty'] for d in doctors_on_duty]))
-        
-        generated_rosters[date_str] = {}
-        
-        # Check for existing leave requests
-        if date_str in existing_rosters:
-            for staff_id, assignment in existing_rosters[date_str].items():
-                if assignment.get('duty_type') == 'leave':
-                    generated_rosters[date_str][staff_id] = assignment
-                    continue
-        
-        # Get available staff (not on leave, not exceeding 5 days/week)
-        available_staff = []
+            schedule = (doc['schedule_by_date'] if 'schedule_by_date' in doc else doc.get('schedule') or {}).get(date_str) or {}
+            if schedule.get('status') == 'ON_DUTY':
+                slots.append(roster_engine.Slot(date_str, doc.get('specialty', 'General'), None, None, False,
+                                                eligible, doc.get('name', '')))
+
+    def cells():
+        for date_str in horizon:
+            for staff_id, assignment in (existing_rosters.get(date_str) or {}).items():
+                kind = assignment.get('duty_type')
+                slot = roster_engine.Slot(date_str, assignment.get('station_id'), None, None, False, (), '')
+                yield staff_id, date_str, kind if kind in ('duty', 'leave') else 'off', slot, bool(assignment.get('manual'))
+
+    fixed, unavailable, kept = _roster_resolve_plan(cells(), dates, set(horizon), affected, keep_manual=incremental)
+    in_range = set(dates)
+    slots = roster_engine.uncovered(slots, {k: v for k, v in fixed.items() if k[1] in in_range})
+    result = roster_engine.solve(horizon, staff_ids, slots, rules, unavailable=unavailable, fixed=fixed,
+                                 time_budget=time_budget, seed=seed,
+                                 progress=lambda f: report_progress(f, 'solving'))
+
+    now_iso = datetime.now().isoformat()
+    generated_rosters = {d: {} for d in dates}
+    for staff_id, date_str in kept:
+        generated_rosters[date_str][staff_id] = existing_rosters[date_str][staff_id]
+    for slot, staff_id in result.pairs():
+        generated_rosters[slot.day][staff_id] = {
+            'duty_type': 'duty',
+            'station_id': slot.station,
+            'leave_type': None,
+            'updated_at': now_iso
+        }
+    # Everyone else being re-solved is off
+    for date_str in dates:
         for s in clinical_staff:
-            # Skip if on leave
-            if s['id'] in generated_rosters[date_str]:
-                continue
-            # Skip if already worked 5 days this week
-            if staff_weekly_duty_count[s['id']] >= 5:
+            if affected is not None and s['id'] not in affected:
                 continue
-            # Skip if worked 3 consecutive days (needs a break)
-            if staff_consecutive_days[s['id']] >= 3:
-                continue
-            available_staff.append(s)
-        
-        if len(doctors_on_duty) > 0 and len(available_staff) > 0:
-            # Calculate how many staff needed (match doctor count)
-            num_assignments = min(len(doctors_on_duty), len(available_staff))
-            
-            # Sort staff by total duty count (assign least worked first for fairness)
-            available_staff.sort(key=lambda x: (staff_total_duty_count[x['id']], random.random()))
-            
-            assigned_specialties = []
-            for i in range(num_assignments):
-                staff = available_staff[i]
-                
-                # Smart specialty assignment: avoid same specialty consecutively
-                available_specialties = [s for s in specialties_today if s not in assigned_specialties]
-                if not available_specialties:
-                    available_specialties = specialties_today
-                
-                # Prefer different specialty than last time
-                last_spec = staff_last_specialty[staff['id']]
-                if last_spec and last_spec in available_specialties and len(available_specialties) > 1:
-                    available_specialties = [s for s in available_specialties if s != last_spec]
-                
-                assigned_specialty = random.choice(available_specialties)
-                assigned_specialties.append(assigned_specialty)
-                
-                generated_rosters[date_str][staff['id']] = {
-                    'duty_type': 'duty',
-                    'station_id': assigned_specialty,
-                    'leave_type': None,
-                    'updated_at': datetime.now().isoformat()
-                }
-                
-                # Update counters
-                staff_weekly_duty_count[staff['id']] += 1
-                staff_total_duty_count[staff['id']] += 1
-                staff_consecutive_days[staff['id']] += 1
-                staff_last_specialty[staff['id']] = assigned_specialty
-        
-        # Mark off days for staff not assigned
-        for s in clinical_staff:
-            if s['id'] not in generated_rosters[date_str]:
-                # Reset consecutive counter when off
-                staff_consecutive_days[s['id']] = 0
-                # Only mark as "off" if not already marked as leave
-                generated_rosters[date_str][s['id']] = {
-                    'duty_type': 'off',
-                    'station_id': None,
-                    'leave_type': None,
-                    'updated_at': datetime.now().isoformat()
-                }
-        
-        # Reset weekly counters on Mondays
-        if datetime.strptime(date_str, '%Y-%m-%d').weekday() == 0:  # Monday
-            staff_weekly_duty_count = {s['id']: 0 for s in clinical_staff}
-    
+            generated_rosters[date_str].setdefault(s['id'], {
+                'duty_type': 'off',
+                'station_id': None,
+                'leave_type': None,
+                'updated_at': now_iso
+            })
+
     # Save generated rosters
     if 'rosters' not in roster_data:
         roster_data['rosters'] = {}
-    roster_data['rosters'].update(generated_rosters)
+    for date_str, cells_today in generated_rosters.items():
+        if affected is None:
+            roster_data['rosters'][date_str] = cells_today
+        else:
+            roster_data['rosters'].setdefault(date_str, {}).update(cells_today)
     save_pr_clinical_roster(roster_data)
     
     return jsonify({
         'ok': True,
+        'mode': 'incremental' if incremental else 'full',
         'generated': len(generated_rosters),
         'rosters': generated_rosters,
         'stats': {
             'dates': len(dates),
             'staff': len(clinical_staff),
             'assignments': sum(len(r) for r in generated_rosters.values()),
+            'kept': len(kept),
+            'unfilled': len(result.unfilled),
+            'violations': result.violations,
+            'solver': result.stats,
             'doctors_per_day': {d: len([doc for doc in doctor_data.get('doctors', []) if (doc.get('schedule_by_date', {}).get(d, {}).get('status') or doc.get('schedule', {}).get(d, {}).get('status')) == 'ON_DUTY']) for d in dates[:5]}
         }
     })
@@ -5442,6 +4923,7 @@ def api_pr_roster_bulk_update():
             'duty_type': update.get('duty_type'),
             'station_id': update.get('station_id'),
             'leave_type': update.get('leave_type'),
+            'manual': bool(update.get('manual', True)),  # kept by incremental regeneration
             'updated_at': datetime.now().isoformat()
         }
         updated_count += 1
@@ -5493,14 +4975,8 @@ def api_pr_roster_clear():
         if not clear_type:
             return jsonify({'ok': False, 'error': 'type required (day, staff, or all)'}), 400
         
-        roster_path = 'data/pr_roster.json'
-        
         # Load current roster
-        if os.path.exists(roster_path):
-            with open(roster_path, 'r', encoding='utf-8') as f:
-                roster = json.load(f)
-        else:
-            roster = {}
+        roster = _load_pr_roster()
         
         if clear_type == 'day':
             # Clear specific day for all staff
@@ -5539,8 +5015,7 @@ def api_pr_roster_clear():
             return jsonify({'ok': False, 'error': 'Invalid type. Use: day, staff, or all'}), 400
         
         # Save updated roster
-        with open(roster_path, 'w', encoding='utf-8') as f:
-            json.dump(roster, f, indent=2, ensure_ascii=False)
+        _save_pr_roster(roster)
         
         return jsonify({'ok': True, 'message': message})
         
@@ -5617,25 +5092,50 @@ PR_TELEGRAM_CHAT_ID = _clean_env(os.environ.get('PR_TELEGRAM_GROUP_ID') or '')
 # Server Sent Events endpoint
 @app.get('/events')
 def sse_events():
+    if _async_sse is not None:
+        # Hand the long-lived stream to the asyncio server instead of a worker thread
+        target = ASYNC_SSE_PUBLIC_URL
+        if not target:
+            host = request.host.rsplit(':', 1)[0] if not request.host.endswith(']') else request.host
+            target = f"{request.scheme}://{host}:{_async_sse.port}/events"
+        if request.query_string:
+            target += '?' + request.query_string.decode('latin-1')
+        return redirect(target, code=307)
+    # Optional ?date= / ?topics= filters; resume after Last-Event-ID (header on
+    # EventSource auto-reconnect, ?lastEventId= for clients that reopen the stream)
+    event_filter = EventFilter.from_args(request.args)
+    last_id = parse_last_event_id(request.headers.get('Last-Event-ID') or request.args.get('lastEventId'))
     def gen():
-        q = broker.subscribe()
+        sub = broker.subscribe(event_filter)
         heartbeat_interval = 15  # seconds
         last_beat = time()
-        while True:
-            # Flush all queued events first for low latency
-            flushed = False
-            while q:
-                ev, data_json = q.popleft()
-                yield f"event: {ev}\ndata: {data_json}\n\n"
-                flushed = True
-            now = time()
-            # Heartbeat comment (ignored by EventSource but keeps connection open across proxies)
-            if now - last_beat >= heartbeat_interval:
-                yield f": ping {int(now)}\n\n"
-                last_beat = now
-            # When idle, slight sleep to avoid tight loop
-            if not flushed:
-                sleep(0.5)
+        sent_upto = last_id
+        try:
+            if last_id is not None:
+                missed, complete = broker.replay(last_id, event_filter)
+                if not complete:
+                    # Too far behind (or ids from a previous run): client must refetch
+                    sent_upto = broker.last_id
+                    yield format_sse((sent_upto, RESYNC_EVENT, '{}', None))
+                for rec in missed:
+                    if sent_upto is None or rec[0] > sent_upto:
+                        yield format_sse(rec)
+                        sent_upto = rec[0]
+            while True:
+                # Block until an event is published or the next heartbeat is due
+                items = sub.wait(max(0.0, heartbeat_interval - (time() - last_beat)))
+                for rec in items:
+                    if sent_upto is not None and rec[0] <= sent_upto:
+                        continue  # already sent from the replay buffer
+                    yield format_sse(rec)
+                now = time()
+                # Heartbeat comment (ignored by EventSource but keeps connection open across proxies)
+                if now - last_beat >= heartbeat_interval:
+                    yield f": ping {int(now)}\n\n"
+                    last_beat = now
+        finally:
+            # Client went away (GeneratorExit on close): stop queueing events for it
+            broker.unsubscribe(sub)
     headers = {
         'Cache-Control': 'no-cache',
         'X-Accel-Buffering': 'no'  # for nginx disabling buffering if ever used
@@ -5652,6 +5152,17 @@ def serve_doctor_photo(fname):
 def _ensure_telegram():
     maybe_start_telegram()
 
+@app.before_request
+def _ensure_storage_compactor():
+    # Journal backend folds doctors.journal into doctors.json in the background
+    if hasattr(_store, 'start_compactor'):
+        _store.start_compactor()
+
+@app.after_request
+def _compress_response(resp):
+    # Uncached JSON/HTML; cached_json_response bodies arrive already encoded
+    return _compressor.apply(resp, request.headers.get('Accept-Encoding', ''))
+
 # --- END appended helpers ---
 
 # ========== PR PORTAL ADDITIONAL APIs ==========
@@ -5661,17 +5172,144 @@ def _ensure_telegram():
 def api_pr_roster_all():
     if not session.get('user'):
         return jsonify({'ok': False, 'error': 'auth required'}), 401
-    roster_path = 'data/pr_roster.json'
-    if os.path.exists(roster_path):
-        with open(roster_path, 'r', encoding='utf-8') as f:
-            roster = json.load(f)
-    else:
-        roster = {}
-    return jsonify(roster)
+    return jsonify(_pr_roster_repo.view())
+
+def _minutes_to_hhmm(minutes) -> str:
+    if minutes is None:
+        return ''
+    minutes %= 1440
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def _pr_leave_days(roster: dict, dates) -> set:
+    """(staff_id, date) pairs on leave: data/pr_leaves.json plus roster cells with a leave code."""
+    wanted = set(dates)
+    out = set()
+    leaves = _pr_leaves_repo.view()
+    for date_str, entries in (leaves.items() if isinstance(leaves, dict) else ()):
+        if date_str in wanted:
+            for entry in entries or []:
+                if isinstance(entry, dict) and entry.get('staff_id') and entry.get('leave_type'):
+                    out.add((str(entry['staff_id']), date_str))
+    for staff_id, days in roster.items():
+        for date_str, entry in (days or {}).items():
+            if date_str in wanted and isinstance(entry, dict) and entry.get('leave'):
+                out.add((staff_id, date_str))
+    return out
+
+def _pr_roster_slots(pr_staff: dict, doctors: list, dates) -> tuple:
+    """Demand for /api/pr/generate-roster as roster_engine slots.
+
+    Clinical: one slot per ON_DUTY doctor at the station of their specialty, on
+    the clinical shift template starting 30-90 min before the doctor (else the
+    first template, else staffStartOffset minutes before). Front: staffCount
+    slots per front shift template bound to a front station, on days with
+    doctors. Returns (slots, clinical_staff, front_staff, days_with_doctors).
+    """
+    station_config = pr_staff.get('stations', {'clinical': [], 'front': []})
+    staff_records = pr_staff.get('staff', [])
+    shift_templates = pr_staff.get('shift_templates', {})
+    offset = int((pr_staff.get('ai_rules') or {}).get('staffStartOffset', 30))
+
+    def has_role(staff_member, role_name: str) -> bool:
+        roles = staff_member.get('roles')
+        if isinstance(roles, list):
+            return role_name in roles
+        return (staff_member.get('role') or '').lower() == role_name
+
+    def template_shifts(team: str) -> list:
+        shifts = []
+        for category_shifts in (shift_templates.get(team) or {}).values():
+            if isinstance(category_shifts, list):
+                shifts.extend(sh for sh in category_shifts if isinstance(sh, dict))
+        return shifts
+
+    clinical_staff = [s for s in staff_records if s.get('active', True) and has_role(s, 'clinical')]
+    front_staff = [s for s in staff_records if s.get('active', True) and has_role(s, 'front')]
+    clinical_shifts = template_shifts('clinical')
+    front_shifts = template_shifts('front')
+    clinical_station_lookup = {
+        (s.get('specialty') or s.get('name') or '').strip().lower(): s
+        for s in station_config.get('clinical', [])
+        if s.get('allow_ai_assignment', True) and (s.get('specialty') or s.get('name'))
+    }
+    front_stations = station_config.get('front', [])
+    front_ids = {fs.get('id') for fs in front_stations if fs.get('id')}
+
+    def clinical_shift_for(doctor_start):
+        """Shift template starting 30-90 min (closest to 30) before the doctor's OPD."""
+        doctor_minutes = roster_engine.hhmm_to_minutes(doctor_start)
+        best, best_diff = None, None
+        for shift in clinical_shifts:
+            start_min = roster_engine.hhmm_to_minutes(shift.get('start'))
+            if doctor_minutes is None or start_min is None:
+                continue
+            diff = doctor_minutes - start_min
+            if 30 <= diff <= 90 and (best is None or abs(diff - 30) < best_diff):
+                best, best_diff = shift, abs(diff - 30)
+        if best is None and clinical_shifts:
+            best = clinical_shifts[0]
+        if best is not None:
+            return roster_engine.hhmm_to_minutes(best.get('start')), roster_engine.hhmm_to_minutes(best.get('end'))
+        if doctor_minutes is None:
+            return 8 * 60, 16 * 60
+        return doctor_minutes - offset, doctor_minutes - offset + 8 * 60
+
+    # Front demand per day with doctors: templates bound to a front station, else one per station
+    front_demand = []
+    for shift in front_shifts:
+        if shift.get('station') in front_ids:
+            front_demand.extend([(shift.get('station'), shift)] * max(1, int(shift.get('staffCount') or 1)))
+    if not front_demand:
+        default_shift = front_shifts[0] if front_shifts else {'start': '07:30', 'end': '15:30'}
+        front_demand = [(fs.get('id'), default_shift) for fs in front_stations if fs.get('id')]
+    front_by_id = {fs.get('id'): fs for fs in front_stations}
+
+    def front_eligible(station_id):
+        return tuple(s['id'] for s in front_staff
+                     if station_id in (s.get('stations') or []) or not front_ids & set(s.get('stations') or []))
+
+    slots = []
+    days_with_doctors = set()
+    for date_str in dates:
+        by_specialty = {}
+        for doctor in doctors:
+            day_schedule = (doctor.get('schedule_by_date') or {}).get(date_str) or {}
+            if day_schedule.get('status') == 'ON_DUTY':
+                key = (doctor.get('specialty') or '').strip().lower()
+                by_specialty.setdefault(key, []).append((doctor, day_schedule))
+        if not by_specialty:
+            continue
+        days_with_doctors.add(date_str)
+        for key, doctor_schedules in by_specialty.items():
+            station = clinical_station_lookup.get(key)
+            if not station or not clinical_staff:
+                continue
+            station_id = station.get('id', '')
+            eligible = tuple(s['id'] for s in clinical_staff if station_id in (s.get('stations') or []))
+            start_min, end_min = clinical_shift_for(doctor_schedules[0][1].get('start_time', '08:00'))
+            label = f'Auto: {station.get("name", "")} - {len(doctor_schedules)} doctor(s)'
+            for _ in doctor_schedules:
+                slots.append(roster_engine.Slot(date_str, station_id, start_min, end_min,
+                                                roster_engine.is_ed_station(station), eligible, label))
+        if front_staff:
+            for station_id, shift in front_demand:
+                station = front_by_id.get(station_id) or {}
+                slots.append(roster_engine.Slot(date_str, station_id, roster_engine.hhmm_to_minutes(shift.get('start')),
+                                                roster_engine.hhmm_to_minutes(shift.get('end')),
+                                                roster_engine.is_ed_station(station), front_eligible(station_id),
+                                                f'Auto: {station.get("name", "Front desk")}'))
+    return slots, clinical_staff, front_staff, days_with_doctors
 
 @app.post('/api/pr/generate-roster')
+@runs_as_job('pr_roster')
 def api_pr_generate_roster():
-    """Generate PR staff roster based on doctor schedules with comprehensive fallback"""
+    """Generate the PR staff roster for a date range from the doctor schedules (see roster_engine).
+
+    Optional seed (default 0) and time_budget (seconds, default ROSTER_TIME_BUDGET);
+    the same seed gives the same roster. Days outside the range and leave
+    entries are kept; mode='incremental' / staff_ids re-solve only part of the
+    range around everything else (see _roster_scope).
+    """
     if not session.get('user'):
         return jsonify({'ok': False, 'error': 'auth required'}), 401
     user_role = (session.get('user', {}).get('role') or '').upper()
@@ -5679,69 +5317,21 @@ def api_pr_generate_roster():
         return jsonify({'ok': False, 'error': 'admin only'}), 403
     
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         start_date = data.get('start_date')
         end_date = data.get('end_date')
         
         if not start_date or not end_date:
             return jsonify({'ok': False, 'error': 'start_date and end_date required'}), 400
-        
-        from datetime import datetime, timedelta
-        
-        # Load doctor schedules from multiple sources
-        doctor_schedules_by_date = {}
-        
-        # Source 1: PR clinical roster
-        clinical_roster_path = 'data/pr_clinical_roster.json'
-        if os.path.exists(clinical_roster_path):
-            with open(clinical_roster_path, 'r', encoding='utf-8') as f:
-                clinical_data = json.load(f)
-                # Handle both formats: direct dates or nested rosters
-                if 'rosters' in clinical_data:
-                    doctor_schedules_by_date = clinical_data.get('rosters', {})
-                else:
-                    doctor_schedules_by_date = clinical_data
-        
-        # Source 2: Main doctors.json (for active ON_DUTY schedules)
-        doctors_path = 'data/doctors.json'
-        if os.path.exists(doctors_path):
-            with open(doctors_path, 'r', encoding='utf-8') as f:
-                doctors_data = json.load(f)
-                doctors_list = doctors_data.get('doctors', [])
-                
-                # Extract schedules from doctor records
-                start = datetime.strptime(start_date, '%Y-%m-%d')
-                end = datetime.strptime(end_date, '%Y-%m-%d')
-                current = start
-                
-                while current <= end:
-                    date_str = current.strftime('%Y-%m-%d')
-                    if date_str not in doctor_schedules_by_date:
-                        doctor_schedules_by_date[date_str] = {}
-                    
-                    # Check each doctor's schedule for this date
-                    for doctor in doctors_list:
-                        schedule_by_date = doctor.get('schedule_by_date', {})
-                        if date_str in schedule_by_date:
-                            day_schedule = schedule_by_date[date_str]
-                            if day_schedule.get('status') == 'ON_DUTY':
-                                specialty = doctor.get('specialty', '')
-                                # Create schedule entry
-                                if not isinstance(doctor_schedules_by_date[date_str], dict):
-                                    doctor_schedules_by_date[date_str] = {}
-                                
-                                # Use doctor ID as key
-                                doctor_schedules_by_date[date_str][str(doctor['id'])] = {
-                                    'duty_type': 'duty',
-                                    'station_id': specialty,
-                                    'specialty': specialty,
-                                    'leave_type': '',
-                                    'start_time': day_schedule.get('start_time', '08:00'),
-                                    'name': doctor.get('name', ''),
-                                    'opd': day_schedule.get('opd', [])
-                                }
-                    
-                    current += timedelta(days=1)
+        try:
+            seed, time_budget = _roster_solver_options(data)
+            incremental, affected = _roster_scope(data)
+        except ValueError as e:
+            return jsonify({'ok': False, 'error': str(e)}), 400
+
+        start = datetime.strptime(start_date, '%Y-%m-%d').date()
+        end = datetime.strptime(end_date, '%Y-%m-%d').date()
+        dates = [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
         
         # Load PR staff & stations
         pr_staff = load_pr_staff()
@@ -5750,352 +5340,79 @@ def api_pr_generate_roster():
         if ensure_changed or specialty_mutated:
             save_pr_staff(pr_staff)
 
-        station_config = pr_staff.get('stations', {'clinical': [], 'front': []})
-        staff_records = pr_staff.get('staff', [])
-        shift_templates = pr_staff.get('shift_templates', {})
-        opdinfo = _load_opdinfo()
-        
-        # Helper functions
-        def has_role(staff_member, role_name: str) -> bool:
-            roles = staff_member.get('roles')
-            if isinstance(roles, list):
-                return role_name in roles
-            return (staff_member.get('role') or '').lower() == role_name
-
-        def time_to_minutes(time_str):
-            try:
-                if not time_str:
-                    return 0
-                hours, mins = time_str.split(':')
-                return int(hours) * 60 + int(mins)
-            except:
-                return 0
-        
-        def find_matching_clinical_shift(doctor_opd_start, clinical_shifts):
-            """Find clinical shift that starts 30-90 min before doctor OPD"""
-            doctor_minutes = time_to_minutes(doctor_opd_start)
-            best_match = None
-            best_diff = 999
-            
-            for shift in clinical_shifts:
-                shift_minutes = time_to_minutes(shift.get('start', ''))
-                diff = doctor_minutes - shift_minutes
-                
-                # Clinical should start 30-90 min before doctor
-                if 30 <= diff <= 90:
-                    if abs(diff - 30) < best_diff:  # Prefer 30 min offset
-                        best_diff = abs(diff - 30)
-                        best_match = shift
-            
-            return best_match or (clinical_shifts[0] if clinical_shifts else None)
-        
-        # Get active staff
-        clinical_staff = [s for s in staff_records if s.get('active', True) and has_role(s, 'clinical')]
-        front_staff = [s for s in staff_records if s.get('active', True) and has_role(s, 'front')]
-        
+        slots, clinical_staff, front_staff, days_with_doctors = _pr_roster_slots(
+            pr_staff, load_data().get('doctors', []), dates)
         if not clinical_staff and not front_staff:
             return jsonify({'ok': False, 'error': 'No active staff members found'}), 400
-        
-        # Build clinical shift pool
-        clinical_shifts = []
-        clinical_team_templates = shift_templates.get('clinical', {})
-        for category_name, category_shifts in clinical_team_templates.items():
-            if isinstance(category_shifts, list):
-                clinical_shifts.extend(category_shifts)
-        
-        # Build doctor-to-clinical mapping
-        doctor_clinical_mapping = {}
-        for specialty, opd_data in opdinfo.items():
-            if not isinstance(opd_data, dict):
-                continue
-            doctor_clinical_mapping[specialty] = {}
-            for shift_key in ['shift1', 'shift2']:
-                shift_info = opd_data.get(shift_key, {})
-                if not shift_info or not isinstance(shift_info, dict):
-                    continue
-                opd_start = shift_info.get('start', '')
-                if opd_start:
-                    matching_shift = find_matching_clinical_shift(opd_start, clinical_shifts)
-                    if matching_shift:
-                        doctor_clinical_mapping[specialty][opd_start] = matching_shift
-        
-        # Generate roster
-        start = datetime.strptime(start_date, '%Y-%m-%d')
-        end = datetime.strptime(end_date, '%Y-%m-%d')
+
+        staff_ids = list(dict.fromkeys(s['id'] for s in clinical_staff + front_staff))
+        rules = roster_engine.Rules.from_ai_rules(pr_staff.get('ai_rules'))
+        horizon = roster_engine.context_days(start_date, end_date, rules)
+        roster = _load_pr_roster()
+        stations = pr_staff.get('stations', {})
+        ed_station_ids = {st.get('id') for st in stations.get('clinical', []) + stations.get('front', [])
+                          if roster_engine.is_ed_station(st)}
+
+        def cells():
+            for staff_id, days in roster.items():
+                for date_str, entry in (days or {}).items():
+                    if not isinstance(entry, dict):
+                        continue
+                    station_id = entry.get('station') or ''
+                    kind = 'leave' if entry.get('leave') else ('duty' if station_id else 'off')
+                    slot = roster_engine.Slot(date_str, station_id, roster_engine.hhmm_to_minutes(entry.get('shift_start')),
+                                              roster_engine.hhmm_to_minutes(entry.get('shift_end')),
+                                              station_id in ed_station_ids, (), entry.get('notes', ''))
+                    yield staff_id, date_str, kind, slot, bool(entry.get('manual'))
+
+        fixed, leave_days, kept = _roster_resolve_plan(cells(), dates, set(horizon), affected, keep_manual=incremental)
+        leave_days |= _pr_leave_days(roster, horizon)
+        in_range = set(dates)
+        slots = roster_engine.uncovered(slots, {k: v for k, v in fixed.items() if k[1] in in_range})
+        if affected is not None:
+            slots = [sl._replace(eligible=tuple(x for x in sl.eligible if x in affected)) for sl in slots]
+        result = roster_engine.solve(horizon, staff_ids, slots, rules, unavailable=leave_days, fixed=fixed,
+                                     time_budget=time_budget, seed=seed,
+                                     progress=lambda f: report_progress(f, 'solving'))
+
+        # Replace the re-solved cells, keeping other days, other staff, leave and (incremental) manual cells
         generated = {}
-        
-        clinical_station_pool = [s for s in station_config.get('clinical', []) if s.get('allow_ai_assignment', True)]
-        clinical_station_lookup = {
-            (s.get('specialty') or s.get('name') or '').strip().lower(): s
-            for s in clinical_station_pool
-            if (s.get('specialty') or s.get('name'))
-        }
-        
-        # Pool-based day-off distribution for fair rotation
-        # Track consecutive work days and per-station counts for each staff
-        staff_work_days = {s['id']: 0 for s in staff_records if s.get('active', True)}
-        staff_station_counts = {s['id']: {} for s in staff_records if s.get('active', True)}  # {staff_id: {station_id: count}}
-        
-        current_date = start
-        clinical_staff_rotation = {s.get('id'): 0 for s in clinical_staff}  # Track rotation index
-        front_staff_rotation = {s.get('id'): 0 for s in front_staff}  # Track rotation index
-        
+        for staff_id, days in roster.items():
+            for date_str, entry in (days or {}).items():
+                if date_str not in in_range or (staff_id, date_str) in kept:
+                    generated.setdefault(staff_id, {})[date_str] = entry
+        front_station_ids = {fs.get('id') for fs in stations.get('front', [])}
         stats = {
-            'total_days': 0,
-            'days_with_doctors': 0,
-            'days_without_doctors': 0,
+            'total_days': len(dates),
+            'days_with_doctors': len(days_with_doctors),
+            'days_without_doctors': len(dates) - len(days_with_doctors),
             'clinical_assigned': 0,
             'front_assigned': 0,
-            'days_off_distributed': 0
+            'days_off_distributed': 0,
+            'kept': len(kept),
+            'unfilled': len(result.unfilled),
+            'violations': result.violations,
+            'solver': result.stats,
         }
-        
-        while current_date <= end:
-            date_str = current_date.strftime('%Y-%m-%d')
-            stats['total_days'] += 1
-            
-            # Get doctor schedules for this date
-            date_doctor_schedules = doctor_schedules_by_date.get(date_str, {})
-            has_doctors = bool(date_doctor_schedules and len(date_doctor_schedules) > 0)
-            
-            if has_doctors:
-                stats['days_with_doctors'] += 1
-            else:
-                stats['days_without_doctors'] += 1
-            
-            # ONLY assign clinical staff when doctors are present
-            if clinical_staff and has_doctors:
-                # Calculate day of week for smart day-off distribution
-                day_of_week = current_date.weekday()  # 0=Monday, 6=Sunday
-                days_since_start = (current_date - start).days
-                
-                # Rotate which pool gets priority day off (changes every 2-3 days)
-                day_off_pool = ['A', 'B', 'C', 'D'][(days_since_start // 2) % 4]
-                
-                # Group doctors by specialty to assign multiple staff if needed
-                specialty_assignments = {}
-                for doctor_id, schedule in date_doctor_schedules.items():
-                    specialty = schedule.get('specialty') or schedule.get('station_id', '')
-                    specialty_key = specialty.strip().lower()
-                    
-                    if specialty_key not in specialty_assignments:
-                        specialty_assignments[specialty_key] = []
-                    specialty_assignments[specialty_key].append(schedule)
-                
-                # Assign staff for each specialty
-                for specialty_key, doctor_schedules in specialty_assignments.items():
-                    # Find matching station
-                    station = clinical_station_lookup.get(specialty_key)
-                    if not station:
-                        continue
-                    
-                    station_id = station.get('id', '')
-                    
-                    # Determine how many staff needed (at least 1 per 2 doctors)
-                    staff_needed = max(1, len(doctor_schedules))
-                    
-                    # Find all available staff for this station
-                    available_staff = []
-                    for staff in clinical_staff:
-                        staff_stations = staff.get('stations', [])
-                        staff_pools = staff.get('pools', [])
-                        staff_id = staff['id']
-                        
-                        # Staff MUST have this station
-                        if station_id not in staff_stations:
-                            continue
-                        
-                        # Skip if already assigned today
-                        if generated.get(staff_id) and date_str in generated[staff_id]:
-                            continue
-
-                        # Hard rule: do not assign same clinical station more than 2 times in the whole range
-                        station_counts = staff_station_counts.get(staff_id, {})
-                        if station_counts.get(station_id, 0) >= 2:
-                            continue
-                        
-                        # Smart day-off logic: give rest to overworked staff from priority pool
-                        consecutive_days = staff_work_days.get(staff_id, 0)
-                        
-                        # Skip if this staff is in day-off pool and worked 5+ days straight
-                        if day_off_pool in staff_pools and consecutive_days >= 5:
-                            stats['days_off_distributed'] += 1
-                            continue
-                        
-                        # Calculate priority score (lower = higher priority)
-                        priority = consecutive_days * 10
-                        
-                        # Bonus priority for staff who haven't worked recently
-                        if consecutive_days == 0:
-                            priority -= 50
-                        
-                        available_staff.append({
-                            'staff': staff,
-                            'priority': priority,
-                            'consecutive_days': consecutive_days
-                        })
-                    
-                    if not available_staff:
-                        continue
-                    
-                    # Sort by priority (lowest first = least worked recently)
-                    available_staff.sort(key=lambda x: x['priority'])
-                    
-                    # Assign staff (up to staff_needed)
-                    assigned_count = 0
-                    for staff_info in available_staff[:staff_needed]:
-                        staff = staff_info['staff']
-                        staff_id = staff['id']
-                        
-                        if not generated.get(staff_id):
-                            generated[staff_id] = {}
-                        
-                        # Get first doctor's timing for this specialty
-                        first_schedule = doctor_schedules[0]
-                        opd_start = first_schedule.get('start_time', '08:00')
-                        opd_end = first_schedule.get('end_time', '16:00')
-                        
-                        # Find matching clinical shift
-                        specialty_mapping = doctor_clinical_mapping.get(specialty_key, {})
-                        matching_shift = specialty_mapping.get(opd_start) or (clinical_shifts[0] if clinical_shifts else None)
-                        
-                        # Calculate shift times
-                        if matching_shift:
-                            shift_start = matching_shift.get('start', '')
-                            shift_end = matching_shift.get('end', '')
-                        else:
-                            # Default: 30 min before doctor
-                            try:
-                                doc_h, doc_m = opd_start.split(':')
-                                staff_start_min = int(doc_h) * 60 + int(doc_m) - 30
-                                shift_start = f"{staff_start_min // 60:02d}:{staff_start_min % 60:02d}"
-                                shift_end = opd_end
-                            except:
-                                shift_start = '08:00'
-                                shift_end = '16:00'
-                        
-                        generated[staff_id][date_str] = {
-                            'station': station_id,
-                            'leave': '',
-                            'shift_start': shift_start,
-                            'shift_end': shift_end,
-                            'notes': f'Auto: {station.get("name", "")} - {len(doctor_schedules)} doctor(s)'
-                        }
-                        
-                        # Track work days and station usage
-                        staff_work_days[staff_id] = staff_work_days.get(staff_id, 0) + 1
-                        station_counts = staff_station_counts.setdefault(staff_id, {})
-                        station_counts[station_id] = station_counts.get(station_id, 0) + 1
-                        assigned_count += 1
-                        stats['clinical_assigned'] += 1
-            
-            # Front staff: ONLY assign when doctors are present
-            if front_staff and has_doctors:
-                front_stations = station_config.get('front', [])
-                num_front_to_assign = min(len(front_staff), max(1, len(front_stations)))
-                
-                # Get front desk shift templates
-                front_team_templates = shift_templates.get('front', {})
-                front_shifts = []
-                for category_name, category_shifts in front_team_templates.items():
-                    if isinstance(category_shifts, list):
-                        front_shifts.extend(category_shifts)
-                
-                # Day-off pool rotation
-                days_since_start = (current_date - start).days
-                day_off_pool = ['A', 'B', 'C', 'D'][(days_since_start // 2) % 4]
-                
-                # Build priority list of available staff
-                available_front = []
-                for staff in front_staff:
-                    staff_id = staff['id']
-                    staff_pools = staff.get('pools', [])
-                    
-                    # Skip if already assigned
-                    if generated.get(staff_id) and date_str in generated[staff_id]:
-                        continue
+        for slot, staff_id in result.pairs():
+            generated.setdefault(staff_id, {})[slot.day] = {
+                'station': slot.station,
+                'leave': '',
+                'shift_start': _minutes_to_hhmm(slot.start),
+                'shift_end': _minutes_to_hhmm(slot.end),
+                'notes': slot.label
+            }
+            stats['front_assigned' if slot.station in front_station_ids else 'clinical_assigned'] += 1
+        stats['days_off_distributed'] = sum(
+            1 for staff_id in staff_ids for date_str in days_with_doctors
+            if (affected is None or staff_id in affected)
+            and date_str not in generated.get(staff_id, {}) and (staff_id, date_str) not in leave_days)
 
-                    # Hard rule: do not assign same front station more than 2 times in the whole range
-                    front_counts = staff_station_counts.get(staff_id, {})
-                    # We cannot yet know which station index they will take, but if they already
-                    # hit 2+ for *all* front stations we skip them to force rotation.
-                    front_ids = [fs.get('id') for fs in station_config.get('front', [])]
-                    if front_ids and all(front_counts.get(fid, 0) >= 2 for fid in front_ids if fid):
-                        continue
-                    
-                    consecutive_days = staff_work_days.get(staff_id, 0)
-                    
-                    # Give day off to priority pool after 5+ days
-                    if day_off_pool in staff_pools and consecutive_days >= 5:
-                        stats['days_off_distributed'] += 1
-                        continue
-                    
-                    # Priority: least worked gets assigned first
-                    priority = consecutive_days * 10
-                    if consecutive_days == 0:
-                        priority -= 50
-                    
-                    available_front.append({
-                        'staff': staff,
-                        'priority': priority
-                    })
-                
-                # Sort by priority
-                available_front.sort(key=lambda x: x['priority'])
-                
-                # Assign up to num_front_to_assign staff
-                for i in range(min(num_front_to_assign, len(available_front))):
-                    staff = available_front[i]['staff']
-                    staff_id = staff['id']
-                    
-                    if not generated.get(staff_id):
-                        generated[staff_id] = {}
-                    
-                    # Assign to specific front station (try to pick the one used least by this staff)
-                    station = None
-                    if front_stations:
-                        front_counts = staff_station_counts.setdefault(staff_id, {})
-                        station = min(
-                            front_stations,
-                            key=lambda s: front_counts.get(s.get('id'), 0)
-                        )
-                    station_id = station.get('id', '') if station else ''
-                    
-                    # Get shift timing
-                    default_shift = front_shifts[0] if front_shifts else None
-                    shift_start = default_shift.get('start', '07:30') if default_shift else '07:30'
-                    shift_end = default_shift.get('end', '15:30') if default_shift else '15:30'
-                    
-                    generated[staff_id][date_str] = {
-                        'station': station_id,
-                        'leave': '',
-                        'shift_start': shift_start,
-                        'shift_end': shift_end,
-                        'notes': f'Auto: {station.get("name", "Front desk")}' if station else 'Auto-assigned'
-                    }
-                    
-                    # Track work days and station usage
-                    staff_work_days[staff_id] = staff_work_days.get(staff_id, 0) + 1
-                    front_counts = staff_station_counts.setdefault(staff_id, {})
-                    if station_id:
-                        front_counts[station_id] = front_counts.get(station_id, 0) + 1
-                    stats['front_assigned'] += 1
-            
-            # Reset work day counter for staff not assigned today (day off)
-            for staff in staff_records:
-                if staff.get('active', True):
-                    staff_id = staff['id']
-                    if not (generated.get(staff_id) and date_str in generated[staff_id]):
-                        staff_work_days[staff_id] = 0  # Reset counter on day off
-            
-            current_date += timedelta(days=1)
-        
-        # Save generated roster
-        roster_path = 'data/pr_roster.json'
-        with open(roster_path, 'w', encoding='utf-8') as f:
-            json.dump(generated, f, indent=2, ensure_ascii=False)
+        _save_pr_roster(generated)
         
         return jsonify({
             'ok': True,
+            'mode': 'incremental' if incremental else 'full',
             'roster': generated,
             'message': f'Roster generated successfully for {stats["total_days"]} days',
             'stats': stats,
@@ -6114,6 +5431,7 @@ def api_pr_generate_roster():
         return jsonify({'ok': False, 'error': str(e)}), 500
 
 @app.post('/api/pr/export-excel')
+@runs_as_job('pr_export')
 def api_pr_export_excel():
     """Export roster to Excel in OneDrive format"""
     if not session.get('user'):
@@ -6237,18 +5555,12 @@ def api_pr_roster_update():
     staff_id = data.get('staff_id')
     date = data.get('date')
     assignment = data.get('assignment')
-    roster_path = 'data/pr_roster.json'
-    if os.path.exists(roster_path):
-        with open(roster_path, 'r', encoding='utf-8') as f:
-            roster = json.load(f)
-    else:
-        roster = {}
-    if staff_id not in roster:
-        roster[staff_id] = {}
-    roster[staff_id][date] = assignment
-    os.makedirs(os.path.dirname(roster_path), exist_ok=True)
-    with open(roster_path, 'w', encoding='utf-8') as f:
-        json.dump(roster, f, indent=2, ensure_ascii=False)
+    if isinstance(assignment, dict):
+        assignment.setdefault('manual', True)  # kept by incremental regeneration
+    with _pr_roster_repo.edit() as roster:
+        if staff_id not in roster:
+            roster[staff_id] = {}
+        roster[staff_id][date] = assignment
     return jsonify({'ok': True})
 
 @app.get('/api/pr/roster/export')
@@ -6262,23 +5574,14 @@ def api_pr_roster_export():
 def api_pr_leaves_all():
     if not session.get('user'):
         return jsonify({'ok': False, 'error': 'auth required'}), 401
-    leaves_path = 'data/pr_leaves.json'
-    if os.path.exists(leaves_path):
-        with open(leaves_path, 'r', encoding='utf-8') as f:
-            leaves = json.load(f)
-    else:
-        leaves = {}
-    return jsonify(leaves)
+    return jsonify(_pr_leaves_repo.view())
 
 @app.post('/api/pr/leaves/update')
 def api_pr_leaves_update():
     if not session.get('user'):
         return jsonify({'ok': False, 'error': 'auth required'}), 401
     leaves = request.get_json()
-    leaves_path = 'data/pr_leaves.json'
-    os.makedirs(os.path.dirname(leaves_path), exist_ok=True)
-    with open(leaves_path, 'w', encoding='utf-8') as f:
-        json.dump(leaves, f, indent=2, ensure_ascii=False)
+    _pr_leaves_repo.save(leaves)
     return jsonify({'ok': True})
 
 @app.get('/api/pr/leaves/export')
@@ -6293,25 +5596,15 @@ def api_telegram_config():
     config = request.get_json()
     bot_token = config.get('bot_token')
     group_id = config.get('group_id')
-    settings_path = 'data/settings.json'
-    if os.path.exists(settings_path):
-        with open(settings_path, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
-    else:
-        settings = {}
-    settings['telegram'] = {'bot_token': bot_token, 'group_id': group_id, 'enabled': True}
-    with open(settings_path, 'w', encoding='utf-8') as f:
-        json.dump(settings, f, indent=2)
+    with _settings_repo.edit() as settings:
+        settings['telegram'] = {'bot_token': bot_token, 'group_id': group_id, 'enabled': True}
     return jsonify({'ok': True})
 
 @app.get('/api/telegram/test')
 def api_telegram_test():
-    settings_path = 'data/settings.json'
-    if os.path.exists(settings_path):
-        with open(settings_path, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
-            if 'telegram' in settings and settings['telegram'].get('enabled'):
-                return jsonify({'ok': True, 'message': 'Configured but not tested'})
+    settings = load_settings()
+    if 'telegram' in settings and settings['telegram'].get('enabled'):
+        return jsonify({'ok': True, 'message': 'Configured but not tested'})
     return jsonify({'ok': False, 'message': 'Not configured'})
 
 @app.post('/api/telegram/sync')
@@ -6326,15 +5619,8 @@ def api_onedrive_config():
     config = request.get_json()
     token = config.get('token')
     sheet_id = config.get('sheet_id')
-    settings_path = 'data/settings.json'
-    if os.path.exists(settings_path):
-        with open(settings_path, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
-    else:
-        settings = {}
-    settings['onedrive'] = {'token': token, 'sheet_id': sheet_id}
-    with open(settings_path, 'w', encoding='utf-8') as f:
-        json.dump(settings, f, indent=2)
+    with _settings_repo.edit() as settings:
+        settings['onedrive'] = {'token': token, 'sheet_id': sheet_id}
     return jsonify({'ok': True})
 
 @app.get('/api/onedrive/test')
@@ -6347,4 +5633,6 @@ if __name__ == '__main__':
     port = int(os.environ.get('FLASK_RUN_PORT','5000'))
     debug = os.environ.get('FLASK_DEBUG','1') == '1'
     maybe_start_telegram()
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_async_sse()
     app.run(host=host, port=port, debug=debug, threaded=True)
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""
+Benchmark: Excel schedule ingestion, full openpyxl load vs read-only streaming.
+
+Writes a synthetic grouped schedule workbook (the layout produced by
+/api/schedule/template?group=1: a date row, then per specialty a title row,
+a header row and one row per doctor; default ~50k rows) and times one and two
+passes over its rows with load_workbook(data_only=True) against
+schedule_parser.XlsxRows. Peak Python memory is measured separately with
+tracemalloc. (apply_excel used to make two passes over grouped files; it now
+makes one.)
+
+Usage:
+  python bench_excel_ingest.py [rows] [path]
+"""
+
+import os
+import sys
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+from time import perf_counter
+
+from openpyxl import Workbook, load_workbook
+
+from schedule_parser import XlsxRows
+
+HEADER = ['Date', 'Doctor', 'Start Time', 'Room', 'Total Patients',
+          'Before Break OPD Patients (time/pts)', 'Breaks', 'After Break OPD Patients (time/pts)', 'Status']
+SPECIALTIES = 12
+DOCTORS_PER_SPECIALTY = 8
+
+
+def make_workbook(path: str, n_rows: int) -> int:
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Schedule')
+    ws.append(['Doctor Schedule Template'])
+    rows = 1
+    day = date(2025, 1, 1)
+    while rows < n_rows:
+        if day.weekday() != 4:
+            ws.append([f"{day.day} {day.strftime('%A %Y')} {day.strftime('%d/%m/%Y')}"])
+            rows += 1
+            for s in range(SPECIALTIES):
+                ws.append([f'Specialty {s + 1}'])
+                ws.append(HEADER)
+                rows += 2
+                for k in range(DOCTORS_PER_SPECIALTY):
+                    ws.append([day.strftime('%d/%m/%Y'), f'Dr. Doctor {s * DOCTORS_PER_SPECIALTY + k + 1}',
+                               '08:00', 100 + k, 20, '08:00-12:00 15', '12:00-13:00', '13:00-15:00 5', None])
+                    rows += 1
+                ws.append([])
+                rows += 1
+        day += timedelta(days=1)
+    wb.save(path)
+    return rows
+
+
+def passes_full(path: str, passes: int) -> int:
+    ws = load_workbook(path, data_only=True).active
+    n = 0
+    for _ in range(passes):
+        for row in ws.iter_rows(values_only=True):
+            n += 1
+    return n
+
+
+def passes_stream(path: str, passes: int) -> int:
+    rows = XlsxRows(path)
+    n = 0
+    for _ in range(passes):
+        for row in rows:
+            n += 1
+    return n
+
+
+def measure(fn, path, passes):
+    t0 = perf_counter()
+    n = fn(path, passes)
+    elapsed = perf_counter() - t0
+    tracemalloc.start()
+    fn(path, passes)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return n, elapsed, peak / (1024 * 1024)
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(tempfile.gettempdir(), f'bench_grouped_{n_rows}.xlsx')
+    if not os.path.exists(path):
+        written = make_workbook(path, n_rows)
+        print(f"wrote {written} rows to {path} ({os.path.getsize(path) / 1024:.0f} KB)")
+    for passes in (1, 2):
+        print(f"{passes} pass(es) over the active sheet:")
+        for label, fn in (('full load_workbook', passes_full), ('read-only XlsxRows', passes_stream)):
+            n, seconds, peak_mb = measure(fn, path, passes)
+            print(f"  {label:<20} {n:>8} rows  {seconds:7.2f} s  peak {peak_mb:8.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark: JSON decode/encode of doctors.json, stdlib json vs json_codec.
+
+Times what the app does with the data file and with API responses:
+parsing doctors.json, writing it back (indent=2 on disk) and encoding a
+response the way Flask's default provider does (sorted keys, ASCII-escaped,
+compact) against json_codec.dumps. --scale N repeats the doctors list N times
+(with fresh ids) to see how a larger roster behaves.
+
+Usage:
+  python bench_json.py [path/to/doctors.json] [--scale N] [--repeat R]
+"""
+
+import argparse
+import json
+import os
+from time import perf_counter
+
+import json_codec
+
+
+def scaled(data: dict, factor: int) -> dict:
+    if factor <= 1:
+        return data
+    doctors = data.get('doctors') or []
+    out = []
+    for k in range(factor):
+        for d in doctors:
+            out.append(dict(d, id=f"{d.get('id')}-{k}" if k else d.get('id')))
+    return dict(data, doctors=out)
+
+
+def timeit(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = perf_counter()
+        fn()
+        best = min(best, perf_counter() - t0)
+    return best * 1000.0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('path', nargs='?', default=os.path.join('data', 'doctors.json'))
+    ap.add_argument('--scale', type=int, default=1)
+    ap.add_argument('--repeat', type=int, default=20)
+    args = ap.parse_args()
+
+    with open(args.path, 'rb') as f:
+        data = scaled(json.loads(f.read().decode('utf-8')), args.scale)
+    raw = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    n_days = sum(len(d.get('schedule_by_date') or {}) for d in data.get('doctors', []))
+
+    # Sanity: both encoders produce the same document
+    assert json_codec.loads(json_codec.dumps(data)) == data
+    assert json_codec.loads(json_codec.dumps(data, pretty=True)) == json.loads(raw)
+
+    r = args.repeat
+    results = [
+        ('decode  stdlib json.loads', timeit(lambda: json.loads(raw.decode('utf-8')), r)),
+        (f'decode  json_codec ({json_codec.BACKEND})', timeit(lambda: json_codec.loads(raw), r)),
+        ('encode  disk, stdlib indent=2', timeit(lambda: json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'), r)),
+        ('encode  disk, json_codec pretty', timeit(lambda: json_codec.dumps(data, pretty=True), r)),
+        ('encode  disk, json_codec compact', timeit(lambda: json_codec.dumps(data), r)),
+        ('encode  wire, Flask default provider',
+         timeit(lambda: json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8'), r)),
+        ('encode  wire, json_codec sorted', timeit(lambda: json_codec.dumps(data, sort_keys=True), r)),
+    ]
+    sizes = [
+        ('stdlib indent=2', len(raw)),
+        ('json_codec pretty', len(json_codec.dumps(data, pretty=True))),
+        ('json_codec compact', len(json_codec.dumps(data))),
+    ]
+    print(f"{args.path}: {len(data.get('doctors', []))} doctors, {n_days} schedule days, "
+          f"backend {json_codec.BACKEND}, best of {r}")
+    for label, ms in results:
+        print(f"  {label:<40} {ms:9.3f} ms")
+    for label, size in sizes:
+        print(f"  size {label:<35} {size / 1024:9.1f} KB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Benchmark: doctor name matching, per-query scan vs DoctorNameIndex.
+
+Uses the doctors in data/doctors.json plus synthetic ones (default 300 in
+total) and a mix of Telegram-style messages ("Dr Asish on leave today",
+misspelt names, "Name shift 2" lines) and Excel name cells. Times the old
+implementations (re-tokenise every doctor per query, difflib over all of
+them) against the index, including the index build, and reports how often the
+two pick the same doctor.
+
+Usage:
+  python bench_name_index.py [doctors] [queries]
+"""
+
+import difflib
+import json
+import os
+import random
+import re
+import sys
+from time import perf_counter
+
+from name_index import DoctorNameIndex, name_tokens, norm_name
+
+FIRST = ['Aminath', 'Ahmed', 'Mohamed', 'Fathimath', 'Ibrahim', 'Hassan', 'Aishath', 'Ali', 'Mariyam',
+         'Hussain', 'Khadeeja', 'Abdulla', 'Saroj', 'Rachit', 'Su', 'Ei', 'Cho', 'Rubab', 'Nafeesa', 'Roshan']
+LAST = ['Shareef', 'Rasheed', 'Thapa', 'Pokharel', 'Kyaw', 'Myint', 'Latheef', 'Waheed', 'Naseem',
+        'Shakoor', 'Girgis', 'Joshi', 'Rajak', 'Mon', 'Zahir', 'Didi', 'Manik', 'Saeed', 'Adam', 'Riza']
+SUFFIXES = [' on leave today', ' sick', ' off duty', ' on call tonight', ' shift 2', ' cancel opd', '']
+
+
+def load_doctors(n: int, seed: int = 3) -> list:
+    rnd = random.Random(seed)
+    doctors = []
+    path = os.path.join('data', 'doctors.json')
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as fh:
+            doctors = [{'name': d.get('name', ''), 'keywords': d.get('keywords') or []}
+                       for d in json.load(fh).get('doctors', [])]
+    while len(doctors) < n:
+        name = f'Dr. {rnd.choice(FIRST)} {rnd.choice(LAST)} {rnd.choice(LAST)}'
+        doctors.append({'name': name, 'keywords': [t.lower() for t in name.split()[1:3]]})
+    return doctors[:n]
+
+
+def misspell(word: str, rnd) -> str:
+    if len(word) < 5:
+        return word
+    i = rnd.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1:]
+
+
+def make_queries(doctors: list, n: int, seed: int = 4) -> list:
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        words = doctors[rnd.randrange(len(doctors))]['name'].split()[1:]
+        kind = rnd.random()
+        if kind < 0.4:
+            name = ' '.join(words)
+        elif kind < 0.7:
+            name = words[0]
+        else:
+            name = ' '.join(misspell(w, rnd) for w in words[:2])
+        out.append(rnd.choice(['Dr ', 'dr. ', '']) + name + rnd.choice(SUFFIXES))
+    return out
+
+
+def legacy_match_text(text: str, doctors: list):
+    """The pre-index _match_doctor_by_text scoring over every doctor."""
+    def norm(s):
+        return norm_name(s)
+    toks = set(name_tokens(text)) if text else set()
+    msg_norm = norm(text)
+    best, best_score = None, 0.0
+    for d in doctors:
+        raw_name = d.get('name', '') or ''
+        name_norm = norm(raw_name)
+        dtoks = set(name_tokens(raw_name))
+        if not (name_norm or dtoks):
+            continue
+        overlap = toks & dtoks if toks else set()
+        base = (len(overlap) / max(1, len(dtoks))) if dtoks else 0.0
+        prefix_bonus = 0.0
+        for t in (toks or {""}):
+            if t and len(t) > 2 and name_norm.startswith(t):
+                prefix_bonus = 0.6
+                break
+        kw_bonus = 0.0
+        for kw in d.get('keywords') or []:
+            k = norm(str(kw))
+            if k and ((toks and k in toks) or k in msg_norm):
+                kw_bonus = 0.5
+                break
+        ratio = difflib.SequenceMatcher(None, name_norm, msg_norm).ratio() if msg_norm and name_norm else 0.0
+        score = base + prefix_bonus + kw_bonus + 0.35 * ratio
+        if dtoks and dtoks.issubset(toks):
+            score = max(score, 1.0)
+        if score > best_score:
+            best, best_score = d, score
+    return best
+
+
+def legacy_match_subset(text: str, doctors: list):
+    """The pre-index Excel/shift-line matcher: largest token subset."""
+    tokens = set(name_tokens(text))
+    match, score = None, 0
+    for d in doctors:
+        dtoks = set(name_tokens(d.get('name', '')))
+        if dtoks and dtoks.issubset(tokens) and len(dtoks) > score:
+            match, score = d, len(dtoks)
+    return match
+
+
+def timed(fn, queries):
+    t0 = perf_counter()
+    results = [fn(q) for q in queries]
+    return results, perf_counter() - t0
+
+
+def main():
+    n_doctors = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    doctors = load_doctors(n_doctors)
+    queries = make_queries(doctors, n_queries)
+    cells = [re.sub(r'\s+(on|sick|off|shift|cancel).*$', '', q) for q in queries]
+
+    t0 = perf_counter()
+    index = DoctorNameIndex(doctors)
+    build = perf_counter() - t0
+    print(f"{len(doctors)} doctors, {len(queries)} queries; index build {build * 1000:.1f} ms")
+
+    for label, old, new, qs in (
+        ('free text (Telegram)', lambda q: legacy_match_text(q, doctors), index.match_text, queries),
+        ('token subset (Excel)', lambda q: legacy_match_subset(q, doctors), index.match_subset, cells),
+    ):
+        old_res, old_s = timed(old, qs)
+        new_res, new_s = timed(new, qs)
+        same = sum(1 for a, b in zip(old_res, new_res) if a is b)
+        print(f"  {label:<22} scan {old_s * 1e6 / len(qs):9.1f} us/query   "
+              f"index {new_s * 1e6 / len(qs):8.1f} us/query   x{old_s / max(new_s, 1e-9):6.1f}   "
+              f"same result {same}/{len(qs)}")
+
+
+if __name__ == '__main__':
+    main()
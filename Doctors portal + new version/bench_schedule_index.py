@@ -0,0 +1,133 @@
+"""
+Benchmark: /api/window and /api/day row building, nested scan vs ScheduleIndex.
+
+Builds a synthetic data set (default 200 doctors x 365 days, ~70% of days
+scheduled) and times the old per-request scan against the index: cold
+(rebuild + rows), warm (cached rows) and after a single-day edit.
+
+Usage:
+  python bench_schedule_index.py [doctors] [days] [repeat]
+"""
+
+import random
+import sys
+from datetime import date, timedelta
+from time import perf_counter
+
+from schedule_index import ScheduleIndex, window_row, day_row
+
+
+def make_data(n_doctors: int, n_days: int, seed: int = 1) -> dict:
+    rnd = random.Random(seed)
+    start = date(2025, 1, 1)
+    doctors = []
+    for i in range(n_doctors):
+        sched = {}
+        for k in range(n_days):
+            if rnd.random() < 0.7:
+                iso = (start + timedelta(days=k)).isoformat()
+                sched[iso] = {
+                    'status': rnd.choice(['ON_DUTY', 'ON_DUTY', 'ON_CALL', 'LEAVE']),
+                    'start_time': '08:00', 'room': str(rnd.randint(1, 40)),
+                    'patient_count': rnd.randint(5, 30), 'opd': [{'range': '08:00-12:00'}],
+                    'breaks': ['12:00-13:00'], 'last_update': '2025-01-01T00:00:00Z',
+                }
+        doctors.append({'id': i + 1, 'name': f'Dr. Doctor {i + 1}', 'specialty': f'Spec {i % 15}',
+                        'image_version': 1, 'schedule_by_date': sched})
+    return {'doctors': doctors}
+
+
+def window_dates(n_days: int, days: int = 30):
+    start = date(2025, 1, 1) + timedelta(days=n_days // 2)
+    out = []
+    i = 0
+    while len(out) < days:
+        d = start + timedelta(days=i)
+        i += 1
+        if d.weekday() != 4:
+            out.append(d.isoformat())
+    return out
+
+
+def scan_window(data: dict, dates):
+    """The pre-index implementation: every doctor, every day, fresh dicts."""
+    window = []
+    for iso in dates:
+        day_doctors = []
+        for d in data.get('doctors', []):
+            per_date = {}
+            if isinstance(d.get('schedule_by_date'), dict):
+                per_date = d['schedule_by_date'].get(iso, {})
+            day_doctors.append(window_row(d, per_date))
+        window.append({'date': iso, 'doctors': day_doctors})
+    return window
+
+
+def scan_day(data: dict, iso: str):
+    docs = []
+    for d in data.get('doctors', []):
+        if not isinstance(d.get('schedule_by_date'), dict):
+            continue
+        per_date = d['schedule_by_date'].get(iso)
+        if per_date:
+            docs.append(day_row(d, per_date))
+    return docs
+
+
+def timeit(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = perf_counter()
+        fn()
+        best = min(best, perf_counter() - t0)
+    return best * 1000.0
+
+
+def main():
+    n_doctors = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    data = make_data(n_doctors, n_days)
+    dates = window_dates(n_days)
+    today = dates[0]
+    index = ScheduleIndex()
+
+    # Sanity: both paths produce identical payloads
+    index.rebuild(data)
+    assert scan_window(data, dates) == [{'date': d, 'doctors': index.window_rows(d)} for d in dates]
+    assert scan_day(data, today) == index.day_rows(today)
+
+    def index_window():
+        return [{'date': d, 'doctors': index.window_rows(d)} for d in dates]
+
+    def cold_window():
+        index.rebuild(data)
+        return index_window()
+
+    def edit_then_window():
+        doc = data['doctors'][n_doctors // 2]
+        doc['schedule_by_date'].setdefault(today, {})['room'] = str(random.randint(1, 40))
+        index.touch(doc, today)
+        return index_window()
+
+    def cold_day():
+        index.mark_stale()
+        index.ensure(data)
+        return index.day_rows(today)
+
+    results = [
+        ('/api/window (30 days) scan', timeit(lambda: scan_window(data, dates), repeat)),
+        ('/api/window index cold (rebuild)', timeit(cold_window, repeat)),
+        ('/api/window index warm', timeit(index_window, repeat)),
+        ('/api/window index after 1 edit', timeit(edit_then_window, repeat)),
+        ('/api/day scan', timeit(lambda: scan_day(data, today), repeat)),
+        ('/api/day index cold (rebuild)', timeit(cold_day, repeat)),
+        ('/api/day index warm', timeit(lambda: index.day_rows(today), repeat)),
+    ]
+    print(f"{n_doctors} doctors x {n_days} days, best of {repeat}")
+    for label, ms in results:
+        print(f"  {label:<36} {ms:9.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
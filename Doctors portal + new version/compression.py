@@ -0,0 +1,110 @@
+"""
+gzip/brotli compression of large text responses.
+
+The lobby screens poll /api/window and /api/doctors and load /display over
+hospital Wi-Fi; the JSON compresses to roughly a tenth of its size. Compressor
+picks an encoding from the request's Accept-Encoding (q-values honoured, br
+preferred over gzip when the client accepts both equally, brotli only when
+the `brotli` module is installed) and compresses bodies of a compressible
+type that are at least min_bytes long.
+
+Two ways in:
+  - apply(resp, accept) compresses an ordinary response in place; app.py runs
+    it from an after_request hook.
+  - choose() + compress() let cached_json_response compress a cached body once
+    and keep the result on the cache entry, so a payload is compressed once
+    per data version instead of once per poll.
+
+gzip output is written with mtime 0, so the same body always compresses to the
+same bytes and ETags derived from it stay stable.
+"""
+
+import gzip
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+COMPRESSIBLE_TYPES = frozenset((
+    'application/json', 'text/html', 'text/plain', 'text/css', 'text/csv',
+    'text/javascript', 'application/javascript', 'image/svg+xml',
+))
+
+
+def parse_accept_encoding(header: str) -> dict:
+    """{coding: q} from an Accept-Encoding header (codings lower-cased)."""
+    out = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        out[coding] = q
+    return out
+
+
+class Compressor:
+    def __init__(self, min_bytes: int = 1024, gzip_level: int = 6, brotli_quality: int = 5,
+                 enabled: bool = True):
+        self.min_bytes = min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.enabled = enabled
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def negotiate(self, accept: str):
+        """Best encoding the client accepts, or None for identity."""
+        accepted = parse_accept_encoding(accept)
+        best, best_q = None, 0.0
+        for coding in self.encodings:  # in order of preference
+            q = accepted.get(coding, accepted.get('*', 0.0))
+            if q > best_q:
+                best, best_q = coding, q
+        return best
+
+    def eligible(self, mimetype: str, size: int) -> bool:
+        return self.enabled and size >= self.min_bytes and mimetype in COMPRESSIBLE_TYPES
+
+    def choose(self, mimetype: str, size: int, accept: str):
+        """Encoding to send a body of this type and size with, or None."""
+        if not self.eligible(mimetype, size):
+            return None
+        return self.negotiate(accept)
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        if encoding == 'gzip':
+            return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+        raise ValueError(f'unsupported encoding {encoding!r}')
+
+    def apply(self, resp, accept: str):
+        """Compress a Flask response in place when worthwhile; returns resp."""
+        if (resp.direct_passthrough or resp.is_streamed or resp.status_code != 200
+                or 'Content-Encoding' in resp.headers):
+            return resp
+        body = resp.get_data()
+        if not self.eligible(resp.mimetype, len(body)):
+            return resp
+        resp.vary.add('Accept-Encoding')
+        encoding = self.negotiate(accept)
+        if encoding is None:
+            return resp
+        packed = self.compress(body, encoding)
+        if len(packed) >= len(body):
+            return resp
+        resp.set_data(packed)
+        resp.headers['Content-Encoding'] = encoding
+        etag, weak = resp.get_etag()
+        if etag:
+            resp.set_etag(f'{etag}-{encoding}', weak)
+        return resp
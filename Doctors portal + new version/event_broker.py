@@ -0,0 +1,259 @@
+"""
+In-process publish/subscribe for the live /events (Server-Sent Events) streams.
+
+Every published event gets a monotonically increasing id and is kept in a
+bounded replay buffer, so a client reconnecting with Last-Event-ID only
+receives what it missed (or a 'resync' event when the gap is older than the
+buffer). Subscribers may filter by topic (event name) and by date; events
+that carry no date always pass the date filter.
+
+Records are (id, event, data_json, dates) tuples; dates is a frozenset of
+ISO dates taken from the payload's 'date'/'dates' keys, or None.
+
+Bursty events (doctor_update during Telegram/Excel imports) can be coalesced:
+the first event for an (event, date) key goes out immediately, further ones
+within the coalescing window are merged into one message carrying the list of
+affected doctor_ids, so displays refetch once per window instead of per edit.
+Only dated events are coalesced; undated ones (photo uploads carrying
+image_version, deletions) carry fields the merge would drop and always go out
+as published.
+
+With several worker processes, attach_bus() routes emitted events through a
+shared SqliteEventBus (event_bus.py) instead: the bus assigns the ids and hands every
+event, from this worker or another, back through deliver() in id order.
+"""
+
+import json
+import threading
+from collections import deque
+from time import time
+
+# Control event sent when a Last-Event-ID can't be resumed from the buffer
+RESYNC_EVENT = 'resync'
+
+
+def event_dates(payload):
+    """ISO dates an event applies to, or None when it is not date specific."""
+    if not isinstance(payload, dict):
+        return None
+    dates = set()
+    if isinstance(payload.get('date'), str) and payload['date']:
+        dates.add(payload['date'])
+    if isinstance(payload.get('dates'), (list, tuple)):
+        dates.update(d for d in payload['dates'] if isinstance(d, str) and d)
+    return frozenset(dates) if dates else None
+
+
+def format_sse(record) -> str:
+    event_id, event, data_json, _dates = record
+    return f"id: {event_id}\nevent: {event}\ndata: {data_json}\n\n"
+
+
+class EventFilter:
+    """Optional ?date= / ?topics= restriction for one stream."""
+
+    def __init__(self, dates=None, topics=None):
+        self.dates = frozenset(d for d in (dates or ()) if d) or None
+        self.topics = frozenset(t for t in (topics or ()) if t) or None
+
+    @classmethod
+    def from_args(cls, args):
+        """Build from request args: date/dates and topics, comma separated."""
+        def split(*names):
+            out = []
+            for n in names:
+                vals = args.getlist(n) if hasattr(args, 'getlist') else args.get(n)
+                if isinstance(vals, str):
+                    vals = [vals]
+                for v in vals or ():
+                    out.extend(p.strip() for p in str(v).split(',') if p.strip())
+            return out
+        return cls(split('date', 'dates'), split('topics', 'topic'))
+
+    def matches(self, record) -> bool:
+        _id, event, _data, dates = record
+        if event == RESYNC_EVENT:
+            return True
+        if self.topics is not None and event not in self.topics:
+            return False
+        if self.dates is not None and dates is not None and not (dates & self.dates):
+            return False
+        return True
+
+
+def coalesce_payloads(date, payloads):
+    """Merge several payloads for one (event, date) into a single message."""
+    merged = {'coalesced': len(payloads)}
+    if date:
+        merged['date'] = date
+    ids, deleted = [], []
+    for p in payloads:
+        for i in ([p['doctor_id']] if 'doctor_id' in p else []) + list(p.get('doctor_ids') or []):
+            if i not in ids:
+                ids.append(i)
+        if p.get('deleted') and 'doctor_id' in p:
+            deleted.append(p['doctor_id'])
+    merged['doctor_ids'] = ids
+    # Delta rows (doctor_update 'doctor'/'doctors') survive the merge, latest row per doctor
+    if all(isinstance(p.get('doctor'), dict) or isinstance(p.get('doctors'), list) for p in payloads):
+        latest = {}
+        for p in payloads:
+            for row in ([p['doctor']] if isinstance(p.get('doctor'), dict) else p['doctors']):
+                latest[row.get('id')] = row
+        merged['doctors'] = list(latest.values())
+    # Versions only when the merged changes form an unbroken chain; otherwise clients refetch
+    if all('version' in p and 'prev_version' in p for p in payloads) and \
+            all(a['version'] == b['prev_version'] for a, b in zip(payloads, payloads[1:])):
+        merged['prev_version'] = payloads[0]['prev_version']
+        merged['version'] = payloads[-1]['version']
+    if deleted:
+        merged['deleted_ids'] = deleted
+    if any(p.get('bulk') for p in payloads):
+        merged['bulk'] = True
+    return merged
+
+
+def parse_last_event_id(value):
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+class EventSubscriber:
+    """Bounded queue of event records for one /events stream.
+    wait() blocks on a condition variable until something is published,
+    so idle streams sleep instead of polling."""
+    def __init__(self, maxlen=200, event_filter=None):
+        self.queue = deque(maxlen=maxlen)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.filter = event_filter
+    def put(self, record):
+        if self.filter is not None and not self.filter.matches(record):
+            return
+        with self.cond:
+            self.queue.append(record)
+            self.cond.notify()
+    def wait(self, timeout):
+        """Return (and clear) everything queued, waiting up to timeout seconds for the first item."""
+        with self.cond:
+            if not self.queue and not self.closed:
+                self.cond.wait(timeout)
+            items = list(self.queue)
+            self.queue.clear()
+            return items
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class EventBroker:
+    def __init__(self, replay_size=500, coalesce_ms=0, coalesce_events=('doctor_update',)):
+        self.subscribers = []  # list of EventSubscriber
+        self.listeners = []  # callables(record), e.g. the asyncio SSE server
+        self.lock = threading.Lock()
+        self.coalesce_window = max(0, coalesce_ms) / 1000.0
+        self.coalesce_events = frozenset(coalesce_events or ())
+        self._pending = {}  # (event, date) -> payloads held back in the open window
+        # Ids start from the wall clock so they keep increasing across restarts;
+        # a client holding an id from a previous process then gets a resync.
+        self.last_id = int(time() * 1000)
+        self.history = deque(maxlen=replay_size)
+        self.bus = None
+    def attach_bus(self, bus, last_id):
+        """Publish through a cross-process bus whose ids continue from last_id."""
+        with self.lock:
+            self.bus = bus
+            self.last_id = last_id
+            self.history.clear()
+    def add_listener(self, fn):
+        with self.lock:
+            if fn not in self.listeners:
+                self.listeners.append(fn)
+    def subscribe(self, event_filter=None):
+        sub = EventSubscriber(maxlen=200, event_filter=event_filter)
+        with self.lock:
+            self.subscribers.append(sub)
+        return sub
+    def unsubscribe(self, sub):
+        with self.lock:
+            try: self.subscribers.remove(sub)
+            except ValueError: pass
+        sub.close()
+    def replay(self, last_id, event_filter=None):
+        """Events published after last_id, oldest first.
+        Returns (records, complete); complete is False when last_id is older than
+        the buffer (or from another process), i.e. the client must resync."""
+        with self.lock:
+            history = list(self.history)
+            current = self.last_id
+        if last_id is None or last_id >= current:
+            return [], last_id is None or last_id == current
+        complete = bool(history) and history[0][0] <= last_id + 1
+        records = [r for r in history if r[0] > last_id]
+        if event_filter is not None:
+            records = [r for r in records if event_filter.matches(r)]
+        return records, complete
+    def publish_event(self, event: str, payload):
+        if (self.coalesce_window and event in self.coalesce_events and isinstance(payload, dict)
+                and payload.get('date')):
+            key = (event, payload['date'])
+            with self.lock:
+                bucket = self._pending.get(key)
+                if bucket is not None:
+                    # Window already open for this key: merge into its trailing message
+                    bucket.append(payload)
+                    return None
+                self._pending[key] = []
+            self._schedule_flush(key)
+        return self._emit(event, payload)
+    def _schedule_flush(self, key):
+        t = threading.Timer(self.coalesce_window, self._flush, args=(key,))
+        t.daemon = True
+        t.start()
+    def _flush(self, key):
+        with self.lock:
+            bucket = self._pending.get(key)
+            if not bucket:
+                self._pending.pop(key, None)  # quiet window: close it
+                return
+            # Keep the window open while the burst continues
+            self._pending[key] = []
+        self._schedule_flush(key)
+        event, date = key
+        self._emit(event, bucket[0] if len(bucket) == 1 else coalesce_payloads(date, bucket))
+    def _emit(self, event: str, payload):
+        data = json.dumps(payload)
+        if self.bus is not None:
+            # Comes back through deliver() once the bus has given it an id
+            self.bus.append(event, data)
+            return None
+        dates = event_dates(payload)
+        with self.lock:
+            self.last_id += 1
+            return self._deliver_locked(self.last_id, event, data, dates)
+    def deliver(self, event_id: int, event: str, data: str):
+        """Deliver an event whose id was assigned by the bus (ignores ids already seen)."""
+        try:
+            dates = event_dates(json.loads(data))
+        except ValueError:
+            dates = None
+        with self.lock:
+            if event_id <= self.last_id:
+                return None
+            self.last_id = event_id
+            return self._deliver_locked(event_id, event, data, dates)
+    def _deliver_locked(self, event_id, event, data, dates):
+        # Deliver under the lock so every stream sees ids in order
+        record = (event_id, event, data, dates)
+        self.history.append(record)
+        for sub in self.subscribers:
+            sub.put(record)
+        for fn in self.listeners:
+            try:
+                fn(record)
+            except Exception:
+                pass
+        return event_id
@@ -0,0 +1,99 @@
+"""
+Cross-process relay for the live /events streams (MULTI_WORKER=1).
+
+Each server process has its own EventBroker, so with several workers behind a
+balancer a display streaming from worker A would never hear about an edit
+saved on worker B. SqliteEventBus appends every emitted event to a small
+SQLite table (WAL mode, next to the data) and a poller thread in each worker
+hands new rows to its broker in id order. The row id is the event id on every
+worker, so a client can resume with Last-Event-ID on whichever worker it
+reconnects to.
+
+Writers are woken immediately for their own events; events from other workers
+arrive within one poll interval (EVENT_BUS_POLL_MS, default 100 ms).
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+
+class SqliteEventBus:
+    """events(id, event, data, ts) table polled by every worker."""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS events ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT, event TEXT NOT NULL, data TEXT NOT NULL, ts REAL NOT NULL)",
+    )
+
+    def __init__(self, db_path: str, poll_interval: float = 0.1, retain: int = 2000):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.retain = retain  # rows kept for late pollers; the broker's replay buffer covers resumes
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.broker = None
+        self.last_seen = 0
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        conn = self._conn()
+        with conn:
+            for stmt in self.SCHEMA:
+                conn.execute(stmt)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def append(self, event: str, data: str):
+        self._conn().execute("INSERT INTO events(event, data, ts) VALUES (?, ?, ?)", (event, data, time.time()))
+        self._wake.set()
+
+    def start(self, broker):
+        """Attach to broker and start polling from the current end of the table (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return self
+        row = self._conn().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()
+        self.last_seen = row[0]
+        self.broker = broker
+        broker.attach_bus(self, self.last_seen)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='event-bus', daemon=True)
+        self._thread.start()
+        return self
+
+    def poll_once(self) -> int:
+        rows = self._conn().execute(
+            "SELECT id, event, data FROM events WHERE id > ? ORDER BY id", (self.last_seen,)).fetchall()
+        for event_id, event, data in rows:
+            self.broker.deliver(event_id, event, data)
+            self.last_seen = event_id
+        return len(rows)
+
+    def prune(self):
+        self._conn().execute("DELETE FROM events WHERE id <= ?", (self.last_seen - self.retain,))
+
+    def _loop(self):
+        polls = 0
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self.poll_once()
+                polls += 1
+                if polls % 600 == 0:
+                    self.prune()
+            except Exception as e:
+                print(f"[event-bus] poll failed: {e}")
+                time.sleep(1)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
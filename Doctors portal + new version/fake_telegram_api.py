@@ -0,0 +1,204 @@
+"""
+Local stand-in for the Telegram Bot API, for running the bot without Telegram.
+
+Implements what the app uses: getUpdates (long polling with offset
+acknowledgement), sendMessage, deleteWebhook/setWebhook/getWebhookInfo and
+getMe, on HTTP/1.1 keep-alive. getUpdates answers 409 while a webhook is set,
+like the real API; instead each pushed update is POSTed to the webhook URL
+with the X-Telegram-Bot-Api-Secret-Token header (retried a few times on a
+non-2xx reply, results in `deliveries`). Test hooks: push_update() queues an incoming message,
+`sent` lists what the bot sent, `connections` counts TCP connections (to check
+that the client reuses them) and send_delay slows sendMessage down.
+
+Run it standalone and point the app at it:
+  python fake_telegram_api.py --port 8081
+  TELEGRAM_API_BASE=http://127.0.0.1:8081 TELEGRAM_BOT_TOKEN=test ENABLE_TELEGRAM=1 python run_waitress.py
+then queue messages with
+  curl -d "chat_id=1&text=Dr Asish on leave" http://127.0.0.1:8081/fake/push
+and inspect replies with GET /fake/state.
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, urlsplit
+from urllib.request import Request, urlopen
+
+
+class FakeTelegramAPI:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, send_delay: float = 0.0):
+        self.send_delay = send_delay
+        self.cond = threading.Condition()
+        self.updates = []       # pending update dicts
+        self.next_update_id = 1
+        self.sent = []          # sendMessage calls, in order
+        self.calls = []         # (method, fields)
+        self.connections = 0
+        self.webhook_url = ''
+        self.webhook_secret = ''
+        self.deliveries = []    # (update_id, HTTP status) of webhook POSTs
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.base_url = f'http://{host}:{self.port}'
+        self._thread = None
+
+    # --- test hooks ---
+    def push_update(self, text: str, chat_id=1, **extra) -> dict:
+        with self.cond:
+            upd = {'update_id': self.next_update_id,
+                   'message': {'message_id': self.next_update_id, 'date': int(time.time()),
+                               'chat': {'id': chat_id, 'type': 'group'}, 'text': text, **extra}}
+            self.next_update_id += 1
+            if self.webhook_url:
+                threading.Thread(target=self._deliver, args=(upd,), daemon=True).start()
+            else:
+                self.updates.append(upd)
+            self.cond.notify_all()
+        return upd
+
+    def _deliver(self, upd, attempts: int = 3):
+        body = json.dumps(upd).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if self.webhook_secret:
+            headers['X-Telegram-Bot-Api-Secret-Token'] = self.webhook_secret
+        for attempt in range(attempts):
+            try:
+                with urlopen(Request(self.webhook_url, data=body, headers=headers), timeout=10) as resp:
+                    status = resp.status
+            except HTTPError as e:
+                status = e.code
+            except OSError:
+                status = None
+            with self.cond:
+                self.deliveries.append((upd['update_id'], status))
+                self.cond.notify_all()
+            if status and 200 <= status < 300:
+                return True
+            time.sleep(0.5 * (attempt + 1))
+        return False
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-telegram', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # --- Bot API methods ---
+    def api(self, method: str, fields: dict):
+        self.calls.append((method, fields))
+        if method == 'getUpdates':
+            if self.webhook_url:
+                return 409, {'ok': False, 'error_code': 409,
+                             'description': "Conflict: can't use getUpdates method while webhook is active"}
+            offset = int(fields.get('offset') or 0)
+            timeout = float(fields.get('timeout') or 0)
+            deadline = time.monotonic() + timeout
+            with self.cond:
+                if offset:
+                    # Offset acknowledges everything before it
+                    self.updates = [u for u in self.updates if u['update_id'] >= offset]
+                while not self.updates and time.monotonic() < deadline:
+                    self.cond.wait(deadline - time.monotonic())
+                return 200, {'ok': True, 'result': list(self.updates)}
+        if method == 'sendMessage':
+            if self.send_delay:
+                time.sleep(self.send_delay)
+            with self.cond:
+                msg = {'message_id': len(self.sent) + 1, 'chat': {'id': fields.get('chat_id')},
+                       'text': fields.get('text'), 'parse_mode': fields.get('parse_mode'), 'at': time.time()}
+                self.sent.append(msg)
+                self.cond.notify_all()
+            return 200, {'ok': True, 'result': msg}
+        if method == 'setWebhook':
+            self.webhook_url = fields.get('url') or ''
+            self.webhook_secret = fields.get('secret_token') or ''
+            return 200, {'ok': True, 'result': True, 'description': 'Webhook was set'}
+        if method == 'deleteWebhook':
+            self.webhook_url = self.webhook_secret = ''
+            return 200, {'ok': True, 'result': True, 'description': 'Webhook was deleted'}
+        if method == 'getWebhookInfo':
+            with self.cond:
+                pending = len(self.updates)
+            return 200, {'ok': True, 'result': {'url': self.webhook_url, 'pending_update_count': pending}}
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'username': 'fake_bot'}}
+        return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with fake.cond:
+                    fake.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _fields(self):
+                parts = urlsplit(self.path)
+                fields = dict(parse_qsl(parts.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    raw = self.rfile.read(length).decode('utf-8')
+                    if 'json' in (self.headers.get('Content-Type') or ''):
+                        fields.update(json.loads(raw or '{}'))
+                    else:
+                        fields.update(parse_qsl(raw))
+                return parts.path, fields
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _dispatch(self):
+                path, fields = self._fields()
+                if path == '/fake/push':
+                    upd = fake.push_update(fields.get('text', ''), fields.get('chat_id', 1))
+                    return self._reply(200, {'ok': True, 'result': upd})
+                if path == '/fake/state':
+                    return self._reply(200, {'ok': True, 'sent': fake.sent, 'pending': fake.updates,
+                                             'connections': fake.connections, 'webhook': fake.webhook_url,
+                                             'deliveries': fake.deliveries})
+                segs = path.strip('/').split('/')
+                if len(segs) != 2 or not segs[0].startswith('bot'):
+                    return self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+                status, payload = fake.api(segs[1], fields)
+                self._reply(status, payload)
+
+            do_GET = _dispatch
+            do_POST = _dispatch
+
+        return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8081)
+    ap.add_argument('--send-delay', type=float, default=0.0, help='seconds each sendMessage takes')
+    args = ap.parse_args()
+    fake = FakeTelegramAPI(args.host, args.port, send_delay=args.send_delay)
+    print(f'fake Telegram Bot API on {fake.base_url}')
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
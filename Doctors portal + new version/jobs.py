@@ -0,0 +1,175 @@
+"""
+Background jobs for the slow admin operations (Excel apply, roster generation,
+roster export).
+
+Those endpoints used to run inside the request thread and hold a waitress
+worker for their whole duration. A client that asks for it (Prefer:
+respond-async, or ?async=1) now gets 202 with a job id straight away; the work
+runs on a small bounded thread pool and GET /api/jobs/<id> reports its state.
+
+Every state change is written to <state_dir>/<id>.json (the response body and
+HTTP status end up there too), so any worker process can answer a status
+query and results survive a restart. on_update(job), if given, is called on
+each state change.
+
+A job function reports progress with report_progress(fraction, message); the
+call is a no-op outside a job, so shared code can call it unconditionally.
+"""
+
+import json
+import os
+import re
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+JOB_ID_RE = re.compile(r'^[0-9a-f]{16}$')
+
+_current = threading.local()
+
+
+class JobQueueFull(Exception):
+    """Raised by submit() when max_pending jobs are already queued or running."""
+
+
+def report_progress(fraction: float, message: str = None):
+    """Progress of the job running on this thread (ignored outside a job)."""
+    runner = getattr(_current, 'runner', None)
+    if runner is not None:
+        runner._progress(_current.job_id, fraction, message)
+
+
+class JobRunner:
+    """Bounded pool of background jobs with their state kept on disk."""
+
+    def __init__(self, state_dir: str, max_workers: int = 2, max_pending: int = 32,
+                 retain: int = 200, on_update=None):
+        self.state_dir = state_dir
+        self.max_pending = max_pending
+        self.retain = retain
+        self.on_update = on_update
+        self._lock = threading.Lock()
+        self._jobs = {}  # id -> job dict, for jobs submitted by this process
+        self._active = 0
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='job')
+        os.makedirs(state_dir, exist_ok=True)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.state_dir, f'{job_id}.json')
+
+    def submit(self, kind: str, fn, owner: str = None) -> dict:
+        """Queue fn() and return the job. fn returns (http_status, json_body)."""
+        with self._lock:
+            if self._active >= self.max_pending:
+                raise JobQueueFull(f'{self._active} jobs already pending')
+            self._active += 1
+            job = {
+                'id': secrets.token_hex(8), 'kind': kind, 'owner': owner,
+                'status': 'queued', 'progress': 0.0, 'message': None,
+                'created_at': time(), 'started_at': None, 'finished_at': None,
+                'http_status': None, 'result': None, 'error': None,
+            }
+            self._jobs[job['id']] = job
+        self._changed(job)
+        self._prune()
+        self._pool.submit(self._run, job, fn)
+        return self._public(job)
+
+    def get(self, job_id: str):
+        """The job's current state (from this process or the state directory), or None."""
+        if not JOB_ID_RE.match(job_id or ''):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def _run(self, job, fn):
+        with self._lock:
+            job['status'] = 'running'
+            job['started_at'] = time()
+        self._changed(job)
+        _current.runner, _current.job_id = self, job['id']
+        try:
+            http_status, body = fn()
+            with self._lock:
+                job['http_status'] = http_status
+                job['result'] = body
+                job['status'] = 'done' if http_status < 400 else 'failed'
+                job['progress'] = 1.0
+        except Exception as e:
+            with self._lock:
+                job['http_status'] = 500
+                job['status'] = 'failed'
+                job['error'] = str(e)
+        finally:
+            _current.runner = _current.job_id = None
+            with self._lock:
+                job['finished_at'] = time()
+                self._active -= 1
+            self._changed(job)
+            with self._lock:
+                # Finished jobs are served from disk from now on
+                self._jobs.pop(job['id'], None)
+
+    def _progress(self, job_id, fraction, message):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job['progress'] = round(min(1.0, max(0.0, float(fraction))), 3)
+            if message is not None:
+                job['message'] = message
+            persist = time() - job.get('_saved_at', 0) >= 1.0
+        if persist:
+            # Throttled: other workers polling this job see progress about once a second
+            self._save(job)
+
+    def _changed(self, job):
+        self._save(job)
+        if self.on_update:
+            try:
+                self.on_update(self._public(job))
+            except Exception:
+                pass
+
+    def _save(self, job):
+        with self._lock:
+            job['_saved_at'] = time()
+            data = json.dumps(self._public(job), ensure_ascii=False, default=str)
+        path = self._path(job['id'])
+        tmp = f'{path}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as fh:
+                fh.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f'[jobs] could not save {job["id"]}: {e}')
+
+    def _prune(self):
+        """Keep the newest `retain` finished job files."""
+        try:
+            entries = [e for e in os.scandir(self.state_dir) if e.name.endswith('.json')]
+        except OSError:
+            return
+        if len(entries) <= self.retain:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        with self._lock:
+            live = set(self._jobs)
+        for e in entries[:len(entries) - self.retain]:
+            if e.name[:-5] not in live:
+                try:
+                    os.remove(e.path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _public(job) -> dict:
+        return {k: v for k, v in job.items() if not k.startswith('_')}
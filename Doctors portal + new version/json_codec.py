@@ -0,0 +1,97 @@
+"""
+JSON encoding/decoding for responses and the data files, using orjson when
+it is installed and the stdlib json module otherwise.
+
+/api/window and /api/doctors serialise every doctor's schedule, and
+doctors.json is parsed and rewritten whole on the json backend; orjson does
+both several times faster (see bench_json.py).
+
+  - dumps(obj, pretty=False) returns UTF-8 bytes; pretty means two-space
+    indentation. Anything orjson refuses (integers beyond 64 bits, unusual
+    dict keys) is retried with the stdlib encoder.
+  - PRETTY_ON_DISK (env JSON_PRETTY, default on) is what the data files are
+    written with, so they stay readable for hand inspection; set
+    JSON_PRETTY=0 for smaller files and faster saves.
+  - JSONProvider plugs the same encoder into Flask (jsonify, request.json).
+    Responses stay compact unless the app runs in debug mode, as with
+    Flask's own provider.
+"""
+
+import json
+import os
+
+from flask.json.provider import DefaultJSONProvider, _default
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+PRETTY_ON_DISK = os.environ.get('JSON_PRETTY', '1').lower() in ('1', 'true', 'yes', 'on')
+
+
+def _stdlib_dumps(obj, pretty: bool, sort_keys: bool, default) -> bytes:
+    if pretty:
+        text = json.dumps(obj, ensure_ascii=False, indent=2, sort_keys=sort_keys, default=default)
+    else:
+        text = json.dumps(obj, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys, default=default)
+    return text.encode('utf-8')
+
+
+def dumps(obj, pretty: bool = False, sort_keys: bool = False, default=None) -> bytes:
+    """obj as UTF-8 JSON bytes, compact unless pretty."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if default is not None:
+            # Let default() see these like the stdlib encoder would
+            option |= orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            pass
+    return _stdlib_dumps(obj, pretty, sort_keys, default)
+
+
+def dumps_str(obj, pretty: bool = False) -> str:
+    return dumps(obj, pretty).decode('utf-8')
+
+
+def loads(raw):
+    """Parse JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        raw = bytes(raw).decode('utf-8')
+    return json.loads(raw)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by dumps()/loads()."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return self._encode(obj, **kwargs).decode('utf-8')
+
+    def _encode(self, obj, **kwargs) -> bytes:
+        if set(kwargs) - {'indent', 'separators', 'sort_keys', 'ensure_ascii', 'default'}:
+            # Arguments only the stdlib encoder understands
+            kwargs.setdefault('default', _default)
+            kwargs.setdefault('sort_keys', self.sort_keys)
+            return json.dumps(obj, **kwargs).encode('utf-8')
+        return dumps(obj, pretty=bool(kwargs.get('indent')), sort_keys=kwargs.get('sort_keys', self.sort_keys),
+                     default=kwargs.get('default', _default))
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        body = self._encode(obj, indent=2 if pretty else None)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
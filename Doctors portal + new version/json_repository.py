@@ -0,0 +1,104 @@
+"""
+Cached, lock-protected access to the app's small JSON files.
+
+users.json, settings.json, opdinfo.json, shift_knowledge.json, pr_staff.json,
+pr_roster.json, pr_clinical_roster.json, pr_leaves.json and closure.json were
+each opened and parsed on every request, and several of them were rewritten
+in place (a reader in another waitress thread could see half a file).
+
+JsonRepository wraps one file:
+  - view() returns the parsed document, re-parsed only when the file's
+    (mtime_ns, size, inode) changes, so edits by another worker process or
+    by hand are picked up. The result is shared: don't modify it.
+  - load() returns a deep copy for the read-modify-write handlers.
+  - save(data) writes a temp file and os.replace()s it over the original, so
+    readers see either the old or the new document.
+  - edit() is load() + save() under the repository's RLock, so two threads
+    updating the same file can't lose each other's change.
+
+Files are parsed and written with json_codec (orjson when installed); they
+are pretty-printed unless JSON_PRETTY=0.
+"""
+
+import copy
+import os
+import threading
+from contextlib import contextmanager
+
+import json_codec
+
+
+class JsonRepository:
+    def __init__(self, path: str, default=dict, validate=None, pretty: bool = None):
+        """default() builds the document when the file is missing or unreadable;
+        validate(doc) may fix up a freshly parsed document and returns it."""
+        self.path = path
+        self.default = default
+        self.validate = validate
+        self.pretty = json_codec.PRETTY_ON_DISK if pretty is None else pretty
+        self.parses = 0  # how often the file was actually read (diagnostics)
+        self._lock = threading.RLock()
+        self._sig = None
+        self._doc = None
+        self._loaded = False
+
+    def signature(self):
+        """(mtime_ns, size, inode) of the file, or None if it does not exist."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def view(self):
+        """The current document (shared; treat as read-only)."""
+        sig = self.signature()
+        if self._loaded and sig == self._sig:
+            return self._doc
+        with self._lock:
+            if not (self._loaded and sig == self._sig):
+                self._doc = self._read(sig)
+                self._sig = sig
+                self._loaded = True
+            return self._doc
+
+    def load(self):
+        """A private copy of the current document."""
+        return copy.deepcopy(self.view())
+
+    def _read(self, sig):
+        if sig is None:
+            return self.default()
+        try:
+            with open(self.path, 'rb') as fh:
+                doc = json_codec.loads(fh.read())
+            self.parses += 1
+        except (OSError, ValueError):
+            return self.default()
+        if self.validate is not None:
+            doc = self.validate(doc)
+        return doc
+
+    def save(self, data):
+        """Atomically replace the file with data."""
+        raw = json_codec.dumps(data, pretty=self.pretty)
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Per-process temp name: workers sharing data/ must not write the same temp file
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as fh:
+                fh.write(raw)
+            os.replace(tmp, self.path)
+            self._doc = copy.deepcopy(data)
+            self._sig = self.signature()
+            self._loaded = True
+
+    @contextmanager
+    def edit(self):
+        """Read-modify-write: yields a copy and saves it when the block exits cleanly."""
+        with self._lock:
+            data = self.load()
+            yield data
+            self.save(data)
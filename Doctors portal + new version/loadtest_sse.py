@@ -0,0 +1,145 @@
+"""
+Load test: many concurrent EventSource-style clients on the asyncio /events server.
+
+Default mode starts an in-process AsyncSSEServer on a free port, opens N raw
+HTTP clients (default 500), publishes a few events from a normal thread the
+way EventBroker does and reports connect time plus publish-to-client latency.
+
+  python loadtest_sse.py [--clients 500] [--events 20]
+
+Against a running server (ASYNC_SSE_PORT set), only connections and whatever
+events arrive during --duration seconds are measured:
+
+  python loadtest_sse.py --url http://127.0.0.1:5001/events --clients 500 --duration 30
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+from event_broker import EventBroker
+from sse_async import AsyncSSEServer
+
+
+def _raise_fd_limit(need: int):
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < need:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(need, hard), hard))
+    except Exception:
+        pass
+
+
+async def client(host, port, path, stats, connected, stop):
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError as e:
+        stats['errors'].append(str(e))
+        return
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nAccept: text/event-stream\r\n\r\n".encode())
+    await writer.drain()
+    status = await reader.readline()
+    if b' 200 ' not in status:
+        stats['errors'].append(status.decode(errors='replace').strip())
+        writer.close()
+        return
+    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+        pass
+    connected()
+    try:
+        while not stop.is_set():
+            line = await reader.readline()
+            if not line:
+                break
+            if line.startswith(b'data: '):
+                now = time.perf_counter()
+                try:
+                    sent = json.loads(line[6:]).get('t')
+                except Exception:
+                    sent = None
+                stats['received'] += 1
+                if sent:
+                    stats['latency'].append(now - sent)
+    finally:
+        writer.close()
+
+
+async def run(args):
+    server = None
+    if args.url:
+        u = urlsplit(args.url)
+        host, port, path = u.hostname, u.port or 80, (u.path or '/events') + (('?' + u.query) if u.query else '')
+    else:
+        broker = EventBroker()
+        server = AsyncSSEServer('127.0.0.1', 0, broker=broker).start()
+        broker.add_listener(server.publish)
+        host, port, path = '127.0.0.1', server.port, '/events'
+    _raise_fd_limit(args.clients * 2 + 256)
+
+    stats = {'errors': [], 'received': 0, 'latency': []}
+    stop = asyncio.Event()
+    n_connected = 0
+    all_connected = asyncio.Event()
+
+    def connected():
+        nonlocal n_connected
+        n_connected += 1
+        if n_connected >= args.clients:
+            all_connected.set()
+
+    t0 = time.perf_counter()
+    tasks = [asyncio.ensure_future(client(host, port, path, stats, connected, stop)) for _ in range(args.clients)]
+    try:
+        await asyncio.wait_for(all_connected.wait(), timeout=60)
+    except asyncio.TimeoutError:
+        pass
+    connect_s = time.perf_counter() - t0
+    print(f"connected {n_connected}/{args.clients} clients in {connect_s:.2f}s"
+          + (f" (server sees {server.client_count})" if server else ''))
+
+    if server:
+        def publisher():
+            for i in range(args.events):
+                broker.publish_event('doctor_update', {'seq': i, 't': time.perf_counter()})
+                time.sleep(args.interval)
+        th = threading.Thread(target=publisher, daemon=True)
+        th.start()
+        expected = args.events * n_connected
+        deadline = time.perf_counter() + args.events * args.interval + 10
+        while stats['received'] < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+    else:
+        await asyncio.sleep(args.duration)
+
+    stop.set()
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    lat = sorted(stats['latency'])
+    print(f"events received: {stats['received']}" + (f" / {args.events * n_connected}" if server else ''))
+    if lat:
+        pct = lambda p: lat[min(len(lat) - 1, int(len(lat) * p))] * 1000
+        print(f"publish->client latency ms: p50 {pct(0.50):.2f}  p95 {pct(0.95):.2f}  max {lat[-1] * 1000:.2f}")
+    if stats['errors']:
+        print(f"errors: {len(stats['errors'])} (first: {stats['errors'][0]})")
+    if server:
+        server.stop()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--url', help='existing /events URL (default: in-process server)')
+    ap.add_argument('--clients', type=int, default=500)
+    ap.add_argument('--events', type=int, default=20)
+    ap.add_argument('--interval', type=float, default=0.1, help='seconds between published events')
+    ap.add_argument('--duration', type=float, default=30, help='listen time with --url')
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
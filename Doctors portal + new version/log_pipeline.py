@@ -0,0 +1,170 @@
+"""
+Non-blocking, rotating log for the Telegram bot and admin actions.
+
+log() used to open data/telegram.log, append one line and close it on every
+call, from request handlers too, and the file grew without bound. Now log()
+formats the line and puts it on a queue; a QueueListener thread writes it to
+stdout and to the log file.
+
+The file is rotated when it passes max_bytes or when its first line is older
+than max_age seconds. Old segments are gzip-compressed (telegram.log.1.gz is
+the newest) and only `backups` of them are kept. Before each write the
+handler checks whether the file on disk is still the one it has open, so
+another worker process rotating the same file (MULTI_WORKER) is noticed.
+
+tail(offset) returns the complete lines written after a byte offset and the
+offset to ask for next. It reads at most `limit` bytes, so the admin panel can
+follow the log without loading the whole file.
+"""
+
+import atexit
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+from datetime import datetime
+from time import time
+
+TAIL_LIMIT = 64 * 1024
+
+
+class RotatingGzipHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler with an age limit and gzip-compressed backups."""
+
+    def __init__(self, path: str, max_bytes: int, max_age: int, backups: int):
+        super().__init__(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+        self.max_age = max_age
+        self.namer = lambda name: name + '.gz'
+        self.rotator = self._gzip
+        self._started = None  # epoch seconds of the current segment's first line
+        self._ino = None
+
+    @staticmethod
+    def _gzip(source, dest):
+        with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def _open(self):
+        stream = super()._open()
+        st = os.fstat(stream.fileno())
+        self._ino = (st.st_dev, st.st_ino)
+        self._started = self._first_line_time(st)
+        return stream
+
+    def _first_line_time(self, st) -> float:
+        if not st.st_size:
+            return time()
+        try:
+            with open(self.baseFilename, 'r', encoding='utf-8', errors='replace') as fh:
+                return datetime.strptime(fh.read(19), '%Y-%m-%d %H:%M:%S').timestamp()
+        except (OSError, ValueError):
+            return st.st_mtime
+
+    def _reopen_if_moved(self):
+        try:
+            st = os.stat(self.baseFilename)
+            current = (st.st_dev, st.st_ino)
+        except FileNotFoundError:
+            current = None
+        if current != self._ino and self.stream is not None:
+            self.stream.close()
+            self.stream = None  # reopened by emit()
+
+    def shouldRollover(self, record):
+        self._reopen_if_moved()
+        if self.stream is None:
+            self.stream = self._open()
+        if self.maxBytes > 0 and self.stream.tell() + len(self.format(record)) + 1 >= self.maxBytes:
+            return True
+        return bool(self.max_age) and self.stream.tell() > 0 and time() - self._started >= self.max_age
+
+    def handleError(self, record):
+        pass  # a full disk must not take the bot down
+
+
+class _DropWhenFull(logging.handlers.QueueHandler):
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Stdout(logging.StreamHandler):
+    def handleError(self, record):
+        pass
+
+
+class LogPipeline:
+    def __init__(self, path: str, max_bytes: int = 5 * 1024 * 1024, max_age: int = 7 * 86400,
+                 backups: int = 10, queue_size: int = 10000, echo: bool = True):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file_handler = RotatingGzipHandler(path, max_bytes, max_age, backups)
+        handlers = [self.file_handler]
+        if echo:
+            handlers.append(_Stdout(sys.stdout))
+        for h in handlers:
+            h.setFormatter(logging.Formatter('%(message)s'))
+        self._queue_handler = _DropWhenFull(queue.Queue(maxsize=queue_size))
+        self.logger = logging.getLogger(f'log_pipeline.{os.path.abspath(path)}')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.handlers = [self._queue_handler]
+        self.listener = logging.handlers.QueueListener(self._queue_handler.queue, *handlers)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def write(self, line: str):
+        """Queue one already formatted line; never blocks."""
+        self.logger.info(line)
+
+    @property
+    def dropped(self) -> int:
+        return self._queue_handler.dropped
+
+    def close(self):
+        """Write out what is queued and stop the writer thread."""
+        if self.listener._thread is not None:
+            self.listener.stop()
+            self.file_handler.close()
+
+    def tail(self, offset: int = None, limit: int = TAIL_LIMIT) -> dict:
+        """Complete lines from byte offset (or the last `limit` bytes when offset is None).
+
+        reset is True when offset lies past the end of the file, i.e. the log was
+        rotated since the caller's last read; reading then restarts at 0.
+        """
+        limit = max(1, limit)
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        reset = offset is not None and offset > size
+        if offset is None:
+            start = max(0, size - limit)
+        else:
+            start = 0 if reset else max(0, offset)
+        if start >= size:
+            return {'offset': size, 'size': size, 'reset': reset, 'lines': []}
+        with open(self.path, 'rb') as fh:
+            fh.seek(start)
+            chunk = fh.read(limit)
+        if offset is None and start > 0:
+            # Started mid-line: drop the partial first line
+            nl = chunk.find(b'\n')
+            skip = nl + 1 if nl >= 0 else len(chunk)
+            chunk, start = chunk[skip:], start + skip
+        end = chunk.rfind(b'\n') + 1
+        if end == 0 and len(chunk) == limit:
+            end = len(chunk)  # a single line longer than limit: hand it out in pieces
+        text = chunk[:end].decode('utf-8', errors='replace')
+        return {'offset': start + end, 'size': size, 'reset': reset, 'lines': text.splitlines()}
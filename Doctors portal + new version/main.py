@@ -1,9 +1,11 @@
 import os
-from app import app, maybe_start_telegram
+from app import app, maybe_start_telegram, start_async_sse
 
 if __name__ == "__main__":
     # Ensure Telegram polling starts
     maybe_start_telegram()
+    # Optional asyncio /events server (ASYNC_SSE_PORT)
+    start_async_sse()
 
     host = os.environ.get('WEB_SERVER_HOST', '0.0.0.0')
     port = int(os.environ.get('PORT', os.environ.get('WEB_SERVER_PORT', 5000)))
@@ -0,0 +1,186 @@
+"""
+Doctor name lookup shared by the Telegram parsers and the Excel importers.
+
+Matching a free-text name used to tokenise and normalise every doctor's name
+again for every message (and, in the Excel importers, for every row), then run
+difflib over all of them. DoctorNameIndex does that work once per doctor list:
+normalised names, token -> doctors and trigram -> doctors inverted indexes, a
+sorted first-word list for prefix hits and the normalised keyword aliases.
+Queries only score the doctors those indexes turn up.
+
+Lookups:
+  - match_subset(name): the doctor whose name tokens are the largest subset of
+    the name's tokens (Excel rows, "Name shift 2" lines)
+  - match_text(text): the scored fuzzy match used for free-text messages
+    (token overlap, first-word prefix, keyword alias, difflib ratio)
+  - match_exact(name) / best_overlap(name): the "Name:" line of rich messages
+
+Positions are kept rather than doctor dicts, so an index built for one load of
+the data can serve a reload with the same names (pass that doctors list).
+"""
+
+import bisect
+import difflib
+import re
+import unicodedata
+
+_HONORIFIC_RE = re.compile(r"(?i)\b(dr|mr|mrs|ms|prof)\.?\b")
+_TOKEN_RE = re.compile(r"[A-Za-z']+")
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9\s]")
+_SPACES_RE = re.compile(r"\s+")
+
+# Fuzzy fallback: how many trigram neighbours get a difflib score
+TRIGRAM_CANDIDATES = 16
+
+
+def name_tokens(text: str):
+    """Lower-case name words without honorifics or one-letter initials."""
+    if not text:
+        return []
+    text = _HONORIFIC_RE.sub(" ", text)
+    return [t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 1]
+
+
+def norm_name(s: str) -> str:
+    """Accent-folded, lower-case, honorific-free name with single spaces."""
+    if not s:
+        return ''
+    s = unicodedata.normalize('NFKD', s)
+    s = ''.join(ch for ch in s if not unicodedata.combining(ch))
+    s = _HONORIFIC_RE.sub(" ", s.lower())
+    s = _NON_ALNUM_RE.sub(" ", s)
+    return _SPACES_RE.sub(" ", s).strip()
+
+
+def trigrams(s: str):
+    padded = f'  {s} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def names_signature(doctors) -> tuple:
+    """What an index depends on: doctor order, names and keywords."""
+    return tuple((d.get('name') or '', tuple(str(k) for k in (d.get('keywords') or ())))
+                 for d in doctors)
+
+
+class DoctorNameIndex:
+    def __init__(self, doctors):
+        self.doctors = doctors
+        self.signature = names_signature(doctors)
+        self.data_version = None  # set by the owner to skip re-checking the signature
+        self._norm = []        # position -> normalised name
+        self._toks = []        # position -> frozenset of name tokens
+        self._by_token = {}    # token -> [positions]
+        self._by_trigram = {}  # trigram -> [positions]
+        self._keywords = []    # (normalised keyword, position)
+        self._exact = {}       # lower-cased full name -> first position
+        firsts = []
+        for pos, d in enumerate(doctors):
+            raw = d.get('name') or ''
+            nn = norm_name(raw)
+            toks = frozenset(name_tokens(raw))
+            self._exact.setdefault(raw.lower(), pos)
+            self._norm.append(nn)
+            self._toks.append(toks)
+            for t in toks:
+                self._by_token.setdefault(t, []).append(pos)
+            for g in trigrams(nn) if nn else ():
+                self._by_trigram.setdefault(g, []).append(pos)
+            if nn:
+                firsts.append((nn.split(' ', 1)[0], pos))
+            for kw in d.get('keywords') or []:
+                k = norm_name(str(kw))
+                if k:
+                    self._keywords.append((k, pos))
+        firsts.sort()
+        self._first_words = [w for w, _ in firsts]
+        self._first_pos = [p for _, p in firsts]
+
+    def __len__(self):
+        return len(self.doctors)
+
+    def _doc(self, pos, doctors):
+        if pos is None:
+            return None
+        return (doctors if doctors is not None else self.doctors)[pos]
+
+    def match_subset(self, text: str, doctors=None):
+        """Doctor whose name tokens are the largest subset of text's tokens
+        (first in list order on a tie), or None."""
+        toks = set(name_tokens(text))
+        if not toks:
+            return None
+        candidates = set()
+        for t in toks:
+            candidates.update(self._by_token.get(t, ()))
+        best, score = None, 0
+        for pos in sorted(candidates):
+            dt = self._toks[pos]
+            if len(dt) > score and dt <= toks:
+                best, score = pos, len(dt)
+        return self._doc(best, doctors)
+
+    def match_exact(self, name: str, doctors=None):
+        """Doctor whose name equals name ignoring case, or None."""
+        return self._doc(self._exact.get((name or '').lower()), doctors)
+
+    def best_overlap(self, text: str, doctors=None):
+        """(doctor, score) with the most shared tokens relative to the shorter
+        of the two names (so a first name alone scores 1.0); (None, 0.0) if none."""
+        toks = set(name_tokens(text))
+        candidates = set()
+        for t in toks:
+            candidates.update(self._by_token.get(t, ()))
+        best, best_score = None, 0.0
+        for pos in sorted(candidates):
+            dt = self._toks[pos]
+            score = len(toks & dt) / max(1, min(len(toks), len(dt)))
+            if score > best_score:
+                best, best_score = pos, score
+        return self._doc(best, doctors), best_score
+
+    def _prefix_hits(self, tok: str):
+        i = bisect.bisect_left(self._first_words, tok)
+        while i < len(self._first_words) and self._first_words[i].startswith(tok):
+            yield self._first_pos[i]
+            i += 1
+
+    def match_text(self, text: str, doctors=None):
+        """Best scored match for a free-text name, or None."""
+        toks = set(name_tokens(text)) if text else set()
+        msg_norm = norm_name(text)
+        if not toks and not msg_norm:
+            return None
+        candidates = set()
+        prefixed = set()
+        for t in toks:
+            candidates.update(self._by_token.get(t, ()))
+            if len(t) > 2:
+                prefixed.update(self._prefix_hits(t))
+        candidates |= prefixed
+        keyworded = {pos for k, pos in self._keywords if k in toks or k in msg_norm}
+        candidates |= keyworded
+        if msg_norm:
+            shared = {}
+            for g in trigrams(msg_norm):
+                for pos in self._by_trigram.get(g, ()):
+                    shared[pos] = shared.get(pos, 0) + 1
+            candidates.update(sorted(shared, key=shared.get, reverse=True)[:TRIGRAM_CANDIDATES])
+        best, best_score = None, 0.0
+        for pos in sorted(candidates):
+            name_norm, dtoks = self._norm[pos], self._toks[pos]
+            if not (name_norm or dtoks):
+                continue
+            # Overlap normalised by the doctor's token count (extra words in the message don't count against it)
+            score = len(toks & dtoks) / len(dtoks) if dtoks else 0.0
+            if pos in prefixed:
+                score += 0.6
+            if pos in keyworded:
+                score += 0.5
+            if msg_norm and name_norm:
+                score += 0.35 * difflib.SequenceMatcher(None, name_norm, msg_norm).ratio()
+            if dtoks and dtoks <= toks:
+                score = max(score, 1.0)
+            if score > best_score:
+                best, best_score = pos, score
+        return self._doc(best, doctors)
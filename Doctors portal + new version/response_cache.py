@@ -0,0 +1,64 @@
+"""
+Serialized response cache for the hot read endpoints.
+
+Each entry is the exact JSON body an endpoint produced for a key (endpoint,
+args, today) at one data version, plus a strong ETag derived from the bytes.
+app.py bumps the data version on every save/reload, so an entry is reused
+until the schedule actually changes; clients revalidating with
+If-None-Match then get 304 Not Modified without any merging or serializing.
+Compressed forms of the body are kept on the entry as well (encoded()), so
+they are produced once per version too.
+"""
+
+import threading
+from collections import OrderedDict
+from hashlib import sha256
+
+
+class CachedBody:
+    __slots__ = ('version', 'body', 'mimetype', 'etag', 'variants')
+
+    def __init__(self, version, body: bytes, mimetype: str):
+        self.version = version
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = sha256(body).hexdigest()[:32]
+        self.variants = {}  # content-coding -> compressed body
+
+    def encoded(self, encoding: str, compress) -> bytes:
+        """The body in `encoding`, compressed with compress(body, encoding) on first use."""
+        packed = self.variants.get(encoding)
+        if packed is None:
+            # Two threads may both compress on a miss; either result is the same bytes
+            packed = self.variants[encoding] = compress(self.body, encoding)
+        return packed
+
+
+class ResponseCache:
+    """Small LRU of CachedBody keyed by request shape, valid for one data version."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, body: bytes, mimetype: str = 'application/json') -> CachedBody:
+        entry = CachedBody(version, body, mimetype)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
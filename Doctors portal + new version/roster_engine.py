@@ -0,0 +1,488 @@
+"""
+PR staff roster solver.
+
+The two generators in app.py filled each day greedily (random.choice and a few
+counters) and could not guarantee the AI rules saved from the PR portal. This
+module takes the staff, the demand (one Slot per staff member needed: day,
+station, shift times, ED or not, who may take it), leave and any assignments
+that must stay as they are, and returns a roster that never breaks these
+hard rules:
+
+  - at most one duty per staff member per day, none on leave days, only
+    stations the caller marked them eligible for
+  - maxConsecutiveDays working days in a row
+  - minWeeklyOffs days off per ISO week (scaled down for weeks only partly
+    inside the horizon)
+  - maxEDPerWeek ED duties per week (1 with noRepeatedED), none on Fridays
+    with noEDOnFriday, none right after a day off with noEDAfterOff, and no ED
+    slots at all when allowEDAssignment is off
+  - minBreakHours between the end of one shift and the start of the next
+    (night shifts end the following morning)
+
+Within those rules it minimises, in this order of weight: unfilled slots,
+uneven workload (balanceWorkload) and the same staff member repeatedly
+getting the same station. A greedy pass builds a start roster; simulated
+annealing then reassigns, swaps and ejects assignments until the iteration
+limit or the time budget is reached. The temperature follows the iteration
+count only, so the same seed gives the same roster unless the time budget
+cuts the search short. No solver package is needed.
+
+Fixed assignments (manual edits, days outside the range being regenerated)
+count towards every rule but are never moved. That is what incremental
+regeneration uses: context_days() widens the re-solved range by the days the
+rules look across, everything already rostered there becomes fixed,
+uncovered() drops the demand those fixed duties already meet, and only the
+rest is solved. The iteration limit scales with the number of slots, so such
+a run takes milliseconds.
+"""
+
+import math
+import random
+import re
+from collections import namedtuple
+from datetime import date as _date, timedelta
+from time import perf_counter
+
+# One unit of demand. start/end are minutes after midnight (None: no times known,
+# the break rule does not apply); eligible is a tuple of staff ids.
+Slot = namedtuple('Slot', 'day station start end ed eligible label')
+
+W_UNFILLED = 1000.0
+W_BALANCE = 2.0
+W_ROTATION = 1.0
+
+_ED_RE = re.compile(r'(?i)\b(ed|emergency)\b')
+
+
+def is_ed_station(station: dict) -> bool:
+    """Stations flagged ed: true, or whose id/name says ED/Emergency."""
+    if station.get('ed') is not None:
+        return bool(station.get('ed'))
+    return bool(_ED_RE.search(str(station.get('id') or '')) or _ED_RE.search(str(station.get('name') or '')))
+
+
+def hhmm_to_minutes(value):
+    """'07:30' -> 450; None for anything unparseable."""
+    try:
+        h, m = str(value).strip().split(':')[:2]
+        return int(h) * 60 + int(m)
+    except (AttributeError, ValueError):
+        return None
+
+
+class Rules:
+    def __init__(self, min_weekly_offs=2, max_consecutive=6, ed_enabled=True, max_ed_per_week=1,
+                 no_ed_after_off=True, no_ed_on_friday=False, min_break_hours=12, balance=True):
+        self.min_weekly_offs = max(0, int(min_weekly_offs))
+        self.max_consecutive = max(1, int(max_consecutive))
+        self.ed_enabled = bool(ed_enabled)
+        self.max_ed_per_week = max(0, int(max_ed_per_week))
+        self.no_ed_after_off = bool(no_ed_after_off)
+        self.no_ed_on_friday = bool(no_ed_on_friday)
+        self.min_break = max(0, int(min_break_hours)) * 60
+        self.balance = bool(balance)
+
+    @classmethod
+    def from_ai_rules(cls, ai_rules: dict):
+        r = ai_rules or {}
+        max_ed = int(r.get('maxEDPerWeek', 1))
+        if r.get('noRepeatedED', True):
+            max_ed = min(max_ed, 1)
+        return cls(min_weekly_offs=r.get('minWeeklyOffs', 2), max_consecutive=r.get('maxConsecutiveDays', 6),
+                   ed_enabled=r.get('allowEDAssignment', True), max_ed_per_week=max_ed,
+                   no_ed_after_off=r.get('noEDAfterOff', True), no_ed_on_friday=r.get('noEDOnFriday', False),
+                   min_break_hours=r.get('minBreakHours', 12), balance=r.get('balanceWorkload', True))
+
+
+class RosterResult:
+    def __init__(self, slots, assigned, skipped, violations, stats):
+        self.slots = slots            # the solvable slots, in input order
+        self.assigned = assigned      # slot position -> staff id or None
+        self.skipped = skipped        # slots dropped by the ED rules
+        self.violations = violations  # hard-rule breaches (only ever from fixed assignments)
+        self.stats = stats
+
+    def pairs(self):
+        """(slot, staff_id) for every filled slot."""
+        return [(s, sid) for s, sid in zip(self.slots, self.assigned) if sid is not None]
+
+    @property
+    def unfilled(self):
+        return [s for s, sid in zip(self.slots, self.assigned) if sid is None]
+
+
+class _State:
+    """Occupancy and counters of one roster, with the running cost."""
+
+    def __init__(self, days, staff_ids, slots, rules, unavailable, fixed):
+        self.rules = rules
+        self.days = days
+        self.D = len(days)
+        self.day_pos = {d: i for i, d in enumerate(days)}
+        parsed = [_date.fromisoformat(d) for d in days]
+        self.week = []
+        week_ids, in_week = {}, {}
+        for p in parsed:
+            w = week_ids.setdefault(p.isocalendar()[:2], len(week_ids))
+            self.week.append(w)
+            in_week[w] = in_week.get(w, 0) + 1
+        self.friday = [p.weekday() == 4 for p in parsed]
+        # Most working days allowed per week: days in the horizon minus the offs still owed
+        self.week_cap = {w: n - max(0, rules.min_weekly_offs - (7 - n)) for w, n in in_week.items()}
+        self.staff_ids = list(staff_ids)
+        self.staff_pos = {sid: i for i, sid in enumerate(self.staff_ids)}
+        S = len(self.staff_ids)
+        self.occ = [[None] * self.D for _ in range(S)]   # staff x day -> Slot or None
+        self.fixed_at = [[False] * self.D for _ in range(S)]
+        self.leave = [set() for _ in range(S)]
+        self.wcount = [dict() for _ in range(S)]
+        self.edcount = [dict() for _ in range(S)]
+        self.total = [0] * S
+        self.station_count = [dict() for _ in range(S)]
+        self.slots = slots
+        self.slot_day = [self.day_pos[s.day] for s in slots]
+        self.by_day = [[] for _ in range(self.D)]
+        for u, d in enumerate(self.slot_day):
+            self.by_day[d].append(u)
+        self.eligible = [tuple(self.staff_pos[e] for e in s.eligible if e in self.staff_pos) for s in slots]
+        self.assigned = [None] * len(slots)
+        self.unfilled = list(range(len(slots)))
+        self.unfilled_at = {u: i for i, u in enumerate(self.unfilled)}
+        self.cost = W_UNFILLED * len(slots)
+        for sid, day in unavailable:
+            if sid in self.staff_pos and day in self.day_pos:
+                self.leave[self.staff_pos[sid]].add(self.day_pos[day])
+        for (sid, day), slot in fixed.items():
+            if sid in self.staff_pos and day in self.day_pos:
+                s, d = self.staff_pos[sid], self.day_pos[day]
+                self._occupy(s, d, slot)
+                self.fixed_at[s][d] = True
+
+    # --- bookkeeping ---
+    def _occupy(self, s, d, slot):
+        self.occ[s][d] = slot
+        w = self.week[d]
+        self.wcount[s][w] = self.wcount[s].get(w, 0) + 1
+        if slot.ed:
+            self.edcount[s][w] = self.edcount[s].get(w, 0) + 1
+        t = self.total[s]
+        k = self.station_count[s].get(slot.station, 0)
+        self.total[s] = t + 1
+        self.station_count[s][slot.station] = k + 1
+        self.cost += (W_BALANCE * (2 * t + 1) if self.rules.balance else 0.0) + W_ROTATION * (2 * k + 1)
+
+    def _vacate(self, s, d):
+        slot = self.occ[s][d]
+        self.occ[s][d] = None
+        w = self.week[d]
+        self.wcount[s][w] -= 1
+        if slot.ed:
+            self.edcount[s][w] -= 1
+        t = self.total[s] - 1
+        k = self.station_count[s][slot.station] - 1
+        self.total[s] = t
+        self.station_count[s][slot.station] = k
+        self.cost -= (W_BALANCE * (2 * t + 1) if self.rules.balance else 0.0) + W_ROTATION * (2 * k + 1)
+
+    def assign(self, u, s):
+        self._occupy(s, self.slot_day[u], self.slots[u])
+        self.assigned[u] = s
+        i = self.unfilled_at.pop(u)
+        last = self.unfilled.pop()
+        if last != u:
+            self.unfilled[i] = last
+            self.unfilled_at[last] = i
+        self.cost -= W_UNFILLED
+
+    def unassign(self, u):
+        s = self.assigned[u]
+        self._vacate(s, self.slot_day[u])
+        self.assigned[u] = None
+        self.unfilled_at[u] = len(self.unfilled)
+        self.unfilled.append(u)
+        self.cost += W_UNFILLED
+
+    # --- hard rules ---
+    def _end_abs(self, d, slot):
+        end = slot.end
+        if end is None:
+            return None
+        if slot.start is not None and end <= slot.start:
+            end += 1440
+        return d * 1440 + end
+
+    def can_take(self, s, u):
+        """Whether staff s may take slot u (s must not be moved off that day meanwhile)."""
+        d = self.slot_day[u]
+        slot = self.slots[u]
+        occ = self.occ[s]
+        if occ[d] is not None or d in self.leave[s]:
+            return False
+        r = self.rules
+        run = 1
+        k = d - 1
+        while k >= 0 and occ[k] is not None:
+            run += 1
+            k -= 1
+        k = d + 1
+        while k < self.D and occ[k] is not None:
+            run += 1
+            k += 1
+        if run > r.max_consecutive:
+            return False
+        w = self.week[d]
+        if self.wcount[s].get(w, 0) + 1 > self.week_cap[w]:
+            return False
+        if slot.ed:
+            if self.edcount[s].get(w, 0) + 1 > r.max_ed_per_week:
+                return False
+            if r.no_ed_after_off and d > 0 and occ[d - 1] is None:
+                return False
+        if r.min_break and slot.start is not None:
+            start = d * 1440 + slot.start
+            if d > 0 and occ[d - 1] is not None:
+                prev_end = self._end_abs(d - 1, occ[d - 1])
+                if prev_end is not None and start - prev_end < r.min_break:
+                    return False
+            if d + 1 < self.D and occ[d + 1] is not None and occ[d + 1].start is not None:
+                end = self._end_abs(d, slot)
+                if end is not None and (d + 1) * 1440 + occ[d + 1].start - end < r.min_break:
+                    return False
+        return True
+
+    def can_release(self, s, d):
+        """Whether staff s can be taken off day d (an ED duty the next day needs them working)."""
+        if self.fixed_at[s][d]:
+            return False
+        if self.rules.no_ed_after_off and d + 1 < self.D:
+            nxt = self.occ[s][d + 1]
+            if nxt is not None and nxt.ed:
+                return False
+        return True
+
+    def violations(self, eligible_ids=None):
+        """Every hard-rule breach in the current roster."""
+        out = []
+        r = self.rules
+        for s, sid in enumerate(self.staff_ids):
+            occ = self.occ[s]
+            run = 0
+            for d in range(self.D):
+                slot = occ[d]
+                day = self.days[d]
+                if slot is None:
+                    run = 0
+                    continue
+                run += 1
+                if run == r.max_consecutive + 1:
+                    out.append({'staff_id': sid, 'date': day, 'rule': 'maxConsecutiveDays'})
+                if d in self.leave[s]:
+                    out.append({'staff_id': sid, 'date': day, 'rule': 'leave'})
+                if slot.ed and r.no_ed_after_off and d > 0 and occ[d - 1] is None:
+                    out.append({'staff_id': sid, 'date': day, 'rule': 'noEDAfterOff'})
+                if slot.ed and (not r.ed_enabled or (r.no_ed_on_friday and self.friday[d])):
+                    out.append({'staff_id': sid, 'date': day, 'rule': 'allowEDAssignment' if not r.ed_enabled else 'noEDOnFriday'})
+                if r.min_break and d > 0 and occ[d - 1] is not None and slot.start is not None:
+                    prev_end = self._end_abs(d - 1, occ[d - 1])
+                    if prev_end is not None and d * 1440 + slot.start - prev_end < r.min_break:
+                        out.append({'staff_id': sid, 'date': day, 'rule': 'minBreakHours'})
+            for w, n in self.wcount[s].items():
+                if n > self.week_cap[w]:
+                    first = self.days[self.week.index(w)]
+                    out.append({'staff_id': sid, 'date': first, 'rule': 'minWeeklyOffs'})
+                if self.edcount[s].get(w, 0) > r.max_ed_per_week:
+                    first = self.days[self.week.index(w)]
+                    out.append({'staff_id': sid, 'date': first, 'rule': 'maxEDPerWeek'})
+        return out
+
+
+def _greedy(st: _State, rng):
+    order = sorted(range(len(st.slots)), key=lambda u: (st.slot_day[u], len(st.eligible[u]), u))
+    for u in order:
+        best, best_cost = None, None
+        cands = list(st.eligible[u])
+        rng.shuffle(cands)
+        for s in cands:
+            if not st.can_take(s, u):
+                continue
+            slot = st.slots[u]
+            c = (W_BALANCE * st.total[s] if st.rules.balance else 0.0) + W_ROTATION * st.station_count[s].get(slot.station, 0)
+            if best is None or c < best_cost:
+                best, best_cost = s, c
+        if best is not None:
+            st.assign(u, best)
+
+
+def _move(st: _State, rng, temp):
+    """Try one random move; keep it if the annealing criterion accepts it."""
+    n = len(st.slots)
+    before = st.cost
+    kind = rng.random()
+    if st.unfilled and kind < 0.35:
+        # Fill an unfilled slot, ejecting the chosen staff member from another
+        # duty that week when the rules leave them no room
+        u = st.unfilled[rng.randrange(len(st.unfilled))]
+        if not st.eligible[u]:
+            return False
+        s = st.eligible[u][rng.randrange(len(st.eligible[u]))]
+        if st.can_take(s, u):
+            st.assign(u, s)
+            return True
+        d = st.slot_day[u]
+        w = st.week[d]
+        mine = [v for v in range(st.D) if st.occ[s][v] is not None and not st.fixed_at[s][v]
+                and (st.week[v] == w or abs(v - d) <= st.rules.max_consecutive)]
+        if not mine:
+            return False
+        v = mine[rng.randrange(len(mine))]
+        if not st.can_release(s, v):
+            return False
+        u2 = _slot_of(st, s, v)
+        if u2 is None:
+            return False
+        st.unassign(u2)
+        if not st.can_take(s, u):
+            st.assign(u2, s)
+            return False
+        st.assign(u, s)
+        if _accept(st.cost - before, temp, rng):
+            return True
+        st.unassign(u)
+        st.assign(u2, s)
+        return False
+    u = rng.randrange(n)
+    s1 = st.assigned[u]
+    if s1 is None:
+        return False
+    d = st.slot_day[u]
+    if kind < 0.75:
+        # Give the slot to someone else
+        if len(st.eligible[u]) < 2 or not st.can_release(s1, d):
+            return False
+        s2 = st.eligible[u][rng.randrange(len(st.eligible[u]))]
+        if s2 == s1:
+            return False
+        st.unassign(u)
+        if not st.can_take(s2, u):
+            st.assign(u, s1)
+            return False
+        st.assign(u, s2)
+        if _accept(st.cost - before, temp, rng):
+            return True
+        st.unassign(u)
+        st.assign(u, s1)
+        return False
+    # Swap two staff members working the same day
+    others = [v for v in st.by_day[d] if v != u and st.assigned[v] is not None]
+    if not others:
+        return False
+    u2 = others[rng.randrange(len(others))]
+    s2 = st.assigned[u2]
+    if s2 not in st.eligible[u] or s1 not in st.eligible[u2]:
+        return False
+    st.unassign(u)
+    st.unassign(u2)
+    if st.can_take(s2, u):
+        st.assign(u, s2)
+        if st.can_take(s1, u2):
+            st.assign(u2, s1)
+            if _accept(st.cost - before, temp, rng):
+                return True
+            st.unassign(u2)
+        st.unassign(u)
+    st.assign(u, s1)
+    st.assign(u2, s2)
+    return False
+
+
+def _slot_of(st: _State, s, d):
+    for v in st.by_day[d]:
+        if st.assigned[v] == s:
+            return v
+    return None
+
+
+def _accept(delta, temp, rng):
+    if delta <= 0:
+        return True
+    return temp > 0 and rng.random() < math.exp(-delta / temp)
+
+
+def context_days(start: str, end: str, rules: Rules) -> list:
+    """ISO dates from start to end widened to whole ISO weeks and by
+    max_consecutive days on each side: every day a rule check on start..end
+    can look at."""
+    first, last = _date.fromisoformat(start), _date.fromisoformat(end)
+    first = min(first - timedelta(days=first.weekday()), first - timedelta(days=rules.max_consecutive))
+    last = max(last + timedelta(days=6 - last.weekday()), last + timedelta(days=rules.max_consecutive))
+    return [(first + timedelta(days=i)).isoformat() for i in range((last - first).days + 1)]
+
+
+def uncovered(slots, fixed: dict) -> list:
+    """slots minus one slot per fixed duty at the same day and station."""
+    covered = {}
+    for slot in fixed.values():
+        key = (slot.day, slot.station)
+        covered[key] = covered.get(key, 0) + 1
+    out = []
+    for slot in slots:
+        key = (slot.day, slot.station)
+        if covered.get(key):
+            covered[key] -= 1
+        else:
+            out.append(slot)
+    return out
+
+
+def solve(days, staff_ids, slots, rules: Rules, unavailable=(), fixed=None, time_budget: float = 2.0,
+          seed: int = 0, max_iterations: int = None, progress=None) -> RosterResult:
+    """Roster the slots over days (ISO dates, consecutive).
+
+    unavailable: (staff_id, day) pairs on leave. fixed: {(staff_id, day): Slot}
+    assignments that stay put (their day must be in days). progress(fraction) is
+    called now and then. max_iterations defaults to 800 per slot (at most 200000).
+    """
+    t0 = perf_counter()
+    skipped, usable = [], []
+    for slot in slots:
+        friday = _date.fromisoformat(slot.day).weekday() == 4
+        if slot.ed and (not rules.ed_enabled or rules.max_ed_per_week == 0 or (rules.no_ed_on_friday and friday)):
+            skipped.append(slot)
+        else:
+            usable.append(slot)
+    if max_iterations is None:
+        max_iterations = min(200000, 1000 + 800 * len(usable))
+    rng = random.Random(seed)
+    st = _State(days, staff_ids, usable, rules, unavailable, fixed or {})
+    _greedy(st, rng)
+    greedy_unfilled = len(st.unfilled)
+    best_cost, best = st.cost, list(st.assigned)
+    iterations = 0
+    stopped_by = 'iterations'
+    t_start, t_end = 3.0, 0.05
+    if usable and max_iterations > 0:
+        for iterations in range(1, max_iterations + 1):
+            temp = t_start * (t_end / t_start) ** (iterations / max_iterations)
+            if _move(st, rng, temp) and st.cost < best_cost - 1e-9:
+                best_cost, best = st.cost, list(st.assigned)
+            if iterations & 1023 == 0:
+                if progress:
+                    progress(iterations / max_iterations)
+                if perf_counter() - t0 >= time_budget:
+                    stopped_by = 'time_budget'
+                    break
+    # Restore the best roster seen
+    for u in range(len(usable)):
+        if st.assigned[u] is not None:
+            st.unassign(u)
+    for u, s in enumerate(best):
+        if s is not None:
+            st.assign(u, s)
+    assigned = [st.staff_ids[s] if s is not None else None for s in st.assigned]
+    stats = {
+        'slots': len(usable), 'filled': sum(1 for a in assigned if a is not None),
+        'unfilled': len(st.unfilled), 'greedy_unfilled': greedy_unfilled, 'skipped_ed': len(skipped),
+        'cost': round(st.cost, 3), 'iterations': iterations, 'stopped_by': stopped_by,
+        'elapsed_ms': round((perf_counter() - t0) * 1000, 1), 'seed': seed,
+    }
+    return RosterResult(usable, assigned, skipped, st.violations(), stats)
@@ -5,6 +5,12 @@ Reads HOST/PORT from environment variables in this order:
 - PORT or FLASK_RUN_PORT (default 5000)
 - HOST or FLASK_RUN_HOST (default 0.0.0.0)
 
+Set ASYNC_SSE_PORT to serve /events from the asyncio SSE server (sse_async.py)
+so display streams don't occupy waitress worker threads.
+
+For several processes behind a load balancer, start one per PORT with
+MULTI_WORKER=1 (shared file lock, version counter and event relay).
+
 Usage:
   python run_waitress.py
 """
@@ -12,7 +18,7 @@ import os
 from waitress import serve
 
 # Import the Flask app instance
-from app import app, maybe_start_telegram
+from app import app, maybe_start_telegram, start_async_sse
 
 HOST = os.environ.get('HOST') or os.environ.get('FLASK_RUN_HOST') or '0.0.0.0'
 PORT = int(os.environ.get('PORT') or os.environ.get('FLASK_RUN_PORT') or 5000)
@@ -24,6 +30,12 @@ try:
 except Exception:
     pass
 
+# Long-lived /events streams go to the asyncio server when ASYNC_SSE_PORT is set
+try:
+    start_async_sse()
+except Exception:
+    pass
+
 if __name__ == '__main__':
     # waitress serve
     serve(app, host=HOST, port=PORT, threads=THREADS, ident='doctor-schedule')
@@ -0,0 +1,200 @@
+"""
+In-memory date index over the doctors/schedule data.
+
+The read endpoints (/api/window, /api/day, /api/doctors) used to scan every
+doctor's schedule_by_date for every requested day. ScheduleIndex keeps
+date -> {doctor_id: per-date entry} for the loaded data, in doctor display
+order, and caches the per-day response rows built from it. app.load_data()
+rebuilds it when the data is (re)loaded; writes patch it per (doctor, date).
+
+It also keeps a version per date (taken from one monotonically increasing
+sequence, so versions never repeat across rebuilds). /api/day reports it and
+doctor_update events carry prev_version/version, letting displays apply a
+delta only when it directly follows the state they hold. In multi-worker mode
+the sequence follows the storage's shared version counter, so versions from
+different workers are comparable.
+"""
+
+import threading
+
+
+def window_row(doc: dict, per_date: dict) -> dict:
+    """One doctor's row for /api/window on a day (PENDING placeholder when unscheduled)."""
+    if per_date:
+        return dict(
+            id=doc.get('id'), name=doc.get('name'), specialty=doc.get('specialty'),
+            designation=per_date.get('designation'), status=per_date.get('status', 'PENDING'),
+            start_time=per_date.get('start_time'), room=per_date.get('room'),
+            patient_count=per_date.get('patient_count'), opd=per_date.get('opd'),
+            breaks=per_date.get('breaks'), status_reason=per_date.get('status_reason'),
+            before_break_opd_patients=per_date.get('before_break_opd_patients'),
+            after_break_opd_patients=per_date.get('after_break_opd_patients'),
+            before_break_opd=per_date.get('before_break_opd'),
+            after_break_opd=per_date.get('after_break_opd'),
+            post_oncall=per_date.get('post_oncall'),
+            after_break_note=per_date.get('after_break_note'),
+            image_version=doc.get('image_version', 1)
+        )
+    # If no per-date schedule for this day:
+    # Always show as clean PENDING (no carry-over) to prevent previous-day bleed-through
+    return dict(
+        id=doc.get('id'), name=doc.get('name'), specialty=doc.get('specialty'),
+        designation=None, status='PENDING', start_time=None, room=None,
+        patient_count=None, opd=[], breaks=[], status_reason=None,
+        before_break_opd=[], after_break_opd=[],
+        before_break_opd_patients=None, after_break_opd_patients=None,
+        after_break_note=None,
+        image_version=doc.get('image_version', 1)
+    )
+
+
+def day_row(doc: dict, per_date: dict) -> dict:
+    """One doctor's row for /api/day (only used for explicit per-date entries)."""
+    return dict(id=doc.get('id'), name=doc.get('name'), specialty=doc.get('specialty'),
+                designation=per_date.get('designation'), status=per_date.get('status', 'PENDING'),
+                start_time=per_date.get('start_time'), room=per_date.get('room'),
+                patient_count=per_date.get('patient_count'), opd=per_date.get('opd'),
+                breaks=per_date.get('breaks'), status_reason=per_date.get('status_reason'),
+                before_break_opd_patients=per_date.get('before_break_opd_patients'),
+                after_break_opd_patients=per_date.get('after_break_opd_patients'),
+                post_oncall=per_date.get('post_oncall'),
+                after_break_note=per_date.get('after_break_note'),
+                image_version=doc.get('image_version', 1))
+
+
+class ScheduleIndex:
+    """date -> {doctor_id: entry} over one loaded data dict, plus cached day rows.
+
+    Entries are the same dict objects stored in schedule_by_date, so the index
+    never copies schedule data; touch() only has to fix membership and drop the
+    cached rows for that day.
+    """
+
+    def __init__(self, max_cached_days: int = 120):
+        self.max_cached_days = max_cached_days
+        self._lock = threading.RLock()
+        self._data = None
+        self._docs = {}       # doctor key -> doctor dict
+        self._pos = {}        # doctor key -> display position
+        self._by_date = {}    # date -> {doctor key: entry}
+        self._rows = {}       # (kind, date) -> cached list of rows
+        self._stale = True
+        self._seq = 0             # version sequence, never reset
+        self._base_version = 0    # version of every date not changed since the last rebuild
+        self._versions = {}       # date -> version of its last change
+
+    def rebuild(self, data: dict, version: int = None):
+        """Index `data`; every date starts at `version` (or the next sequence number)."""
+        with self._lock:
+            docs, pos, by_date = {}, {}, {}
+            for i, d in enumerate(data.get('doctors', []) if isinstance(data, dict) else []):
+                key = str(d.get('id'))
+                docs[key] = d
+                pos[key] = i
+                sched = d.get('schedule_by_date')
+                if not isinstance(sched, dict):
+                    continue
+                for date_iso, entry in sched.items():
+                    if entry:
+                        by_date.setdefault(date_iso, {})[key] = entry
+            self._data = data
+            self._docs, self._pos, self._by_date = docs, pos, by_date
+            self._rows = {}
+            self._stale = False
+            self._seq = max(self._seq + 1, version or 0)
+            self._base_version = self._seq
+            self._versions = {}
+
+    def mark_stale(self):
+        with self._lock:
+            self._stale = True
+            self._rows = {}
+
+    def ensure(self, data: dict, version: int = None):
+        """Rebuild if the index is stale or was built for a different data dict."""
+        with self._lock:
+            if self._stale or self._data is not data:
+                self.rebuild(data, version)
+        return self
+
+    def touch(self, doc: dict, date_iso: str):
+        """Re-read one doctor's entry for date_iso after it was changed in place."""
+        with self._lock:
+            if self._stale:
+                return
+            key = str(doc.get('id'))
+            if self._docs.get(key) is not doc:
+                # Not the indexed copy (e.g. a new doctor): rebuild on next read
+                self.mark_stale()
+                return
+            entry = (doc.get('schedule_by_date') or {}).get(date_iso)
+            if entry:
+                self._by_date.setdefault(date_iso, {})[key] = entry
+            else:
+                bucket = self._by_date.get(date_iso)
+                if bucket:
+                    bucket.pop(key, None)
+            self._rows.pop(('window', date_iso), None)
+            self._rows.pop(('day', date_iso), None)
+
+    def touch_doctor(self, doc: dict):
+        """Base fields (name, specialty, image_version...) changed: drop cached rows."""
+        with self._lock:
+            if self._docs.get(str(doc.get('id'))) is not doc:
+                self.mark_stale()
+            else:
+                self._rows = {}
+
+    def date_version(self, date_iso: str) -> int:
+        with self._lock:
+            return self._versions.get(date_iso, self._base_version)
+
+    def bump(self, dates, version: int = None) -> dict:
+        """Move the given dates to one new version (`version` if newer than the
+        sequence); returns {date: (prev_version, version)}."""
+        out = {}
+        with self._lock:
+            self._seq = max(self._seq + 1, version or 0)
+            for date_iso in dict.fromkeys(dates):
+                prev = self._versions.get(date_iso, self._base_version)
+                self._versions[date_iso] = self._seq
+                out[date_iso] = (prev, self._seq)
+        return out
+
+    def doctor_row(self, doc: dict, date_iso: str) -> dict:
+        """The doctor's /api/day row for date_iso, or the PENDING placeholder when unscheduled."""
+        entry = (doc.get('schedule_by_date') or {}).get(date_iso)
+        return day_row(doc, entry) if entry else window_row(doc, None)
+
+    def entries_for(self, date_iso: str) -> dict:
+        with self._lock:
+            return dict(self._by_date.get(date_iso) or {})
+
+    def entry(self, doc: dict, date_iso: str) -> dict:
+        with self._lock:
+            return (self._by_date.get(date_iso) or {}).get(str(doc.get('id'))) or {}
+
+    def _cached(self, kind: str, date_iso: str, build):
+        with self._lock:
+            rows = self._rows.get((kind, date_iso))
+            if rows is None:
+                if len(self._rows) >= 2 * self.max_cached_days:
+                    self._rows = {}
+                rows = build()
+                self._rows[(kind, date_iso)] = rows
+            return rows
+
+    def window_rows(self, date_iso: str) -> list:
+        """All doctors in display order, merged for date_iso (shared list: do not mutate)."""
+        def build():
+            bucket = self._by_date.get(date_iso) or {}
+            return [window_row(d, bucket.get(key)) for key, d in self._docs.items()]
+        return self._cached('window', date_iso, build)
+
+    def day_rows(self, date_iso: str) -> list:
+        """Only doctors with an explicit entry for date_iso, in display order."""
+        def build():
+            bucket = self._by_date.get(date_iso) or {}
+            keys = sorted(bucket, key=lambda k: self._pos.get(k, 0))
+            return [day_row(self._docs[k], bucket[k]) for k in keys if k in self._docs]
+        return self._cached('day', date_iso, build)
@@ -0,0 +1,460 @@
+"""
+Excel schedule parsing for the bulk / preview / apply upload endpoints.
+
+Workbooks are read with openpyxl in read-only mode: rows are streamed from the
+sheet XML as value tuples instead of building every cell object in memory, so
+memory stays flat however many months a grouped schedule file covers.
+
+parse_schedule() turns that row stream into ScheduleRecord tuples (row number,
+doctor name, matched doctor id, date, patch, preview state) in one pass. It
+understands both layouts the templates produce:
+
+  - flat: one header row (Date, Doctor, Start Time, ...) and a row per doctor/day
+  - grouped: a date row ("19th Wednesday 2025 19/11/2025"), then per specialty
+    a title row, a header row and the doctor rows; a Date column on a data row
+    wins over the date row above it
+
+Header names go through HEADER_ALIASES, so old and new template columns map to
+the same keys. Preview and apply share the result through ParseCache, which
+also keeps it on disk next to the upload: applying (or re-previewing) a file
+that was already parsed doesn't read the workbook again.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime
+
+# One parsed data row. doctor_id is None when the name matched no doctor.
+# state is what the preview matrix shows: ADDED (has times), OFF or EMPTY.
+ScheduleRecord = namedtuple('ScheduleRecord', 'row doctor_name doctor_id date patch state')
+
+HEADER_ALIASES = {
+    'doctor name': 'doctor', 'name': 'doctor', 'dr': 'doctor', 'dr.': 'doctor',
+    'physician': 'doctor', 'doctor/physician': 'doctor',
+    'starting time': 'start time', 'start': 'start time', 'starttime': 'start time',
+    'room no': 'room', 'room number': 'room',
+    'total no of patients': 'total patients', 'total patients': 'total patients', 'total': 'total patients',
+    # Old combined "time/pts" columns and the newer separate timing/patients columns
+    'before break opd patients (time/pts)': 'before break opd patients combined',
+    'before break opd timing': 'before break opd timing',
+    'before break opd patients': 'before break opd patients',
+    'before break patients': 'before break opd patients',
+    'after break opd patients (time/pts)': 'after break opd patients combined',
+    'after break opd timing': 'after break opd timing',
+    'after break opd patients': 'after break opd patients',
+    'after break patients': 'after break opd patients',
+    'shift': 'shift',
+    'specialty': 'specialty', 'speciality': 'specialty', 'department': 'specialty', 'dept': 'specialty',
+}
+
+ON_CALL_VALUES = ('ON/CALL', 'ON CALL', 'ONCALL', 'ON-CALL')
+POST_ON_CALL_VALUES = ('POST ON/CALL', 'POST ONCALL', 'POST ON CALL', 'POST-ONCALL', 'POST-ON-CALL')
+
+_TIME_RANGE_RE = re.compile(r'(\d{1,2}:\d{2}(?::\d{2})?)\s*-\s*(\d{1,2}:\d{2}(?::\d{2})?)')
+_HH_MM_RE = re.compile(r'^(\d{1,2}):(\d{2})')
+_SMALL_INT_RE = re.compile(r'\b\d{1,3}\b')
+_NO_BREAK_RE = re.compile(r'no\s*break', re.I)
+_YMD_IN_TEXT_RE = re.compile(r'(\d{4})[./-](\d{1,2})[./-](\d{1,2})')
+_DMY_IN_TEXT_RE = re.compile(r'(\d{1,2})[./-](\d{1,2})[./-](\d{2,4})')
+
+
+class XlsxRows:
+    """Re-iterable row stream over the active sheet of an .xlsx file.
+
+    source is a path or a binary file object. Opening validates the workbook
+    (so unreadable uploads fail up front); each iteration is a fresh
+    constant-memory pass that closes the workbook when it ends, which matters
+    on Windows where an open file can't be deleted.
+    """
+
+    def __init__(self, source):
+        from openpyxl import load_workbook
+        self._load = load_workbook
+        self.source = source
+        self._open().close()
+
+    def _open(self):
+        if hasattr(self.source, 'seek'):
+            self.source.seek(0)
+        return self._load(self.source, read_only=True, data_only=True)
+
+    def __iter__(self):
+        wb = self._open()
+        try:
+            ws = wb.active
+            # Stored <dimension> tags are often wrong in generated files: read every row present
+            ws.reset_dimensions()
+            for row in ws.iter_rows(values_only=True):
+                yield row
+        finally:
+            wb.close()
+
+
+def cell_str(v) -> str:
+    if v is None:
+        return ''
+    return str(v).strip()
+
+
+def norm_key(k: str) -> str:
+    k = (k or '').strip().lower()
+    return HEADER_ALIASES.get(k, k)
+
+
+def parse_date(v):
+    """ISO date of a cell: date/datetime values, 'YYYY-MM-DD', or a date inside
+    text such as '19th Wednesday 2025 19/11/2025' (day first)."""
+    if v is None:
+        return None
+    if isinstance(v, datetime):
+        return v.date().isoformat()
+    if isinstance(v, date):
+        return v.isoformat()
+    s = cell_str(v)
+    if not s:
+        return None
+    try:
+        return datetime.strptime(s, '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        pass
+    m = _YMD_IN_TEXT_RE.search(s)
+    if m:
+        y, mo, d = map(int, m.groups())
+        return f"{y:04d}-{mo:02d}-{d:02d}"
+    m = _DMY_IN_TEXT_RE.search(s)
+    if m:
+        d, mo, y = m.groups()
+        y = int(y)
+        if y < 100:
+            y += 2000
+        return f"{y:04d}-{int(mo):02d}-{int(d):02d}"
+    return None
+
+
+def parse_breaks(v):
+    s = cell_str(v)
+    if not s:
+        return None
+    items = [p.strip() for p in s.split(',') if p.strip()]
+    return items or None
+
+
+def extract_time_and_count(v):
+    """'08:00-12:00 15' -> ('08:00-12:00', 15); either part may be None."""
+    s = cell_str(v)
+    if not s:
+        return (None, None)
+    time_txt = None
+    rest = s
+    m = _TIME_RANGE_RE.search(s)
+    if m:
+        def norm(t):
+            mm = _HH_MM_RE.match(t)
+            return f"{int(mm.group(1)):02d}:{mm.group(2)}" if mm else t
+        time_txt = f"{norm(m.group(1))}-{norm(m.group(2))}"
+        # Remove the range before looking for the patient count
+        rest = (s[:m.start()] + ' ' + s[m.end():]).strip()
+    counts = _SMALL_INT_RE.findall(rest)
+    return (time_txt, int(counts[-1]) if counts else None)
+
+
+def _to_int(s):
+    try:
+        return int(float(s))
+    except (TypeError, ValueError):
+        return None
+
+
+def find_specialty_match(spec_val: str, shift_knowledge: dict):
+    if not spec_val:
+        return None
+    s = spec_val.strip().lower()
+    for k in shift_knowledge.keys():
+        if k.strip().lower() == s:
+            return k
+    return spec_val  # as-is; the lookup below simply finds nothing
+
+
+def apply_shift_defaults(patch: dict, spec: str, shift_name: str, shift_knowledge: dict):
+    """Fill fields the row left empty from the specialty's shift template."""
+    if not shift_name or not shift_knowledge:
+        return
+    s_key = find_specialty_match(spec or '', shift_knowledge) if spec else None
+    if not s_key:
+        return
+    defaults = (shift_knowledge.get(s_key) or {}).get(shift_name.strip())
+    if not isinstance(defaults, dict):
+        return
+    applied_any = False
+    if 'start_time' not in patch and defaults.get('start'):
+        patch['start_time'] = defaults.get('start')
+        applied_any = True
+    for field, key in (('before_break_opd_patients', 'before_patients'), ('after_break_opd_patients', 'after_patients')):
+        if field not in patch and defaults.get(key) not in (None, ''):
+            value = _to_int(defaults.get(key))
+            if value is not None:
+                patch[field] = value
+                applied_any = True
+    if 'breaks' not in patch:
+        accum = [t for t in ((defaults.get('before_timing') or '').strip(), (defaults.get('breaks') or '').strip(),
+                             (defaults.get('after_timing') or '').strip()) if t]
+        if accum:
+            patch['breaks'] = accum
+            applied_any = True
+    if 'patient_count' not in patch:
+        tp = defaults.get('total_patients')
+        if tp not in (None, ''):
+            value = _to_int(tp)
+            if value is not None:
+                patch['patient_count'] = value
+                applied_any = True
+        else:
+            bp = patch.get('before_break_opd_patients')
+            ap = patch.get('after_break_opd_patients')
+            if isinstance(bp, int) and isinstance(ap, int):
+                patch['patient_count'] = bp + ap
+                applied_any = True
+    if applied_any and patch.get('status') not in ('OFF_DUTY', 'ON_CALL'):
+        patch['status'] = 'ON_DUTY'
+
+
+def _range_start(rng: str) -> int:
+    """Minutes after midnight a 'HH:MM-HH:MM' range starts; unparseable text sorts last."""
+    m = _HH_MM_RE.match(rng.strip())
+    return int(m.group(1)) * 60 + int(m.group(2)) if m else 24 * 60
+
+
+def _opd_side(get, side: str, field: str, patch: dict):
+    """Patients (into patch) and time range (returned) for the before/after break OPD.
+    Separate timing/patients columns win over the old combined 'time/pts' column."""
+    timing = cell_str(get(f'{side} break opd timing'))
+    patients = cell_str(get(f'{side} break opd patients'))
+    rng, count = timing or None, None
+    if patients:
+        count = _to_int(patients)
+        if count is None:  # a 'time/pts' value in the patients column
+            found_rng, count = extract_time_and_count(patients)
+            rng = rng or found_rng
+    elif not timing:
+        rng, count = extract_time_and_count(get(f'{side} break opd patients combined'))
+    if count is not None:
+        patch[field] = count
+    return rng
+
+
+def build_patch(get, specialty=None, shift_knowledge=None) -> dict:
+    """Per-date schedule patch for one data row; get(header_key) returns the raw cell."""
+    patch = {}
+    st = cell_str(get('start time'))
+    if st:
+        patch['start_time'] = st
+        patch['status'] = 'ON_DUTY'
+    rm = cell_str(get('room'))
+    if rm:
+        patch['room'] = rm
+    tp = cell_str(get('total patients'))
+    if tp:
+        value = _to_int(tp)
+        if value is not None:
+            patch['patient_count'] = value
+    before_rng = _opd_side(get, 'before', 'before_break_opd_patients', patch)
+    after_rng = _opd_side(get, 'after', 'after_break_opd_patients', patch)
+    br = parse_breaks(get('breaks'))
+    if br and any(_NO_BREAK_RE.search(b) for b in br):
+        patch['breaks'] = ['NO BREAK']  # explicit override of any OPD ranges
+    else:
+        ranges = ([before_rng] if before_rng else []) + (br or []) + ([after_rng] if after_rng else [])
+        if ranges:
+            patch['breaks'] = sorted(dict.fromkeys(ranges), key=_range_start)
+    shift_val = cell_str(get('shift'))
+    if shift_val:
+        apply_shift_defaults(patch, cell_str(get('specialty')) or specialty, shift_val, shift_knowledge or {})
+    status_val = cell_str(get('status')).upper()
+    if status_val in ON_CALL_VALUES:
+        patch['status'] = 'ON_CALL'
+    elif status_val in POST_ON_CALL_VALUES:
+        patch['status'] = 'ON_DUTY'
+        patch['post_oncall'] = True
+    elif status_val == 'OFF':
+        # Not working: clear the OPD fields
+        patch.update(status='OFF_DUTY', start_time=None, room=None, patient_count=None,
+                     before_break_opd_patients=None, after_break_opd_patients=None, breaks=None)
+    # Start time without counts: default the OPD counts to 0 so displays don't show "no patients"
+    if 'start_time' in patch and 'patient_count' not in patch and patch.get('status') != 'OFF_DUTY':
+        patch.setdefault('before_break_opd_patients', 0)
+        patch.setdefault('after_break_opd_patients', 0)
+    return patch
+
+
+def _row_state(get) -> str:
+    if cell_str(get('status')).upper() == 'OFF':
+        return 'OFF'
+    if cell_str(get('start time')) or cell_str(get('before break opd timing')) or cell_str(get('after break opd timing')):
+        return 'ADDED'
+    return 'EMPTY'
+
+
+def make_doctor_matcher(name_index, doctors):
+    """Return match(name) -> doctor dict or None: the doctor whose name tokens are
+    the largest subset of the given name's tokens (name_index.DoctorNameIndex
+    over doctors). Results are memoized per name for the parse."""
+    memo = {}
+
+    def match(name):
+        if name not in memo:
+            memo[name] = name_index.match_subset(name, doctors)
+        return memo[name]
+    return match
+
+
+def parse_schedule(rows, match_doctor, shift_knowledge=None) -> list:
+    """One pass over a row stream (flat or grouped layout) -> list of ScheduleRecord.
+
+    match_doctor(name) returns the doctor dict for a name or None; rows whose
+    name matches nobody are kept with doctor_id None so callers can report them.
+    """
+    records = []
+    header = None
+    current_date = None
+    for i, row in enumerate(rows, start=1):
+        vals = [cell_str(v) for v in row]
+        if not any(vals):
+            continue
+        keys = {}
+        for idx, v in enumerate(vals):
+            k = norm_key(v)
+            if k and k not in keys:
+                keys[k] = idx
+        if 'doctor' in keys:
+            header = keys  # header row (repeated per specialty block in grouped files)
+            continue
+        filled = sum(1 for v in vals if v)
+        doc_name = ''
+        if header is not None and filled > 1:  # a lone name is a specialty title row
+            d_idx = header['doctor']
+            doc_name = vals[d_idx] if d_idx < len(vals) else ''
+        if doc_name:
+            def get(key, row=row, header=header):
+                j = header.get(key)
+                return row[j] if j is not None and j < len(row) else None
+            use_date = parse_date(get('date')) or current_date
+            if not use_date:
+                continue
+            doc = match_doctor(doc_name)
+            patch = build_patch(get, doc.get('specialty') if doc else None, shift_knowledge)
+            records.append(ScheduleRecord(i, doc_name, doc.get('id') if doc else None, use_date, patch, _row_state(get)))
+            continue
+        # A date declaration row (grouped layout): a few cells, one of them a date
+        if filled <= 3:
+            for v in row:
+                iso = parse_date(v)
+                if iso:
+                    current_date = iso
+                    break
+    return records
+
+
+class ParseCache:
+    """Parse results of stored uploads, so preview and apply don't re-read a file.
+
+    Two layers: an in-memory LRU keyed by (path, mtime, size, context), and a
+    hidden sidecar next to the upload (".<name>.parse.json") holding the
+    records under the sha256 of the file bytes and a digest of the context
+    (doctor names/specialties and shift templates, which both change what a
+    row parses to). The sidecar survives restarts and is shared by workers;
+    a stale one is simply rewritten. discard()/move() keep it with its file.
+    """
+
+    FORMAT = 1  # bump when parse_schedule output changes meaning
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def sidecar_path(path: str) -> str:
+        head, name = os.path.split(path)
+        return os.path.join(head, f'.{name}.parse.json')
+
+    @staticmethod
+    def file_sha256(path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    @classmethod
+    def context_digest(cls, context) -> str:
+        raw = json.dumps([cls.FORMAT, context], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get_or_parse(self, path: str, context, parse):
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_mtime_ns, st.st_size, self.context_digest(context))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        sha = self.file_sha256(path)
+        records = self._read_sidecar(path, sha, key[3])
+        if records is None:
+            records = parse()
+            self._write_sidecar(path, sha, key[3], records)
+        with self._lock:
+            self._entries[key] = records
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return records
+
+    def _read_sidecar(self, path, sha, context_digest):
+        try:
+            with open(self.sidecar_path(path), 'r', encoding='utf-8') as fh:
+                doc = json.load(fh)
+            if doc.get('sha256') != sha or doc.get('context') != context_digest:
+                return None
+            return [ScheduleRecord(*r) for r in doc['records']]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_sidecar(self, path, sha, context_digest, records):
+        target = self.sidecar_path(path)
+        tmp = f'{target}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as fh:
+                json.dump({'sha256': sha, 'context': context_digest,
+                           'records': [list(r) for r in records]}, fh, ensure_ascii=False)
+            os.replace(tmp, target)
+        except OSError:
+            # Read-only or full disk: the in-memory layer still works
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _forget(self, path: str):
+        apath = os.path.abspath(path)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == apath]:
+                del self._entries[key]
+
+    def discard(self, path: str):
+        """Drop cached results for an upload that is being deleted."""
+        self._forget(path)
+        try:
+            os.remove(self.sidecar_path(path))
+        except OSError:
+            pass
+
+    def move(self, src: str, dst: str):
+        """Carry the sidecar along when an upload is renamed or moved."""
+        self._forget(src)
+        try:
+            os.replace(self.sidecar_path(src), self.sidecar_path(dst))
+        except OSError:
+            pass
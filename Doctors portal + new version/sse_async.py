@@ -0,0 +1,193 @@
+"""
+Asyncio Server-Sent Events endpoint running beside the WSGI app.
+
+Under waitress every open /events stream pins one of the worker threads, so a
+handful of lobby displays can starve the pool. AsyncSSEServer serves the same
+stream from a single asyncio thread instead: EventBroker publications are
+handed to its loop with call_soon_threadsafe and fanned out to small
+per-client queues, so an idle display costs one socket and one queue.
+Stdlib only (no ASGI server dependency).
+
+Supports the same ?date= / ?topics= filters and Last-Event-ID resume as the
+Flask stream (see event_broker.py).
+
+Enable with ASYNC_SSE_PORT=<port>; Flask's /events then redirects (307) there.
+"""
+
+import asyncio
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+from event_broker import EventFilter, RESYNC_EVENT, format_sse, parse_last_event_id
+
+
+class AsyncSSEServer:
+    """Minimal HTTP/1.1 server answering GET /events with text/event-stream."""
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 5001, heartbeat: int = 15,
+                 queue_size: int = 200, allow_origin: str = '*', broker=None):
+        self.broker = broker  # EventBroker, for Last-Event-ID replay
+        self.host = host
+        self.port = port
+        self.heartbeat = heartbeat
+        self.queue_size = queue_size
+        self.allow_origin = allow_origin
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._clients = {}  # asyncio.Queue -> EventFilter per connected stream
+
+    @property
+    def client_count(self) -> int:
+        return len(self._clients)
+
+    def start(self, timeout: float = 5.0):
+        """Start the event loop thread (idempotent); returns once the socket is bound."""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name='sse-async', daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout)
+        return self
+
+    def stop(self):
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+
+    def publish(self, record):
+        """Thread-safe EventBroker listener: queue one event record for every matching client."""
+        loop = self._loop
+        if loop is None or not self._clients:
+            return
+        try:
+            loop.call_soon_threadsafe(self._fanout, record)
+        except RuntimeError:
+            pass  # loop closed
+
+    def _fanout(self, record):
+        frame = None
+        for q, event_filter in list(self._clients.items()):
+            if not event_filter.matches(record):
+                continue
+            if frame is None:
+                frame = (record[0], format_sse(record).encode('utf-8'))
+            if q.full():
+                # Same policy as the WSGI streams' deque(maxlen): drop the oldest
+                try:
+                    q.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+            q.put_nowait(frame)
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        try:
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, backlog=2048))
+            if not self.port:
+                self.port = self._server.sockets[0].getsockname()[1]
+        except Exception as e:
+            print(f"[sse-async] failed to bind {self.host}:{self.port}: {e}")
+            self._loop = None
+            self._ready.set()
+            return
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            self._server.close()
+            self._loop = None
+            loop.close()
+
+    def _cors_headers(self) -> str:
+        return (f"Access-Control-Allow-Origin: {self.allow_origin}\r\n"
+                "Access-Control-Allow-Headers: Last-Event-ID, Cache-Control\r\n")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 10)
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+                k, _, v = line.decode('latin-1').partition(':')
+                headers[k.strip().lower()] = v.strip()
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2:
+                return
+            method, target = parts[0].upper(), parts[1]
+            path = urlsplit(target).path
+            if method == 'OPTIONS':
+                writer.write(("HTTP/1.1 204 No Content\r\n" + self._cors_headers() +
+                              "Access-Control-Allow-Methods: GET, OPTIONS\r\nContent-Length: 0\r\n\r\n").encode())
+                await writer.drain()
+                return
+            if method != 'GET' or path.rstrip('/') != '/events':
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                await writer.drain()
+                return
+            await self._stream(reader, writer, target, headers)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    async def _stream(self, reader, writer, target: str, headers: dict):
+        query = parse_qs(urlsplit(target).query)
+        event_filter = EventFilter.from_args(query)
+        last_id = parse_last_event_id(headers.get('last-event-id') or (query.get('lastEventId') or [None])[0])
+        writer.write(("HTTP/1.1 200 OK\r\n"
+                      "Content-Type: text/event-stream\r\n"
+                      "Cache-Control: no-cache\r\n"
+                      "Connection: keep-alive\r\n"
+                      "X-Accel-Buffering: no\r\n" + self._cors_headers() + "\r\n").encode())
+        writer.write(b"retry: 3000\n\n")
+        q = asyncio.Queue(maxsize=self.queue_size)
+        self._clients[q] = event_filter
+        sent_upto = last_id
+        if last_id is not None and self.broker is not None:
+            missed, complete = self.broker.replay(last_id, event_filter)
+            if not complete:
+                # Too far behind (or ids from a previous run): client must refetch
+                sent_upto = self.broker.last_id
+                writer.write(format_sse((sent_upto, RESYNC_EVENT, '{}', None)).encode())
+                missed = []
+            for rec in missed:
+                writer.write(format_sse(rec).encode('utf-8'))
+                sent_upto = rec[0]
+        await writer.drain()
+        # The client never sends anything after the request; EOF means it went away
+        eof = asyncio.ensure_future(reader.read(1))
+        try:
+            while True:
+                get = asyncio.ensure_future(q.get())
+                done, _ = await asyncio.wait({get, eof}, timeout=self.heartbeat,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if eof in done:
+                    get.cancel()
+                    return
+                if get in done:
+                    frames = [get.result()]
+                    while not q.empty():
+                        frames.append(q.get_nowait())
+                    for event_id, frame in frames:
+                        if sent_upto is not None and event_id <= sent_upto:
+                            continue  # already sent from the replay buffer
+                        writer.write(frame)
+                else:
+                    get.cancel()
+                    writer.write(f": ping {int(time.time())}\n\n".encode())
+                await writer.drain()
+        finally:
+            self._clients.pop(q, None)
+            eof.cancel()
@@ -1454,7 +1454,7 @@ async function loadScheduleWindow(){
   try{
     const start = new Date().toISOString().slice(0,10);
     const days = 14;
-    const win = await fetch(`/api/window?start=${start}&days=${days}`, {cache:'no-store'}).then(r=>r.json());
+    const win = await fetch(`/api/window?start=${start}&days=${days}`, {cache:'no-cache'}).then(r=>r.json());
     const windowArr = win.window || win;
     // Fetch closures to annotate
     let closures = {};
@@ -1522,7 +1522,7 @@ let pollTimer = null;
 function startPolling(){
   if(pollTimer) return;
   pollTimer = setInterval(()=>{
-    fetch('/api/doctors', {cache:'no-store'}).then(r=>r.json()).then(r=>{ cache=r; renderList(); ensureFilterOptions(); }).catch(()=>{});
+    fetch('/api/doctors', {cache:'no-cache'}).then(r=>r.json()).then(r=>{ cache=r; renderList(); ensureFilterOptions(); }).catch(()=>{});
   }, 5000);
 }
 // ======= Bulk clear/set status tools =======
@@ -1866,10 +1866,10 @@ async function loadScheduleEditor(){
   try{
     const dateIso = schedDateInput?.value || isoToday();
     // Base doctor master list
-    const base = await fetch('/api/doctors',{cache:'no-store'}).then(r=>r.json());
+    const base = await fetch('/api/doctors',{cache:'no-cache'}).then(r=>r.json());
     // Per-day schedule (may include only subset / changed fields)
     let dayData = null;
-    try { dayData = await fetch('/api/day?date='+encodeURIComponent(dateIso), {cache:'no-store'}).then(r=>r.json()); } catch { dayData = null; }
+    try { dayData = await fetch('/api/day?date='+encodeURIComponent(dateIso), {cache:'no-cache'}).then(r=>r.json()); } catch { dayData = null; }
     const dayIndex = new Map();
     if(dayData && Array.isArray(dayData.doctors)){
       dayData.doctors.forEach(doc=>{ dayIndex.set(String(doc.id), doc); });
@@ -2026,7 +2026,7 @@ async function showClearDateConfirmation(){
     clearDatePreview.innerHTML = '<div style="text-align:center;padding:20px;color:var(--muted)">Loading schedules...</div>';
     clearDateModal.style.display = 'flex';
     
-    const dayData = await fetch(`/api/day?date=${encodeURIComponent(dateIso)}`, {cache:'no-store'}).then(r=>r.json());
+    const dayData = await fetch(`/api/day?date=${encodeURIComponent(dateIso)}`, {cache:'no-cache'}).then(r=>r.json());
     
     if(!dayData || !dayData.doctors || dayData.doctors.length === 0){
       clearDatePreview.innerHTML = `
@@ -388,30 +388,60 @@ function ensurePolling(){
     syncCurrentDay();
   }, 8000); // slower safety net; SSE drives fast updates
 }
+// Version of the viewed day's data we hold (from /api/day); doctor_update deltas apply only on top of it
+let dayVersion = null;
+let dayVersionDate = null;
+function rememberDayVersion(d){
+  if(d && d.date && d.version != null){ dayVersion = d.version; dayVersionDate = d.date; }
+}
 function syncCurrentDay(){
   const viewedIso = (windowData && windowData[currentDayOffset] && windowData[currentDayOffset].date) || todayIso;
   const url = '/api/day?date='+encodeURIComponent(viewedIso);
-  fetch(url, {cache:'no-store'}).then(r=>r.json()).then(d=>{ if(d && (d.doctors||d.doctors===0)) updateCards(d); }).catch(()=>{});
+  fetch(url, {cache:'no-cache'}).then(r=>r.json()).then(d=>{ if(d && (d.doctors||d.doctors===0)){ rememberDayVersion(d); updateCards(d); } }).catch(()=>{});
 }
 let es = null;
 let esRetryDelay = 1000;
+let esLastId = null; // resume point sent back on reconnect so the server replays missed events
+let esDate = null;   // day the stream is filtered to (reconnects when the viewed day changes)
+const SSE_TOPICS = 'doctor_update,closure_update,branding_updated,specialty_order_updated,schedule_cleared';
+function sseViewedDate(){
+  // windowData/todayIso are declared further down; guard the first call
+  try { return (windowData && windowData[currentDayOffset] && windowData[currentDayOffset].date) || todayIso; } catch { return null; }
+}
+function restartSSE(){
+  try{ if(es) es.close(); }catch{}
+  es = null;
+  startSSE();
+}
 function startSSE(){
   try{
-    es = new EventSource('/events');
+    esDate = sseViewedDate();
+    const qs = new URLSearchParams({topics: SSE_TOPICS});
+    if(esDate) qs.set('date', esDate);
+    if(esLastId) qs.set('lastEventId', esLastId);
+    es = new EventSource('/events?' + qs.toString());
     esRetryDelay = 1000; // reset on successful open
     ensurePolling();
+    SSE_TOPICS.split(',').concat(['resync']).forEach(t => es.addEventListener(t, e => { if(e.lastEventId) esLastId = e.lastEventId; }));
+    // Server could not replay everything we missed: reload the whole window
+    es.addEventListener('resync', ()=>{ closuresCache = null; loadWindowData(todayIso); });
   es.onopen = ()=>{ /* connection established */ };
     es.addEventListener('doctor_update', e => { try {
       const payload = JSON.parse(e.data);
   const viewedIso = (windowData && windowData[currentDayOffset] && windowData[currentDayOffset].date) || todayIso;
       if(payload.date && payload.date !== viewedIso){ return; }
-      // If doctor data included, patch it directly for instant UI update
-      if(payload.doctor && payload.doctor.id && windowData){
-        updateCards({doctors:[payload.doctor]});
+      const rows = payload.doctors || (payload.doctor && payload.doctor.id ? [payload.doctor] : null);
+      const haveVersion = dayVersion != null && dayVersionDate === viewedIso && payload.version != null;
+      // Already included in the snapshot we hold
+      if(haveVersion && payload.version <= dayVersion){ return; }
+      // Delta directly follows our version: patch the cards, no round trip
+      if(rows && windowData && haveVersion && payload.prev_version === dayVersion){
+        updateCards({doctors: rows});
+        dayVersion = payload.version;
+        return;
       }
-  // Then fetch the exact day to keep consistency
-  const url = '/api/day?date='+encodeURIComponent(viewedIso);
-      fetch(url, {cache:'no-store'}).then(r=>r.json()).then(d=>{ if(d && d.doctors) updateCards(d); }).catch(()=>{});
+      // Missed something (or no delta in the event): fetch the exact day to keep consistency
+      syncCurrentDay();
     } catch {} });
   es.addEventListener('closure_update', ()=>{ 
     console.log('[SSE] Closure update received, reloading closures...');
@@ -507,8 +537,8 @@ async function loadWindowData(startOverride){
   try{
     const dayIso = windowData[currentDayOffset]?.date;
     if(dayIso){
-      const d = await fetch('/api/day?date='+encodeURIComponent(dayIso), {cache:'no-store'}).then(r=>r.json());
-      if(d && d.doctors) updateCards(d);
+      const d = await fetch('/api/day?date='+encodeURIComponent(dayIso), {cache:'no-cache'}).then(r=>r.json());
+      if(d && d.doctors){ rememberDayVersion(d); updateCards(d); }
     }
   }catch{}
   setNavDisabled();
@@ -612,6 +642,7 @@ function updateDisplayForDay(offset){
   if(offset < 0 || offset >= windowData.length) return;
   currentDayOffset = offset;
   const day = windowData[offset];
+  if(es && esDate !== day.date) restartSSE(); // stream is filtered to the viewed day
   const dateDisp = document.getElementById('dateDisplay');
   if(dateDisp) dateDisp.textContent = formatDisplayDate(day.date);
   
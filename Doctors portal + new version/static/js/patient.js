@@ -196,11 +196,11 @@
   async function load(){
     try{
       // Base doctor list
-      const base = await fetch('/api/doctors',{cache:'no-store'}).then(r=>r.json());
+      const base = await fetch('/api/doctors',{cache:'no-cache'}).then(r=>r.json());
       // Per-date overrides
       let perDate = { doctors: [] };
       try{
-        perDate = await fetch(`/api/day?date=${todayISO()}`, {cache:'no-store'}).then(r=> r.ok ? r.json() : {doctors:[]});
+        perDate = await fetch(`/api/day?date=${todayISO()}`, {cache:'no-cache'}).then(r=> r.ok ? r.json() : {doctors:[]});
       }catch(_){ /* ignore */ }
       // Build a map of base doctors
       const baseMap = new Map();
@@ -243,8 +243,9 @@
 
   // Live updates via SSE
   try{
-    const es = new EventSource('/events');
+    const es = new EventSource('/events?topics=doctor_update,specialty_order_updated,closure_update,patient_display_settings');
     es.addEventListener('doctor_update', ()=> setTimeout(load, 200));
+    es.addEventListener('resync', ()=> load());
     es.addEventListener('specialty_order_updated', ()=> load());
     es.addEventListener('closure_update', ()=> load());
     es.addEventListener('patient_display_settings', (ev)=>{
@@ -0,0 +1,751 @@
+"""
+Storage backends for the doctor schedule data.
+
+app.load_data()/save_data() keep their plain-dict contract
+({'doctors': [...], 'specialty_order': [...], ...}); the backend decides how
+that dict is persisted:
+
+  - JsonStore:   the original single data/doctors.json document (default)
+  - JournalStore: doctors.json snapshot plus an append-only doctors.journal of
+                 row changes, folded back into the snapshot by a compactor
+  - SqliteStore: SQLite in WAL mode with tables for doctors, per-date schedule
+                 entries, specialties and closures
+
+Besides the full load()/save() pair every backend exposes row-level writes
+(upsert_schedule_entries / upsert_doctor) for the hot edit paths, so changing
+one doctor's day does not have to rewrite the whole schedule history;
+upsert_doctor(..., dates=...) writes base fields and day rows as one change.
+
+Select the backend with STORAGE_BACKEND=json|journal|sqlite (SQLITE_PATH overrides the
+database location). With MULTI_WORKER=1 (several server processes sharing the
+data directory) the backend is wrapped in MultiWorkerStore: writes run under an
+advisory file lock and bump a shared version counter file that also serves as
+the change signature. One-shot import of an existing JSON file:
+
+  python storage.py import [data/doctors.json] [data/schedule.db] [data/closure.json]
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+import json_codec
+from json_repository import JsonRepository
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+
+def _empty_data():
+    return {'doctors': []}
+
+
+def _doctor_key(doc) -> str:
+    return str(doc.get('id'))
+
+
+def _doctor_body(doc: dict) -> dict:
+    """Doctor record without the (separately stored) schedule history."""
+    return {k: v for k, v in doc.items() if k != 'schedule_by_date'}
+
+
+class ProcessLock:
+    """Exclusive advisory lock on a file, shared by every worker process.
+
+    fcntl.flock on POSIX, msvcrt.locking on Windows. Re-entrant within a
+    process: threads first serialize on an RLock and only the outermost
+    acquire takes the file lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fh = None
+
+    def acquire(self):
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                fh = open(self.path, 'a+b')
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+                    elif msvcrt is not None:
+                        fh.seek(0)
+                        while True:
+                            try:
+                                msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                                break
+                            except OSError:  # LK_LOCK gives up after ~10s; keep waiting
+                                time.sleep(0.05)
+                except Exception:
+                    fh.close()
+                    raise
+            except Exception:
+                self._rlock.release()
+                raise
+            self._fh = fh
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            fh, self._fh = self._fh, None
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+                elif msvcrt is not None:
+                    fh.seek(0)
+                    msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+            finally:
+                fh.close()
+        self._rlock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class VersionFile:
+    """Monotonic change counter shared by all workers: one integer in a small file."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def read(self) -> int:
+        try:
+            with open(self.path, 'r', encoding='ascii') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def bump(self) -> int:
+        """Increment and return the counter; the caller holds the ProcessLock."""
+        value = self.read() + 1
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='ascii') as f:
+            f.write(str(value))
+        for attempt in range(5):
+            try:
+                os.replace(tmp_path, self.path)
+                break
+            except PermissionError:  # Windows: a reader has the file open
+                if attempt == 4:
+                    raise
+                time.sleep(0.01)
+        return value
+
+
+class JsonStore:
+    """Single JSON document (the historic data/doctors.json layout)."""
+
+    name = 'json'
+
+    def __init__(self, data_path: str, closure_path: str):
+        self.data_path = data_path
+        self.closure_path = closure_path
+        self._closures = JsonRepository(closure_path, validate=lambda d: d if isinstance(d, dict) else {})
+
+    def signature(self):
+        """Cheap change token; load_data() reloads when it differs."""
+        try:
+            return os.stat(self.data_path).st_mtime
+        except OSError:
+            return None
+
+    def load(self) -> dict:
+        if not os.path.exists(self.data_path):
+            return _empty_data()
+        with open(self.data_path, 'rb') as f:
+            return json_codec.loads(f.read())
+
+    def save(self, data: dict):
+        os.makedirs(os.path.dirname(self.data_path) or '.', exist_ok=True)
+        tmp_path = self.data_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(json_codec.dumps(data, pretty=json_codec.PRETTY_ON_DISK))
+        os.replace(tmp_path, self.data_path)
+
+    # Row-level API: a single document has no rows, so fall back to a full write.
+    def upsert_schedule_entries(self, data: dict, changes, actor=None):
+        self.save(data)
+
+    def upsert_doctor(self, data: dict, doc: dict, actor=None, dates=()):
+        self.save(data)
+
+    def load_closures(self) -> dict:
+        return self._closures.load()
+
+    def save_closures(self, data: dict):
+        self._closures.save(data)
+
+    def close(self):
+        pass
+
+
+class JournalStore(JsonStore):
+    """doctors.json snapshot plus an append-only journal of row-level changes.
+
+    Each upsert appends one JSON line to the journal
+    ({ts, op, doctor_id, date, entry|doctor, actor}); load() replays the
+    journal on top of the snapshot. compact() folds the journal into a fresh
+    snapshot, and start_compactor() runs it in the background once the journal
+    passes max_bytes or its oldest change is older than max_age seconds.
+    """
+
+    name = 'journal'
+
+    def __init__(self, data_path: str, closure_path: str, journal_path: str = None,
+                 max_bytes: int = 1024 * 1024, max_age: int = 3600, compact_lock=None):
+        super().__init__(data_path, closure_path)
+        self.journal_path = journal_path or (os.path.splitext(data_path)[0] + '.journal')
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        # ProcessLock in multi-worker mode, so compaction can't drop another worker's appends
+        self._compact_lock = compact_lock
+        self._compactor = None
+
+    def signature(self):
+        with self._lock:
+            snap = super().signature()
+            try:
+                size = os.path.getsize(self.journal_path)
+            except OSError:
+                size = 0
+            return (snap, size)
+
+    def _replay(self, data: dict, lines):
+        by_key = {_doctor_key(d): d for d in data.get('doctors', [])}
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json_codec.loads(line)
+            except Exception:
+                continue  # torn tail after a crash: ignore the partial line
+            key = str(rec.get('doctor_id'))
+            op = rec.get('op')
+            if op == 'doctor':
+                body = rec.get('doctor') or {}
+                doc = by_key.get(key)
+                if doc is None:
+                    doc = dict(body, schedule_by_date={})
+                    data.setdefault('doctors', []).append(doc)
+                    by_key[key] = doc
+                else:
+                    sched = doc.get('schedule_by_date')
+                    doc.clear()
+                    doc.update(body)
+                    doc['schedule_by_date'] = sched if isinstance(sched, dict) else {}
+            elif op == 'day':
+                doc = by_key.get(key)
+                if doc is None:
+                    continue
+                sched = doc.setdefault('schedule_by_date', {})
+                entry = rec.get('entry')
+                if entry:
+                    sched[rec.get('date')] = entry
+                else:
+                    sched.pop(rec.get('date'), None)
+        return data
+
+    def load(self) -> dict:
+        with self._lock:
+            # Journal before snapshot: if another process compacts in between, the
+            # new snapshot already holds these lines and replaying them is a no-op
+            try:
+                with open(self.journal_path, 'r', encoding='utf-8') as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                lines = []
+            data = super().load()
+            if not lines:
+                return data
+            if not isinstance(data, dict):
+                data = _empty_data()
+            data.setdefault('doctors', [])
+            return self._replay(data, lines)
+
+    def _append(self, records):
+        os.makedirs(os.path.dirname(self.journal_path) or '.', exist_ok=True)
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            for rec in records:
+                f.write(json_codec.dumps_str(rec) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save(self, data: dict):
+        # A full snapshot already contains every journalled change
+        with self._lock:
+            super().save(data)
+            self._truncate_journal()
+
+    def _truncate_journal(self):
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _day_records(changes, ts, actor):
+        records = []
+        for doc, date_iso in changes:
+            entry = (doc.get('schedule_by_date') or {}).get(date_iso)
+            records.append({'ts': ts, 'op': 'day', 'doctor_id': doc.get('id'), 'date': date_iso,
+                            'entry': entry or None, 'actor': actor})
+        return records
+
+    def upsert_schedule_entries(self, data: dict, changes, actor=None):
+        records = self._day_records(changes, datetime.utcnow().isoformat() + 'Z', actor)
+        if records:
+            with self._lock:
+                self._append(records)
+
+    def upsert_doctor(self, data: dict, doc: dict, actor=None, dates=()):
+        ts = datetime.utcnow().isoformat() + 'Z'
+        rec = {'ts': ts, 'op': 'doctor', 'doctor_id': doc.get('id'),
+               'doctor': _doctor_body(doc), 'actor': actor}
+        with self._lock:
+            self._append([rec] + self._day_records([(doc, d) for d in dates], ts, actor))
+
+    def needs_compaction(self) -> bool:
+        try:
+            st = os.stat(self.journal_path)
+        except OSError:
+            return False
+        if st.st_size == 0:
+            return False
+        if st.st_size >= self.max_bytes:
+            return True
+        # Age of the oldest pending change = time since the snapshot was last written
+        snap = super().signature() or st.st_mtime
+        return (time.time() - snap) >= self.max_age
+
+    def compact(self) -> bool:
+        """Fold the journal into a new snapshot. Returns True when work was done."""
+        if self._compact_lock is not None:
+            with self._compact_lock:
+                return self._compact()
+        return self._compact()
+
+    def _compact(self) -> bool:
+        with self._lock:
+            if not os.path.exists(self.journal_path):
+                return False
+            data = self.load()
+            JsonStore.save(self, data)
+            self._truncate_journal()
+            return True
+
+    def start_compactor(self, interval: int = 30):
+        """Start the background compaction thread (idempotent)."""
+        if self._compactor and self._compactor.is_alive():
+            return
+
+        def _loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    if self.needs_compaction():
+                        self.compact()
+                except Exception as e:
+                    print(f"[storage] journal compaction failed: {e}")
+
+        self._compactor = threading.Thread(target=_loop, name='journal-compactor', daemon=True)
+        self._compactor.start()
+
+
+class SqliteStore:
+    """SQLite (WAL) backend: one row per doctor and per (doctor, date) entry.
+
+    Every write transaction bumps meta.version, which doubles as the change
+    signature for load_data()'s cache (also across processes).
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+        "CREATE TABLE IF NOT EXISTS doctors ("
+        " id TEXT PRIMARY KEY, position INTEGER NOT NULL, body TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS schedule_entries ("
+        " doctor_id TEXT NOT NULL, date TEXT NOT NULL, body TEXT NOT NULL,"
+        " PRIMARY KEY (doctor_id, date))",
+        "CREATE INDEX IF NOT EXISTS idx_schedule_entries_date ON schedule_entries(date)",
+        "CREATE TABLE IF NOT EXISTS specialties ("
+        " name TEXT PRIMARY KEY, position INTEGER, designation TEXT)",
+        "CREATE TABLE IF NOT EXISTS closures (date TEXT PRIMARY KEY, reasons TEXT NOT NULL)",
+    )
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        conn = self._conn()
+        with conn:
+            for stmt in self.SCHEMA:
+                conn.execute(stmt)
+            conn.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('version', '0')")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections must stay on the thread that created them
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=OFF')
+            self._local.conn = conn
+        return conn
+
+    def _begin(self, conn):
+        conn.execute('BEGIN IMMEDIATE')
+
+    def _bump_version(self, conn):
+        conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+
+    def signature(self):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def load(self) -> dict:
+        conn = self._conn()
+        # One read transaction, so a concurrent writer can't be seen half applied
+        conn.execute('BEGIN')
+        try:
+            return self._load(conn)
+        finally:
+            conn.execute('COMMIT')
+
+    def _load(self, conn) -> dict:
+        data = {}
+        row = conn.execute("SELECT value FROM meta WHERE key = 'extra'").fetchone()
+        if row and row[0]:
+            try:
+                data.update(json_codec.loads(row[0]))
+            except Exception:
+                pass
+        order = []
+        designations = {}
+        has_designations = False
+        for name, position, designation in conn.execute(
+                "SELECT name, position, designation FROM specialties ORDER BY position IS NULL, position, name"):
+            if position is not None:
+                order.append(name)
+            if designation is not None:
+                designations[name] = designation
+                has_designations = True
+        flags = conn.execute("SELECT value FROM meta WHERE key = 'specialty_keys'").fetchone()
+        present = set(json_codec.loads(flags[0])) if flags and flags[0] else set()
+        if order or 'specialty_order' in present:
+            data['specialty_order'] = order
+        if has_designations or 'specialty_designations' in present:
+            data['specialty_designations'] = designations
+
+        doctors = []
+        by_key = {}
+        for key, body in conn.execute("SELECT id, body FROM doctors ORDER BY position"):
+            doc = json_codec.loads(body)
+            doc['schedule_by_date'] = {}
+            by_key[key] = doc
+            doctors.append(doc)
+        for doctor_id, date_iso, body in conn.execute(
+                "SELECT doctor_id, date, body FROM schedule_entries ORDER BY doctor_id, date"):
+            doc = by_key.get(doctor_id)
+            if doc is not None:
+                doc['schedule_by_date'][date_iso] = json_codec.loads(body)
+        data['doctors'] = doctors
+        return data
+
+    def save(self, data: dict):
+        conn = self._conn()
+        self._begin(conn)
+        try:
+            conn.execute("DELETE FROM doctors")
+            conn.execute("DELETE FROM schedule_entries")
+            conn.execute("DELETE FROM specialties")
+            for pos, doc in enumerate(data.get('doctors', [])):
+                key = _doctor_key(doc)
+                conn.execute("INSERT OR REPLACE INTO doctors(id, position, body) VALUES (?, ?, ?)",
+                             (key, pos, json_codec.dumps_str(_doctor_body(doc))))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO schedule_entries(doctor_id, date, body) VALUES (?, ?, ?)",
+                    [(key, d, json_codec.dumps_str(e))
+                     for d, e in (doc.get('schedule_by_date') or {}).items() if isinstance(e, dict)])
+            order = data.get('specialty_order') or []
+            designations = data.get('specialty_designations') or {}
+            for pos, name in enumerate(order):
+                conn.execute("INSERT OR REPLACE INTO specialties(name, position, designation) VALUES (?, ?, ?)",
+                             (name, pos, designations.get(name)))
+            for name, designation in designations.items():
+                if name not in order:
+                    conn.execute("INSERT OR REPLACE INTO specialties(name, position, designation) VALUES (?, NULL, ?)",
+                                 (name, designation))
+            present = [k for k in ('specialty_order', 'specialty_designations') if k in data]
+            extra = {k: v for k, v in data.items()
+                     if k not in ('doctors', 'specialty_order', 'specialty_designations')}
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('extra', ?)",
+                         (json_codec.dumps_str(extra),))
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('specialty_keys', ?)",
+                         (json.dumps(present),))
+            self._bump_version(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _write_entries(conn, changes):
+        for doc, date_iso in changes:
+            key = _doctor_key(doc)
+            entry = (doc.get('schedule_by_date') or {}).get(date_iso)
+            if entry:
+                conn.execute("INSERT OR REPLACE INTO schedule_entries(doctor_id, date, body) VALUES (?, ?, ?)",
+                             (key, date_iso, json_codec.dumps_str(entry)))
+            else:
+                conn.execute("DELETE FROM schedule_entries WHERE doctor_id = ? AND date = ?", (key, date_iso))
+
+    def upsert_schedule_entries(self, data: dict, changes, actor=None):
+        """Write only the given (doctor, date_iso) rows; a missing entry deletes the row."""
+        conn = self._conn()
+        self._begin(conn)
+        try:
+            self._write_entries(conn, changes)
+            self._bump_version(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def upsert_doctor(self, data: dict, doc: dict, actor=None, dates=()):
+        """Write one doctor's base fields (not the schedule history), plus its rows
+        for `dates` in the same transaction."""
+        conn = self._conn()
+        key = _doctor_key(doc)
+        try:
+            position = next(i for i, d in enumerate(data.get('doctors', [])) if d is doc)
+        except StopIteration:
+            position = len(data.get('doctors', []))
+        self._begin(conn)
+        try:
+            conn.execute("INSERT OR REPLACE INTO doctors(id, position, body) VALUES (?, ?, ?)",
+                         (key, position, json_codec.dumps_str(_doctor_body(doc))))
+            self._write_entries(conn, [(doc, d) for d in dates])
+            self._bump_version(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def load_closures(self) -> dict:
+        out = {}
+        for date_iso, reasons in self._conn().execute("SELECT date, reasons FROM closures ORDER BY date"):
+            try:
+                out[date_iso] = json_codec.loads(reasons)
+            except Exception:
+                out[date_iso] = reasons
+        return out
+
+    def save_closures(self, data: dict):
+        conn = self._conn()
+        self._begin(conn)
+        try:
+            conn.execute("DELETE FROM closures")
+            conn.executemany("INSERT INTO closures(date, reasons) VALUES (?, ?)",
+                             [(k, json_codec.dumps_str(v)) for k, v in (data or {}).items()])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class MultiWorkerStore:
+    """A backend shared by several worker processes (MULTI_WORKER=1).
+
+    Every write runs under a ProcessLock and bumps a VersionFile; the counter
+    is part of signature(), so load_data() sees each write from any worker
+    instead of relying on mtime resolution. app.py holds the same lock from
+    load to save in the handlers that save() the whole document. If a row-level
+    write finds that another worker saved since this process last loaded, it
+    first folds the on-disk state into the in-memory dict (keeping the rows
+    being written) and returns True. A full save() is last-writer-wins.
+
+    Reads take no lock: each backend's load() is consistent on its own.
+    """
+
+    def __init__(self, inner, lock: ProcessLock, counter: VersionFile):
+        self.inner = inner
+        self.name = inner.name
+        self.lock = lock
+        self.counter = counter
+        self.version = None  # counter value of the state held in memory
+
+    def signature(self):
+        return (self.counter.read(), self.inner.signature())
+
+    def load(self) -> dict:
+        # Counter first: a write landing during the load only causes one extra reload
+        self.version = self.counter.read()
+        return self.inner.load()
+
+    def save(self, data: dict):
+        with self.lock:
+            self.inner.save(data)
+            self.version = self.counter.bump()
+
+    def upsert_schedule_entries(self, data: dict, changes, actor=None) -> bool:
+        changes = list(changes)
+        with self.lock:
+            merged = self._catch_up(data, entries=changes)
+            self.inner.upsert_schedule_entries(data, changes, actor=actor)
+            self.version = self.counter.bump()
+        return merged
+
+    def upsert_doctor(self, data: dict, doc: dict, actor=None, dates=()) -> bool:
+        dates = list(dates)
+        with self.lock:
+            merged = self._catch_up(data, entries=[(doc, d) for d in dates], doctor=doc)
+            self.inner.upsert_doctor(data, doc, actor=actor, dates=dates)
+            self.version = self.counter.bump()
+        return merged
+
+    def _catch_up(self, data: dict, entries=(), doctor=None) -> bool:
+        """Fold changes other workers saved into `data` in place (caller holds the lock).
+
+        Doctor dicts keep their identity so callers' references stay valid; the
+        schedule rows in `entries` and the base fields of `doctor` are the ones
+        about to be written and win over the disk copy.
+        """
+        if self.version is not None and self.counter.read() == self.version:
+            return False
+        fresh = self.inner.load()
+        if not isinstance(fresh, dict):
+            fresh = _empty_data()
+        keep = [(doc, d, (doc.get('schedule_by_date') or {}).get(d)) for doc, d in entries]
+        keep_key = _doctor_key(doctor) if doctor is not None else None
+        mine = {_doctor_key(d): d for d in data.get('doctors', [])}
+        doctors = []
+        for f in fresh.get('doctors', []):
+            key = _doctor_key(f)
+            d = mine.get(key)
+            if d is None:
+                doctors.append(f)
+                continue
+            if key == keep_key:
+                d['schedule_by_date'] = f.get('schedule_by_date') or {}
+            else:
+                d.clear()
+                d.update(f)
+            doctors.append(d)
+        if keep_key is not None and all(_doctor_key(d) != keep_key for d in doctors):
+            doctors.append(doctor)
+        by_key = {_doctor_key(d): d for d in doctors}
+        for doc, date_iso, entry in keep:
+            target = by_key.get(_doctor_key(doc))
+            if target is None:
+                continue  # deleted on another worker
+            if not isinstance(target.get('schedule_by_date'), dict):
+                target['schedule_by_date'] = {}
+            if entry:
+                target['schedule_by_date'][date_iso] = entry
+            else:
+                target['schedule_by_date'].pop(date_iso, None)
+        data.clear()
+        data.update((k, v) for k, v in fresh.items() if k != 'doctors')
+        data['doctors'] = doctors
+        return True
+
+    def load_closures(self) -> dict:
+        return self.inner.load_closures()
+
+    def save_closures(self, data: dict):
+        with self.lock:
+            self.inner.save_closures(data)
+
+    def start_compactor(self, interval: int = 30):
+        if hasattr(self.inner, 'start_compactor'):
+            self.inner.start_compactor(interval)
+
+    def close(self):
+        self.inner.close()
+
+
+def open_store(backend: str, data_path: str, closure_path: str, sqlite_path: str,
+               journal_path: str = None, journal_max_bytes: int = 1024 * 1024, journal_max_age: int = 3600,
+               multi_worker: bool = False, lock_path: str = None, version_path: str = None):
+    """Return the storage backend named by STORAGE_BACKEND (defaults to JSON),
+    wrapped in MultiWorkerStore when several processes share the data."""
+    backend = (backend or 'json').strip().lower()
+    lock = None
+    if multi_worker:
+        base = os.path.splitext(data_path)[0]
+        lock = ProcessLock(lock_path or base + '.lock')
+    if backend == 'sqlite':
+        store = SqliteStore(sqlite_path)
+    elif backend == 'journal':
+        store = JournalStore(data_path, closure_path, journal_path,
+                             max_bytes=journal_max_bytes, max_age=journal_max_age, compact_lock=lock)
+    else:
+        store = JsonStore(data_path, closure_path)
+    if multi_worker:
+        store = MultiWorkerStore(store, lock, VersionFile(version_path or base + '.version'))
+    return store
+
+
+def import_json(json_path: str, db_path: str, closure_path: str = None) -> dict:
+    """One-shot import of doctors.json (and closure.json) into a SQLite store."""
+    src = JsonStore(json_path, closure_path or '')
+    data = src.load()
+    if not isinstance(data, dict):
+        data = _empty_data()
+    data.setdefault('doctors', [])
+    dst = SqliteStore(db_path)
+    dst.save(data)
+    closures = src.load_closures() if closure_path else {}
+    if closures:
+        dst.save_closures(closures)
+    stats = {
+        'doctors': len(data['doctors']),
+        'schedule_entries': sum(len(d.get('schedule_by_date') or {}) for d in data['doctors']),
+        'specialties': len(set(data.get('specialty_order') or []) | set(data.get('specialty_designations') or {})),
+        'closures': len(closures),
+    }
+    dst.close()
+    return stats
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args or args[0] != 'import':
+        print(__doc__)
+        sys.exit(1)
+    json_path = args[1] if len(args) > 1 else os.path.join('data', 'doctors.json')
+    db_path = args[2] if len(args) > 2 else os.path.join('data', 'schedule.db')
+    closure_path = args[3] if len(args) > 3 else os.path.join('data', 'closure.json')
+    result = import_json(json_path, db_path, closure_path)
+    print(f"Imported {result['doctors']} doctors, {result['schedule_entries']} schedule entries, "
+          f"{result['specialties']} specialties and {result['closures']} closures into {db_path}")
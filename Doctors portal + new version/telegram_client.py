@@ -0,0 +1,208 @@
+"""
+Keep-alive Telegram Bot API transport.
+
+The bot used urllib's urlopen for every call, so each getUpdates long poll
+and each reply paid a fresh TCP + TLS handshake, and replies were sent inline
+in the poll thread (a slow sendMessage delayed the next getUpdates).
+
+TelegramClient keeps one persistent HTTP/1.1 connection for polling and one
+for the sender thread. Outbound messages go through a queue drained by that
+thread, paced to Telegram's limits (about 30 messages/s overall and one per
+second per chat) and retried after a 429's retry_after. A stale keep-alive
+connection is reopened and the call retried once.
+
+base_url defaults to https://api.telegram.org; point it (TELEGRAM_API_BASE) at
+fake_telegram_api.py to exercise the bot locally.
+"""
+
+import http.client
+import json
+import queue
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+DEFAULT_BASE_URL = 'https://api.telegram.org'
+
+
+class TelegramError(Exception):
+    """A failed Bot API call; code is the HTTP status (409, 429...) when there was one."""
+
+    def __init__(self, message, code=None, retry_after=None):
+        super().__init__(message)
+        self.code = code
+        self.retry_after = retry_after
+
+
+class _KeepAlive:
+    """One persistent connection to the API host, reopened when it goes stale."""
+
+    def __init__(self, base_url: str):
+        parts = urlsplit(base_url)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip('/')
+        self.conn = None
+        self.connects = 0
+
+    def _open(self, timeout):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.conn = cls(self.host, self.port, timeout=timeout)
+        self.connects += 1
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+    def post(self, path: str, fields: dict, timeout: float):
+        body = urlencode(fields).encode('utf-8')
+        headers = {'Content-Type': 'application/x-www-form-urlencoded', 'User-Agent': 'schedule-bot',
+                   'Connection': 'keep-alive'}
+        for attempt in (1, 2):
+            reused = self.conn is not None
+            if not reused:
+                self._open(timeout)
+            try:
+                if self.conn.sock is not None:
+                    self.conn.sock.settimeout(timeout)
+                self.conn.timeout = timeout
+                self.conn.request('POST', self.prefix + path, body=body, headers=headers)
+                resp = self.conn.getresponse()
+                raw = resp.read()
+                if resp.getheader('Connection', '').lower() == 'close':
+                    self.close()
+                return resp.status, raw
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                    http.client.BadStatusLine, ConnectionError) as e:
+                # The server dropped an idle keep-alive connection: reconnect once
+                self.close()
+                if attempt == 2 or not reused:
+                    raise TelegramError(f'connection failed: {e}')
+            except Exception:
+                self.close()
+                raise
+
+
+class TelegramClient:
+    def __init__(self, token: str, base_url: str = None, rate_per_sec: float = 25.0,
+                 per_chat_interval: float = 1.0, log=print):
+        self.token = token
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip('/')
+        self.min_interval = 1.0 / rate_per_sec if rate_per_sec > 0 else 0.0
+        self.per_chat_interval = per_chat_interval
+        self.log = log
+        self._poll = _KeepAlive(self.base_url)   # used by the poll thread only
+        self._send = _KeepAlive(self.base_url)   # used by the sender thread only
+        self._call_lock = threading.Lock()       # other one-off calls share the send connection
+        self._outbox = queue.Queue(maxsize=1000)
+        self._sender = None
+        self._sender_lock = threading.Lock()
+        self._last_sent = {}  # chat_id -> monotonic time of last send
+        self.sent = 0
+        self.failed = 0
+
+    # --- raw calls ---
+    def _call(self, conn: _KeepAlive, method: str, fields: dict, timeout: float) -> dict:
+        status, raw = conn.post(f'/bot{self.token}/{method}', fields, timeout)
+        try:
+            data = json.loads(raw.decode('utf-8', errors='replace'))
+        except ValueError:
+            raise TelegramError(f'{method}: bad JSON (HTTP {status}): {raw[:120]!r}', code=status)
+        if status >= 400 or not data.get('ok'):
+            params = data.get('parameters') or {}
+            raise TelegramError(f"{method}: {data.get('description') or status}",
+                                code=data.get('error_code') or status, retry_after=params.get('retry_after'))
+        return data
+
+    def call(self, method: str, fields: dict = None, timeout: float = 15) -> dict:
+        """One-off API call (deleteWebhook, setWebhook, getMe...)."""
+        with self._call_lock:
+            return self._call(self._send, method, fields or {}, timeout)
+
+    # --- polling ---
+    def get_updates(self, offset: int = None, timeout: int = 25, allowed_updates=None) -> dict:
+        """Long poll on the persistent poll connection; returns the whole response."""
+        fields = {'timeout': timeout}
+        if offset:
+            fields['offset'] = offset
+        if allowed_updates:
+            fields['allowed_updates'] = json.dumps(list(allowed_updates))
+        return self._call(self._poll, 'getUpdates', fields, timeout + 10)
+
+    def delete_webhook(self):
+        return self.call('deleteWebhook')
+
+    # --- sending ---
+    def send_message(self, chat_id, text: str, parse_mode: str = None) -> bool:
+        """Queue a message; returns False if the outbox is full."""
+        fields = {'chat_id': chat_id, 'text': text}
+        if parse_mode:
+            fields['parse_mode'] = parse_mode
+        self._ensure_sender()
+        try:
+            self._outbox.put_nowait(fields)
+            return True
+        except queue.Full:
+            self.failed += 1
+            self.log('send queue full, message dropped')
+            return False
+
+    def flush(self, timeout: float = 10) -> bool:
+        """Wait until the outbox is drained (tests, shutdown)."""
+        deadline = time.monotonic() + timeout
+        while self._outbox.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.02)
+        return not self._outbox.unfinished_tasks
+
+    def _ensure_sender(self):
+        if self._sender is None or not self._sender.is_alive():
+            with self._sender_lock:
+                if self._sender is None or not self._sender.is_alive():
+                    self._sender = threading.Thread(target=self._send_loop, name='telegram-send', daemon=True)
+                    self._sender.start()
+
+    def _send_loop(self):
+        last_any = 0.0
+        while True:
+            fields = self._outbox.get()
+            try:
+                chat = str(fields.get('chat_id'))
+                now = time.monotonic()
+                wait = max(last_any + self.min_interval,
+                           self._last_sent.get(chat, 0.0) + self.per_chat_interval) - now
+                if wait > 0:
+                    time.sleep(wait)
+                for attempt in range(3):
+                    try:
+                        with self._call_lock:
+                            self._call(self._send, 'sendMessage', fields, 15)
+                        self.sent += 1
+                        break
+                    except TelegramError as e:
+                        if e.code == 429 and attempt < 2:
+                            time.sleep(float(e.retry_after or 1))
+                            continue
+                        self.failed += 1
+                        self.log(f'send message error: {e}')
+                        break
+                    except Exception as e:
+                        self.failed += 1
+                        self.log(f'send message error: {e}')
+                        break
+                last_any = self._last_sent[chat] = time.monotonic()
+            finally:
+                self._outbox.task_done()
+
+    def stats(self) -> dict:
+        return {'poll_connects': self._poll.connects, 'send_connects': self._send.connects,
+                'queued': self._outbox.qsize(), 'sent': self.sent, 'failed': self.failed}
+
+    def close(self):
+        self._poll.close()
+        with self._call_lock:
+            self._send.close()